@@ -0,0 +1,30 @@
+"""
+Engine performance benchmarks
+Run as modules from the app directory, e.g. python -m benchmarks.scoring
+"""
+import os
+from contextlib import contextmanager
+import django
+
+
+def setup_django():
+    """
+    Configure django so that engine modules can be imported outside of manage.py
+    """
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings.local')
+    django.setup()
+
+
+@contextmanager
+def benchmark_database(keepdb=False):
+    """
+    Run with a test database created from the configured database settings (e.g. test_<name> on PostgreSQL),
+    destroyed afterwards unless keepdb is True
+    :param keepdb: bool, keep the database, and reuse it if it exists
+    """
+    from django.db import connection
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, keepdb=keepdb)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=keepdb)
@@ -0,0 +1,188 @@
+"""
+Benchmark recommend and score (mastery update) latency on a large Score table, with and without the composite
+indexes and unique constraints of hot-path tables (Score(learner, timestamp), Score(learner, activity),
+Mastery(learner, knowledge_component))
+
+Runs against a test database created from the configured database settings (e.g. test_<name> on PostgreSQL), which
+is destroyed afterwards unless --keepdb is given; a kept database is reused without regenerating data.
+
+Usage:
+    python -m benchmarks.indexes [--scores 10000000] [--learners 10000] [--activities 1000] [--kcs 50]
+        [--trials 50] [--keepdb]
+"""
+import argparse
+import datetime
+import time
+import numpy as np
+from benchmarks import benchmark_database, setup_django
+
+setup_django()
+
+from django.db import connection, transaction  # noqa: E402
+from django.utils import timezone  # noqa: E402
+from engine.engines import AdaptiveEngine, get_engine  # noqa: E402
+from engine.models import (  # noqa: E402
+    Activity, ActivityKCParameter, Collection, KnowledgeComponent, Learner, Mastery, Score)
+
+
+# number of rows per insert statement when generating data
+INSERT_BATCH_SIZE = 10000
+
+
+def insert_rows(model, fields, rows):
+    """
+    Insert rows with executemany, bypassing model instantiation
+    :param model: model class
+    :param fields: list of column names
+    :param rows: iterable of row tuples
+    """
+    sql = 'INSERT INTO {} ({}) VALUES ({})'.format(
+        connection.ops.quote_name(model._meta.db_table),
+        ', '.join(connection.ops.quote_name(field) for field in fields),
+        ', '.join(['%s'] * len(fields)),
+    )
+    batch = []
+    with connection.cursor() as cursor:
+        for row in rows:
+            batch.append(row)
+            if len(batch) == INSERT_BATCH_SIZE:
+                cursor.executemany(sql, batch)
+                batch = []
+        if batch:
+            cursor.executemany(sql, batch)
+
+
+def generate_data(n_scores, n_learners, n_activities, n_kcs, seed=0):
+    """
+    Populate a collection of activities tagged with one or two KCs each, with parameters, learner masteries and
+    random scores
+    """
+    rng = np.random.RandomState(seed)
+    with transaction.atomic():
+        collection = Collection.objects.create(collection_id='benchmark', name='benchmark')
+        KnowledgeComponent.objects.bulk_create([
+            KnowledgeComponent(kc_id='kc{}'.format(i), name='kc{}'.format(i), mastery_prior=0.1)
+            for i in range(n_kcs)
+        ])
+        Activity.objects.bulk_create([
+            Activity(url='http://example.com/{}'.format(i), name='activity{}'.format(i), difficulty=rng.rand())
+            for i in range(n_activities)
+        ])
+        Learner.objects.bulk_create([
+            Learner(user_id='learner{}'.format(i), tool_consumer_instance_guid='benchmark') for i in range(n_learners)
+        ])
+        activity_pks = list(Activity.objects.order_by('pk').values_list('pk', flat=True))
+        kc_pks = list(KnowledgeComponent.objects.order_by('pk').values_list('pk', flat=True))
+        learner_pks = list(Learner.objects.order_by('pk').values_list('pk', flat=True))
+        collection.activity_set.add(*activity_pks)
+
+        tagging = {(activity_pk, kc_pks[j]) for activity_pk in activity_pks
+                   for j in rng.choice(n_kcs, size=rng.randint(1, 3), replace=False)}
+        Activity.knowledge_components.through.objects.bulk_create([
+            Activity.knowledge_components.through(activity_id=activity_pk, knowledgecomponent_id=kc_pk)
+            for activity_pk, kc_pk in tagging
+        ], batch_size=INSERT_BATCH_SIZE)
+        ActivityKCParameter.objects.bulk_create([
+            ActivityKCParameter(activity_id=activity_pk, knowledge_component_id=kc_pk, guess=rng.uniform(0.05, 0.3),
+                                slip=rng.uniform(0.05, 0.3), transit=rng.uniform(0.05, 0.3))
+            for activity_pk, kc_pk in tagging
+        ], batch_size=INSERT_BATCH_SIZE)
+        insert_rows(Mastery, ['learner_id', 'knowledge_component_id', 'value'], (
+            (learner_pk, kc_pk, float(value))
+            for learner_pk in learner_pks
+            for kc_pk, value in zip(kc_pks, rng.uniform(0.05, 0.95, n_kcs))
+        ))
+
+    # scores in increasing timestamp order, one per second
+    start = timezone.now() - datetime.timedelta(seconds=n_scores)
+    for offset in range(0, n_scores, INSERT_BATCH_SIZE * 10):
+        size = min(INSERT_BATCH_SIZE * 10, n_scores - offset)
+        learners = rng.choice(learner_pks, size=size).tolist()
+        activities = rng.choice(activity_pks, size=size).tolist()
+        scores = rng.rand(size).round(3).tolist()
+        with transaction.atomic():
+            insert_rows(Score, ['learner_id', 'activity_id', 'score', 'timestamp'], (
+                (learners[i], activities[i], scores[i], start + datetime.timedelta(seconds=offset + i))
+                for i in range(size)
+            ))
+    if connection.vendor in ('postgresql', 'sqlite'):
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+
+def set_indexes(enabled):
+    """
+    Create or drop Score indexes and the Mastery unique constraint defined on the models
+    """
+    with connection.schema_editor() as schema_editor:
+        for index in Score._meta.indexes:
+            if enabled:
+                schema_editor.add_index(Score, index)
+            else:
+                schema_editor.remove_index(Score, index)
+        unique_together = Mastery._meta.unique_together
+        if enabled:
+            schema_editor.alter_unique_together(Mastery, [], unique_together)
+        else:
+            schema_editor.alter_unique_together(Mastery, unique_together, [])
+    if connection.vendor in ('postgresql', 'sqlite'):
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+
+def time_hot_paths(engine, collection, learners, activities):
+    """
+    Median wall time of recommend and of score handling (score insert and mastery update), in milliseconds
+    """
+    recommend_times, score_times = [], []
+    for learner, activity in zip(learners, activities):
+        start = time.perf_counter()
+        engine.recommend(learner, collection)
+        recommend_times.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        with transaction.atomic():
+            Score.objects.create(learner=learner, activity=activity, score=1.0)
+            engine.update_from_score(learner, activity, 1.0)
+        score_times.append(time.perf_counter() - start)
+    return 1000 * np.median(recommend_times), 1000 * np.median(score_times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scores', type=int, default=10000000)
+    parser.add_argument('--learners', type=int, default=10000)
+    parser.add_argument('--activities', type=int, default=1000)
+    parser.add_argument('--kcs', type=int, default=50)
+    parser.add_argument('--trials', type=int, default=50)
+    parser.add_argument('--keepdb', action='store_true', help='keep (and reuse) the benchmark database')
+    args = parser.parse_args()
+
+    with benchmark_database(args.keepdb):
+        if not Score.objects.exists():
+            start = time.perf_counter()
+            generate_data(args.scores, args.learners, args.activities, args.kcs)
+            print('generated {} scores in {:.1f}s'.format(Score.objects.count(), time.perf_counter() - start))
+
+        # recompute scores from the database on each call, so that parameter and mastery reads are measured
+        engine = AdaptiveEngine(get_engine().engine_settings, incremental_scores=False)
+        collection = Collection.objects.get(collection_id='benchmark')
+        rng = np.random.RandomState(1)
+        learner_pks = list(Learner.objects.values_list('pk', flat=True))
+        learners = list(Learner.objects.filter(pk__in=rng.choice(learner_pks, size=args.trials).tolist()))
+        activities = list(collection.activity_set.order_by('?')[:len(learners)])
+
+        print('{:>10} {:>14} {:>12}'.format('indexes', 'recommend_ms', 'score_ms'))
+        for enabled in (True, False):
+            if not enabled:
+                set_indexes(False)
+            try:
+                recommend_ms, score_ms = time_hot_paths(engine, collection, learners, activities)
+            finally:
+                if not enabled:
+                    set_indexes(True)
+            print('{:>10} {:>14.3f} {:>12.3f}'.format('yes' if enabled else 'no', recommend_ms, score_ms))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+"""
+Benchmark pruned recommendation (score upper bounds, see engine.sparse.pruned_recommendation) against exact scoring
+of all candidate activities: latency, fraction of candidates scored, and agreement with the exact top activity
+
+Usage:
+    python -m benchmarks.pruning [--kcs 200] [--density 0.02] [--trials 20] [--learned 0.1]
+        [--sizes 1000 10000 100000] [--epsilons 0 0.5 2]
+"""
+import argparse
+import time
+import numpy as np
+from benchmarks import setup_django
+
+setup_django()
+
+from alosi.engine import odds  # noqa: E402
+from engine.engines import GUESS_DEFAULT, SLIP_DEFAULT  # noqa: E402
+from engine.sparse import CSRMatrix, sparse_relevance, sparse_recommendation_score, pruned_recommendation  # noqa: E402
+
+
+def random_sparse_params(n_activities, n_kcs, density, seed=0):
+    """
+    Random sparse recommendation parameters, with engine default weights
+    :return: dict of sparse_recommendation_score keyword arguments, without learner_mastery
+    """
+    rng = np.random.RandomState(seed)
+    nnz = int(n_activities * n_kcs * density)
+    rows, cols = rng.randint(n_activities, size=nnz), rng.randint(n_kcs, size=nnz)
+    shape = (n_activities, n_kcs)
+    relevance = sparse_relevance(
+        shape,
+        (rows, cols),
+        (rows, cols, rng.uniform(0.05, 0.3, nnz)),
+        (rows, cols, rng.uniform(0.05, 0.3, nnz)),
+        GUESS_DEFAULT,
+        SLIP_DEFAULT,
+    )
+    n_prereqs = n_kcs * 2
+    prereqs = CSRMatrix.from_triples(
+        rng.randint(n_kcs, size=n_prereqs), rng.randint(n_kcs, size=n_prereqs), rng.rand(n_prereqs), (n_kcs, n_kcs)
+    )
+    return dict(
+        relevance=relevance,
+        prereqs=prereqs,
+        r_star=0.0,
+        L_star=float(np.log(odds(0.9))),
+        difficulty=rng.rand(n_activities),
+        W_p=2.0,
+        W_r=2.0,
+        W_d=0.5,
+        W_c=1.0,
+        last_attempted_relevance=relevance.getrow(0),
+    )
+
+
+def random_learner_mastery(rng, n_kcs, learned, prior=0.1):
+    """
+    Learner mastery at prior, except for a random fraction of kcs that the learner has worked on
+    """
+    learner_mastery = np.full(n_kcs, prior)
+    kcs = rng.rand(n_kcs) < learned
+    learner_mastery[kcs] = rng.beta(2, 2, kcs.sum())
+    return learner_mastery
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--kcs', type=int, default=200)
+    parser.add_argument('--density', type=float, default=0.02)
+    parser.add_argument('--trials', type=int, default=20)
+    parser.add_argument('--learned', type=float, default=0.1, help='fraction of kcs with mastery above prior')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--epsilons', type=float, nargs='+', default=[0.0, 0.5, 2.0])
+    args = parser.parse_args()
+
+    print('{:>10} {:>8} {:>12} {:>12} {:>10} {:>10}'.format(
+        'activities', 'epsilon', 'exact_ms', 'pruned_ms', 'scored', 'agreement'))
+    for n_activities in args.sizes:
+        params = random_sparse_params(n_activities, args.kcs, args.density)
+        # row indices, row sums and transpose are cached with collection parameters in the engine
+        params['relevance'].row_sums
+        params['relevance_columns'] = params['relevance'].transpose()
+        rng = np.random.RandomState(1)
+        masteries = [random_learner_mastery(rng, args.kcs, args.learned) for i in range(args.trials)]
+        exact_times, exact_scores = [], []
+        for learner_mastery in masteries:
+            start = time.perf_counter()
+            scores = sparse_recommendation_score(
+                learner_mastery=learner_mastery, **{k: v for k, v in params.items() if k != 'relevance_columns'})
+            scores.argmax()
+            exact_times.append(time.perf_counter() - start)
+            exact_scores.append(scores)
+        for epsilon in args.epsilons:
+            times, scored, agreement = [], [], []
+            for learner_mastery, scores in zip(masteries, exact_scores):
+                start = time.perf_counter()
+                indices, score, n_scored = pruned_recommendation(
+                    learner_mastery=learner_mastery, epsilon=epsilon, **params)
+                times.append(time.perf_counter() - start)
+                scored.append(n_scored / n_activities)
+                # pruned result agrees if it is a top activity of the exact scores
+                agreement.append(scores[indices[0]] == scores.max())
+            print('{:>10} {:>8} {:>12.3f} {:>12.3f} {:>10.3f} {:>10.2f}'.format(
+                n_activities, epsilon, 1000 * np.median(exact_times), 1000 * np.median(times), np.mean(scored),
+                np.mean(agreement)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+"""
+Benchmark recommendation score functions on random parameters, at increasing numbers of candidate activities
+
+Usage:
+    python -m benchmarks.scoring [--kcs 50] [--density 0.05] [--repeat 20] [--sizes 100 1000 10000]
+"""
+import argparse
+import logging
+import time
+import numpy as np
+from benchmarks import setup_django
+
+setup_django()
+
+from alosi.engine import recommendation_score  # noqa: E402
+from engine.engines import recommendation_score_kernel, numba  # noqa: E402
+
+
+# alosi.engine.recommendation_score builds a QxQ intermediate for substrategy D; skip it above this size
+REFERENCE_MAX_ACTIVITIES = 2000
+
+
+def random_params(n_activities, n_kcs, density, seed=0):
+    """
+    Random recommendation parameters for n_activities candidate activities and n_kcs KCs
+    :return: dict of recommendation_score keyword arguments
+    """
+    rng = np.random.RandomState(seed)
+    tagging = rng.rand(n_activities, n_kcs) < density
+    guess = np.where(tagging, rng.uniform(0.05, 0.3, (n_activities, n_kcs)), np.nan)
+    slip = np.where(tagging, rng.uniform(0.05, 0.3, (n_activities, n_kcs)), np.nan)
+    return dict(
+        guess=guess,
+        slip=slip,
+        learner_mastery=rng.rand(n_kcs),
+        prereqs=np.where(rng.rand(n_kcs, n_kcs) < density, rng.rand(n_kcs, n_kcs), np.nan),
+        r_star=0.0,
+        L_star=2.2,
+        difficulty=rng.rand(n_activities),
+        W_p=5.0,
+        W_r=3.0,
+        W_d=1.0,
+        W_c=1.0,
+        last_attempted_guess=guess[0],
+        last_attempted_slip=slip[0],
+    )
+
+
+def time_function(function, params, repeat):
+    """
+    Median wall time of function(**params) over repeat calls, in milliseconds
+    Array arguments are copied before each call since some score functions modify inputs in place
+    """
+    timings = []
+    for i in range(repeat):
+        call_params = {k: np.copy(v) if isinstance(v, np.ndarray) else v for k, v in params.items()}
+        start = time.perf_counter()
+        function(**call_params)
+        timings.append(time.perf_counter() - start)
+    return 1000 * np.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--kcs', type=int, default=50)
+    parser.add_argument('--density', type=float, default=0.05)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 10000])
+    args = parser.parse_args()
+    # alosi.engine logs subscore arrays at debug level
+    logging.disable(logging.DEBUG)
+
+    functions = [
+        ('alosi', recommendation_score),
+        ('kernel_float64', lambda **p: recommendation_score_kernel(**p, use_numba=False)),
+        ('kernel_float32', lambda **p: recommendation_score_kernel(**p, dtype=np.float32, use_numba=False)),
+    ]
+    if numba is not None:
+        functions.append(('kernel_numba', lambda **p: recommendation_score_kernel(**p, use_numba=True)))
+
+    print('{:>10} {:>16} {:>12}'.format('activities', 'function', 'median_ms'))
+    for n_activities in args.sizes:
+        params = random_params(n_activities, args.kcs, args.density)
+        for name, function in functions:
+            if name == 'alosi' and n_activities > REFERENCE_MAX_ACTIVITIES:
+                print('{:>10} {:>16} {:>12}'.format(n_activities, name, 'skipped'))
+                continue
+            # warm up (numba compilation, workspace allocation)
+            function(**{k: np.copy(v) if isinstance(v, np.ndarray) else v for k, v in params.items()})
+            print('{:>10} {:>16} {:>12.3f}'.format(n_activities, name, time_function(function, params, args.repeat)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,230 @@
+"""
+Engine benchmark suite: latency percentiles, query counts and peak memory of engine operations (recommend,
+update_from_score, grade, utils.estimate) and of the main API endpoints (through DRF's test client), for each
+combination of catalog size, KC count, collection size and learner history length
+
+Data is generated in a test database (see benchmarks.benchmark_database) with engine.simulation. Results are written
+as JSON, and can be compared against a stored baseline; the exit status is 1 if the median latency of any operation
+regressed by more than the tolerance.
+
+Usage:
+    python -m benchmarks.suite [--activities 1000 10000] [--kcs 50] [--collection-sizes 100] [--history 20]
+        [--learners 200] [--trials 30] [--estimate-trials 1] [--operations recommend grade ...]
+        [--output results.json] [--baseline baseline.json] [--tolerance 0.25]
+
+Example (local PostgreSQL):
+    DJANGO_SETTINGS_MODULE=config.settings.local python -m benchmarks.suite --activities 1000 10000 100000 \
+        --output benchmarks.json
+"""
+import argparse
+import itertools
+import json
+import logging
+import platform
+import sys
+import time
+import tracemalloc
+from collections import OrderedDict
+import numpy as np
+from benchmarks import benchmark_database, setup_django
+
+setup_django()
+
+from django.contrib.auth.models import User  # noqa: E402
+from django.core.management import call_command  # noqa: E402
+from django.db import connection  # noqa: E402
+from django.test.utils import CaptureQueriesContext, setup_test_environment  # noqa: E402
+from rest_framework.test import APIClient  # noqa: E402
+from engine import utils  # noqa: E402
+from engine.caches import (  # noqa: E402
+    activity_url_index, learner_cache, nonadaptive_sequence_cache, score_vector_cache)
+from engine.engines import get_engine  # noqa: E402
+from engine.models import Collection, Learner  # noqa: E402
+from engine.registry import engine_registry  # noqa: E402
+from engine.simulation.synthetic import generate_synthetic_data  # noqa: E402
+
+
+# configuration fields, in result key order
+CONFIG_FIELDS = ('activities', 'kcs', 'collection_size', 'history')
+PERCENTILES = (50, 90, 99)
+
+
+def generate_config_data(config, n_learners, kcs_per_activity, seed):
+    """
+    Replace database contents with synthetic data for a benchmark configuration
+    """
+    call_command('flush', interactive=False, verbosity=0)
+    # process-local caches refer to flushed rows
+    for cache in (activity_url_index, learner_cache, score_vector_cache, nonadaptive_sequence_cache, engine_registry):
+        cache.clear()
+    generate_synthetic_data(
+        n_activities=config['activities'],
+        n_kcs=config['kcs'],
+        kcs_per_activity=kcs_per_activity,
+        n_collections=max(1, config['activities'] // config['collection_size']),
+        prerequisite_density=0.01,
+        n_learners=n_learners,
+        scores_per_learner=config['history'],
+        seed=seed,
+        prefix='benchmark',
+    )
+
+
+def learner_data(learner):
+    return {'user_id': learner.user_id, 'tool_consumer_instance_guid': learner.tool_consumer_instance_guid}
+
+
+def get_operations(trials, seed):
+    """
+    Benchmarked operations, as name -> function of trial index
+    Trial i uses the i-th of a random sample of learners, with a random activity of the first collection.
+    """
+    rng = np.random.RandomState(seed)
+    engine = get_engine()
+    collection = Collection.objects.order_by('pk').first()
+    learners = list(Learner.objects.order_by('pk'))
+    learners = [learners[i] for i in rng.randint(len(learners), size=trials)]
+    activities = list(collection.activity_set.order_by('pk'))
+    activities = [activities[i] for i in rng.randint(len(activities), size=trials)]
+
+    client = APIClient()
+    client.force_authenticate(User.objects.create_superuser('benchmark', 'benchmark@example.com', 'benchmark'))
+
+    def api_post(url, data):
+        response = client.post(url, data, format='json')
+        assert response.status_code < 400, response.content
+        return response
+
+    return OrderedDict([
+        ('recommend', lambda i: engine.recommend(learners[i], collection)),
+        ('update_from_score', lambda i: engine.update_from_score(learners[i], activities[i], float(i % 2))),
+        ('grade', lambda i: engine.grade(learners[i], collection)),
+        ('estimate', lambda i: utils.estimate()),
+        ('api_recommend', lambda i: api_post('/api/v2/activity/recommend', {
+            'learner': learner_data(learners[i]), 'collection': collection.collection_id, 'sequence': []})),
+        ('api_score', lambda i: api_post('/api/v2/score', {
+            'learner': learner_data(learners[i]), 'activity': activities[i].url, 'score': float(i % 2)})),
+        ('api_grade', lambda i: api_post('/api/v2/collection/{}/grade'.format(collection.collection_id), {
+            'learner': learner_data(learners[i])})),
+    ])
+
+
+def measure(function, trials):
+    """
+    Run function(i) for i in range(trials), after an untimed warm-up call
+    Peak memory is measured with tracemalloc in a separate call, so that tracing does not affect latencies.
+    :return: dict of latency percentiles (ms), query counts and peak memory (KiB) of Python allocations
+    """
+    function(0)
+    latencies, queries = [], []
+    for i in range(trials):
+        with CaptureQueriesContext(connection) as context:
+            start = time.perf_counter()
+            function(i)
+            latencies.append(1000 * (time.perf_counter() - start))
+        queries.append(len(context.captured_queries))
+    tracemalloc.start()
+    try:
+        function(0)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return OrderedDict([
+        ('trials', trials),
+        ('latency_ms', OrderedDict(
+            [('p{}'.format(q), float(np.percentile(latencies, q))) for q in PERCENTILES] +
+            [('mean', float(np.mean(latencies)))]
+        )),
+        ('queries', OrderedDict([('mean', float(np.mean(queries))), ('max', int(np.max(queries)))])),
+        ('peak_memory_kb', peak / 1024),
+    ])
+
+
+def result_key(result):
+    return tuple(result[field] for field in CONFIG_FIELDS) + (result['operation'],)
+
+
+def compare(results, baseline, tolerance):
+    """
+    Compare median latencies with a baseline
+    :param results: list of result dicts
+    :param baseline: list of result dicts
+    :param tolerance: float, allowed relative increase of median latency
+    :return: list of (result, baseline result, ratio, regressed) tuples, for results with a matching baseline result
+    """
+    baseline = {result_key(result): result for result in baseline}
+    comparisons = []
+    for result in results:
+        base = baseline.get(result_key(result))
+        if base is not None:
+            ratio = result['latency_ms']['p50'] / max(base['latency_ms']['p50'], 1e-9)
+            comparisons.append((result, base, ratio, ratio > 1 + tolerance))
+    return comparisons
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--activities', type=int, nargs='+', default=[1000, 10000])
+    parser.add_argument('--kcs', type=int, nargs='+', default=[50])
+    parser.add_argument('--collection-sizes', type=int, nargs='+', default=[100])
+    parser.add_argument('--history', type=int, nargs='+', default=[20], help='scores per learner')
+    parser.add_argument('--learners', type=int, default=200)
+    parser.add_argument('--kcs-per-activity', type=int, default=2)
+    parser.add_argument('--trials', type=int, default=30)
+    parser.add_argument('--estimate-trials', type=int, default=1, help='trials of utils.estimate (full recalibration)')
+    parser.add_argument('--operations', nargs='+', default=None, help='operations to run (default: all)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=None, help='path of JSON results file')
+    parser.add_argument('--baseline', default=None, help='path of JSON results file to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed relative increase of median latency')
+    parser.add_argument('--keepdb', action='store_true', help='keep the benchmark database')
+    args = parser.parse_args()
+
+    setup_test_environment()
+    # debug logging of request handling (see config.settings.local) would be included in latencies
+    logging.disable(logging.INFO)
+    results = []
+    print('{:>10} {:>6} {:>10} {:>8} {:>18} {:>10} {:>10} {:>10} {:>9} {:>10}'.format(
+        *CONFIG_FIELDS, 'operation', 'p50_ms', 'p90_ms', 'p99_ms', 'queries', 'peak_kb'))
+    with benchmark_database(args.keepdb):
+        for values in itertools.product(args.activities, args.kcs, args.collection_sizes, args.history):
+            config = OrderedDict(zip(CONFIG_FIELDS, values))
+            generate_config_data(config, args.learners, args.kcs_per_activity, args.seed)
+            for name, function in get_operations(args.trials, args.seed).items():
+                if args.operations and name not in args.operations:
+                    continue
+                result = OrderedDict(config, operation=name)
+                result.update(measure(function, args.estimate_trials if name == 'estimate' else args.trials))
+                results.append(result)
+                print('{:>10} {:>6} {:>10} {:>8} {:>18} {:>10.2f} {:>10.2f} {:>10.2f} {:>9.1f} {:>10.0f}'.format(
+                    *values, name, *[result['latency_ms']['p{}'.format(q)] for q in PERCENTILES],
+                    result['queries']['mean'], result['peak_memory_kb']))
+
+    output = OrderedDict([
+        ('environment', OrderedDict([
+            ('database', connection.vendor),
+            ('python', platform.python_version()),
+            ('numpy', np.__version__),
+            ('learners', args.learners),
+            ('kcs_per_activity', args.kcs_per_activity),
+        ])),
+        ('results', results),
+    ])
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(output, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            comparisons = compare(results, json.load(f)['results'], args.tolerance)
+        print('\ncomparison with baseline (median latency)')
+        for result, base, ratio, regressed in comparisons:
+            print('{:>40} {:>18} {:>10.2f} {:>10.2f} {:>7.2f}x {}'.format(
+                ' '.join(str(result[field]) for field in CONFIG_FIELDS), result['operation'],
+                base['latency_ms']['p50'], result['latency_ms']['p50'], ratio, 'REGRESSION' if regressed else ''))
+        if any(regressed for result, base, ratio, regressed in comparisons):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -24,7 +24,7 @@ admin.site.register(KnowledgeComponent)
 admin.site.register(EngineSettings)
 admin.site.register(ExperimentalGroup)
 admin.site.register(PrerequisiteRelation)
-admin.site.register(Guess)
-admin.site.register(Slip)
-admin.site.register(Transit)
+admin.site.register(ActivityKCParameter)
+admin.site.register(ParameterVersion)
 admin.site.register(Mastery)
+admin.site.register(LearnerSequence)
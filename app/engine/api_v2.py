@@ -1,16 +1,70 @@
+import io
 import logging
+from collections import OrderedDict
+import numpy as np
 from rest_framework import viewsets
 from rest_framework.response import Response
 from rest_framework.decorators import action
 from rest_framework import status
+from rest_framework.exceptions import NotFound
+from django.db import transaction
+from django.shortcuts import get_object_or_404
 from .serializers import *
 from .models import *
-from .engines import get_engine
+from .registry import engine_registry
+from .caches import activity_url_index, learner_cache, score_vector_cache
+from .bulk import replace_tagging
+from .engines import get_kcs_in_activity_set, get_mastery_matrix
+from .renderers import NpyRenderer, NpzRenderer, NDJSONRenderer, CSVRenderer, array_renderer_classes
+from .parameters import (PARAMETER_MODELS, TRIPLE_FIELDS, ParameterImportError, get_parameter_queryset, export_dense,
+                         read_parameter_file, import_parameters)
+from .pagination import CursorOrLimitOffsetPagination
+from .export import export_response
 
 
 log = logging.getLogger(__name__)
 
 
+def parse_sequence(sequence_data, deferred=False):
+    """
+    Resolve activities referenced in sequence data from a recommendation request
+    Unknown activities are logged and skipped
+    :param sequence_data: list of validated sequence item dicts (from SequenceActivitySerializer)
+    :param deferred: bool, whether indexed activities are resolved without a query (see ActivityUrlIndex.resolve_many)
+    :return: list of (Activity model instance, score) tuples
+    """
+    activities = activity_url_index.resolve_many([activity_data['url'] for activity_data in sequence_data],
+                                                 deferred=deferred)
+    sequence = []
+    for activity_data in sequence_data:
+        activity = activities.get(activity_data['url'])
+        if activity is None:
+            log.error("Unknown activity found in sequence data: {}".format(activity_data))
+            continue
+        sequence.append((activity, activity_data['score']))
+    return sequence
+
+
+class ExportMixin(object):
+    """
+    Adds streaming export endpoint to a viewset
+    Subclasses define export_fields, a dict of output field name -> queryset field lookup.
+    """
+    export_fields = None
+
+    @action(methods=['get'], detail=False, renderer_classes=[NDJSONRenderer, CSVRenderer])
+    def export(self, request):
+        """
+        Streams all (filtered) objects, ordered by id, as newline-delimited JSON (default) or CSV.
+        Format is selected by Accept header (application/x-ndjson, text/csv) or "format" query parameter
+        (ndjson, csv). List filters apply.
+
+        GET /{resource}/export
+        """
+        queryset = self.filter_queryset(self.get_queryset()).order_by('pk')
+        return export_response(queryset, self.export_fields, request.accepted_renderer.format, self.basename)
+
+
 class ActivityViewSet(viewsets.ModelViewSet):
     """
     Activity-related API endpoints
@@ -25,6 +79,8 @@ class ActivityViewSet(viewsets.ModelViewSet):
 
     Additional endpoints:
         POST /activity/recommend - recommend activity
+        GET /activity/tagging - get activity-KC tagging as sparse matrix
+        PUT /activity/tagging - replace activity-KC tagging in bulk
     """
     queryset = Activity.objects.all()
     serializer_class = ActivitySerializer
@@ -54,6 +110,29 @@ class ActivityViewSet(viewsets.ModelViewSet):
                 ]
 
             }
+
+        Server-side sequence mode: omit "sequence" and the engine uses the sequence it has recorded for the
+        learner/collection (recommended activities are appended to it, and scores are recorded on its items).
+        Request Body:
+            {
+                learner: {...}
+                collection: <str>
+                sequence_version: <int>, optional - version from the last recommendation response
+                sequence_delta: [...], optional - sequence items added since sequence_version
+            }
+        Response includes "sequence_version"; if the provided sequence_version does not match the server,
+        a 409 response with the current server sequence_version is returned.
+
+        Optional "top_n": <int> in the request adds a ranked list of the n best activities to the response,
+        so that the bridge can prefetch them and fall back to the next best activity locally:
+            {
+                source_launch_url: <str>,  (top activity)
+                complete: false,
+                recommendations: [
+                    {source_launch_url: <str>, score: <float>},
+                    ...
+                ]
+            }
         """
         log.debug("Received recommendation request data (request.data): {}".format(request.data))
         # validate request serializer
@@ -64,36 +143,168 @@ class ActivityViewSet(viewsets.ModelViewSet):
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
         # get learner (creation of learner is supported here if learner does not already exist)
-        learner, created = Learner.objects.get_or_create(**serializer.data['learner'])
+        learner, created = learner_cache.get_or_create(**serializer.data['learner'])
 
         # get collection
         collection = serializer.validated_data['collection']
 
-        # parse sequence data
-        sequence_data = serializer.validated_data['sequence']
-        sequence = []
-        for activity_data in sequence_data:
-            try:
-                sequence.append(Activity.objects.get(url=activity_data['url']))
-            except Activity.DoesNotExist:
-                log.error("Unknown activity found in sequence data: {}".format(activity_data))
-        log.debug("Parsed sequence: {}".format(sequence))
-        # get recommendation from engine
-        recommended_activity = get_engine().recommend(learner, collection, sequence)
-
-        # construct response data
-        if recommended_activity:
-            recommendation_data = ActivityRecommendationSerializer(recommended_activity).data
-            recommendation_data['complete'] = False
+        with transaction.atomic():
+            # parse sequence data
+            sequence_data = serializer.validated_data.get('sequence')
+            if sequence_data is not None:
+                learner_sequence = None
+                # sequence history is only used to exclude activities by pk
+                sequence = [activity for activity, score in parse_sequence(sequence_data, deferred=True)]
+            else:
+                # server-side sequence mode
+                # the sequence row is locked until the recommended activity is appended, so that concurrent requests
+                # for the same sequence are applied one after the other
+                learner_sequence, created = LearnerSequence.objects.select_for_update().get_or_create(
+                    learner=learner, collection=collection)
+                sequence_version = serializer.validated_data.get('sequence_version')
+                if sequence_version is not None and sequence_version != learner_sequence.version:
+                    return Response(
+                        {'detail': 'sequence_version does not match server',
+                         'sequence_version': learner_sequence.version},
+                        status=status.HTTP_409_CONFLICT
+                    )
+                delta = parse_sequence(serializer.validated_data.get('sequence_delta', []))
+                if delta:
+                    activities, scores = zip(*delta)
+                    learner_sequence.extend(list(activities), list(scores))
+                sequence = learner_sequence.activities()
+            log.debug("Parsed sequence: {}".format(sequence))
+            # get recommendation from engine
+            engine = engine_registry.get_engine_for_learner(learner)
+            top_n = serializer.validated_data.get('top_n')
+            if top_n is not None:
+                ranked = engine.recommend_top_n(learner, collection, top_n, sequence)
+                recommended_activity = ranked[0][0] if ranked else None
+            else:
+                recommended_activity = engine.recommend(learner, collection, sequence)
+
+            # construct response data
+            if recommended_activity:
+                recommendation_data = ActivityRecommendationSerializer(recommended_activity).data
+                recommendation_data['complete'] = False
+                if top_n is not None:
+                    for activity, score in ranked:
+                        activity.score = score
+                    recommendation_data['recommendations'] = RankedActivityRecommendationSerializer(
+                        [activity for activity, score in ranked], many=True).data
+                if learner_sequence is not None:
+                    learner_sequence.extend([recommended_activity])
+            else:
+                # Indicate that learner is done with sequence
+                recommendation_data = dict(
+                    collection=collection.collection_id,
+                    url=None,
+                    complete=True,
+                )
+        if learner_sequence is not None:
+            recommendation_data['sequence_version'] = learner_sequence.version
+
+        return Response(recommendation_data)
+
+    @action(methods=['get', 'put'], detail=False)
+    def tagging(self, request):
+        """
+        Handles two API endpoints:
+
+        1. Get activity-KC tagging as a sparse matrix
+            GET /activity/tagging[?collection=<collection_id>]
+
+            Response Body:
+                {
+                    activity_urls: [<str>, ...],
+                    kc_ids: [<str>, ...],
+                    rows: [<int>, ...],  (index into activity_urls)
+                    cols: [<int>, ...],  (index into kc_ids)
+                }
+            Activities are ordered by pk, and include untagged activities; if collection is specified, only
+            activities in the collection are included.
+
+        2. Replace tagging of activities in bulk
+            PUT /activity/tagging
+
+            Request Body:
+                {
+                    pairs: [[<activity url>, <kc_id>], ...]
+                }
+                or
+                {
+                    matrix: {activity_urls: [...], kc_ids: [...], rows: [...], cols: [...]}  (as returned by GET)
+                }
+                optionally with
+                    collection: <collection_id>
+
+            Tagging of every activity in the request (in pairs, or in matrix activity_urls), and of every activity in
+            collection if specified, is replaced by the requested tagging: missing tags are added and tags not in the
+            request are removed. Other activities are not changed. Changes are applied with bulk inserts and deletes
+            in one transaction.
+
+            Response Body:
+                {
+                    created: <int>, number of added activity-KC tags
+                    deleted: <int>, number of removed activity-KC tags
+                }
+            Returns 400 if the request references unknown activities or knowledge components.
+        """
+        if request.method == 'GET':
+            activities = Activity.objects.order_by('pk')
+            if 'collection' in request.query_params:
+                collection = get_object_or_404(Collection, collection_id=request.query_params['collection'])
+                activities = activities.filter(collections=collection)
+            activity_urls = OrderedDict(activities.values_list('pk', 'url'))
+            activity_map = {pk: i for i, pk in enumerate(activity_urls)}
+            tagging = Activity.knowledge_components.through.objects.filter(activity__in=activities).order_by(
+                'activity_id', 'knowledgecomponent_id').values_list('activity_id', 'knowledgecomponent_id')
+            kc_ids = OrderedDict(KnowledgeComponent.objects.order_by('pk').values_list('pk', 'kc_id'))
+            kc_map = {pk: i for i, pk in enumerate(kc_ids)}
+            rows, cols = [], []
+            for activity_pk, kc_pk in tagging:
+                rows.append(activity_map[activity_pk])
+                cols.append(kc_map[kc_pk])
+            return Response({
+                'activity_urls': list(activity_urls.values()),
+                'kc_ids': list(kc_ids.values()),
+                'rows': rows,
+                'cols': cols,
+            })
+
+        serializer = TaggingRequestSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        data = serializer.validated_data
+        if 'pairs' in data:
+            url_pairs = [tuple(pair) for pair in data['pairs']]
+            urls = [url for url, kc_id in url_pairs]
         else:
-            # Indicate that learner is done with sequence
-            recommendation_data = dict(
-                collection=collection.collection_id,
-                url=None,
-                complete=True,
+            matrix = data['matrix']
+            url_pairs = [(matrix['activity_urls'][i], matrix['kc_ids'][j])
+                         for i, j in zip(matrix['rows'], matrix['cols'])]
+            urls = matrix['activity_urls']
+
+        activities = activity_url_index.resolve_many(urls)
+        kcs = KnowledgeComponent.objects.in_bulk(list({kc_id for url, kc_id in url_pairs}), field_name='kc_id')
+        unknown_urls = sorted(set(urls) - set(activities))
+        unknown_kc_ids = sorted({kc_id for url, kc_id in url_pairs} - set(kcs))
+        if unknown_urls or unknown_kc_ids:
+            return Response(
+                {'detail': "Unknown activity urls: {}; unknown kc_ids: {}".format(unknown_urls, unknown_kc_ids)},
+                status=status.HTTP_400_BAD_REQUEST
             )
 
-        return Response(recommendation_data)
+        activity_pks = {activity.pk for activity in activities.values()}
+        if 'collection' in data:
+            activity_pks.update(data['collection'].activity_set.values_list('pk', flat=True))
+        pairs = {(activities[url].pk, kcs[kc_id].pk) for url, kc_id in url_pairs}
+        created, deleted = replace_tagging(activity_pks, pairs)
+        if created or deleted:
+            # bulk writes do not send the m2m_changed signal that clears score parameters; other processes detect the
+            # change from ParameterVersion, bumped by replace_tagging()
+            score_vector_cache.clear_params()
+        return Response({'created': created, 'deleted': deleted})
 
 
 class CollectionViewSet(viewsets.ModelViewSet):
@@ -112,6 +323,7 @@ class CollectionViewSet(viewsets.ModelViewSet):
         GET /collection/{slug}/activities - list activities in collection
         POST /collection/{slug}/activities - modify activities in collection
         POST /collection/grade - get collection grade for a learner
+        POST /collection/grades - get collection grades for multiple learners
     """
     queryset = Collection.objects.all()
     serializer_class = CollectionSerializer
@@ -197,13 +409,82 @@ class CollectionViewSet(viewsets.ModelViewSet):
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
         # get or create learner
-        learner, created = Learner.objects.get_or_create(**serializer.data)
+        learner, created = learner_cache.get_or_create(**serializer.data)
 
-        grade = get_engine().grade(learner, collection)
+        grade = engine_registry.get_engine_for_learner(learner).grade(learner, collection)
         return Response({'learner': serializer.data, 'grade': grade})
 
+    @action(methods=['post'], detail=True)
+    def grades(self, request, collection_id=None):
+        """
+        Returns grades between 0.0 and 1.0 for multiple learners in the specified collection.
+        Grades are computed with one mastery query per experimental group of the requested learners.
+        Learners that do not exist yet are graded without being created (as a new learner would be).
+        Grade is null if it can not be computed, e.g. if no activities in the collection are tagged with KCs.
+
+        POST /collection/{collection_id}/grades
+        Request Body:
+            {
+                learners: [
+                    {
+                        'tool_consumer_instance_guid': str,
+                        'user_id': str
+                    },
+                    ...
+                ]
+            }
+            If "learners" is omitted, all learners with scores on activities in the collection are graded.
+
+        Response Body:
+            {
+                grades: [
+                    {
+                        learner: {
+                            'tool_consumer_instance_guid': str,
+                            'user_id': str
+                        },
+                        grade: float
+                    },
+                    ...
+                ]
+            }
+        """
+        collection = self.get_object()
+        serializer = CollectionGradesRequestSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
-class MasteryViewSet(viewsets.ModelViewSet):
+        learner_fields = ('user_id', 'tool_consumer_instance_guid')
+        if 'learners' in serializer.validated_data:
+            identities = [(learner['user_id'], learner['tool_consumer_instance_guid'])
+                          for learner in serializer.validated_data['learners']]
+            learners = learner_cache.get_many(identities)
+        else:
+            learners = {
+                (learner.user_id, learner.tool_consumer_instance_guid): learner
+                for learner in Learner.objects.filter(score__activity__collections=collection).distinct().order_by('pk')
+            }
+            identities = list(learners)
+
+        # group learners by engine, so that grades of each group are computed together
+        groups = {}
+        for i, identity in enumerate(identities):
+            learner = learners.get(identity)
+            engine = engine_registry.get_engine(learner.experimental_group_id if learner else None)
+            groups.setdefault(engine, []).append((i, learner.pk if learner else None))
+        grades = [None] * len(identities)
+        for engine, items in groups.items():
+            positions, learner_pks = zip(*items)
+            for i, grade in zip(positions, engine.grade_many(list(learner_pks), collection)):
+                grades[i] = None if grade is None or np.isnan(grade) else float(grade)
+
+        return Response({'grades': [
+            {'learner': dict(zip(learner_fields, identity)), 'grade': grade}
+            for identity, grade in zip(identities, grades)
+        ]})
+
+
+class MasteryViewSet(ExportMixin, viewsets.ModelViewSet):
     """
     Mastery-related API endpoints.
 
@@ -217,19 +498,33 @@ class MasteryViewSet(viewsets.ModelViewSet):
 
     Additional endpoints:
         PUT /mastery/bulk_update - bulk update
+        POST /mastery/matrix - mastery of multiple learners as a learner x KC array
+        GET /mastery/export - stream all masteries as NDJSON or CSV
+
+    List endpoint uses limit/offset pagination by default, and keyset pagination if a "cursor" query parameter is
+    included (start with GET /mastery?cursor= and follow "next" links).
     """
-    queryset = Mastery.objects.all()
+    queryset = Mastery.objects.select_related('learner', 'knowledge_component')
     serializer_class = MasterySerializer
     filter_fields = ('learner', 'learner__user_id',)
+    pagination_class = CursorOrLimitOffsetPagination
+    export_fields = OrderedDict([
+        ('id', 'pk'),
+        ('user_id', 'learner__user_id'),
+        ('tool_consumer_instance_guid', 'learner__tool_consumer_instance_guid'),
+        ('kc_id', 'knowledge_component__kc_id'),
+        ('value', 'value'),
+    ])
 
     @action(methods=['put'], detail=False)
     def bulk_update(self, request):
         """
         Receive and create list of mastery objects
         Update mastery value if value has changed
+        Learners, knowledge components and existing mastery objects are resolved in bulk (see MasteryListSerializer)
         TODO would like to revert kc dict representation back to string (but keep backcompatibility through sept 2018)
         """
-        serializer = MasterySerializer(
+        serializer = BulkMasterySerializer(
             data=request.data,
             many=True,
         )
@@ -239,6 +534,78 @@ class MasteryViewSet(viewsets.ModelViewSet):
         else:
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+    @action(methods=['post'], detail=False, renderer_classes=array_renderer_classes())
+    def matrix(self, request):
+        """
+        Returns mastery of learners as one array, with rows aligned to the requested learners and columns aligned
+        to a list of KC ids. KCs without a stored mastery value for a learner (and unknown learners) have the KC's
+        mastery prior.
+
+        POST /mastery/matrix
+        Request Body:
+            {
+                learners: [
+                    {
+                        'tool_consumer_instance_guid': str,
+                        'user_id': str
+                    },
+                    ...
+                ],
+                kc_ids: [<kc_id>, ...], optional - KCs in column order
+                collection: <collection_id>, optional - if kc_ids is omitted, columns are the KCs of the collection
+            }
+            If both kc_ids and collection are omitted, columns are all KCs, ordered by kc_id.
+
+        Response format is selected by content negotiation (Accept header or "format" query parameter):
+            application/json (format=json):
+                {
+                    learners: [{'tool_consumer_instance_guid': str, 'user_id': str}, ...],
+                    kc_ids: [<kc_id>, ...],
+                    mastery: [[<float>, ...], ...]  (null where the KC has no mastery prior)
+                }
+            application/x-msgpack (format=msgpack): same structure as JSON; requires the msgpack package
+            application/x-npy (format=npy): only the mastery array, as a float64 NumPy .npy file (np.nan where the KC
+                has no mastery prior); rows and columns are in request order, or for columns in collection/all KCs
+                ordered by kc_id
+        """
+        serializer = MasteryMatrixRequestSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        data = serializer.validated_data
+
+        # kc axis
+        if 'kc_ids' in data:
+            kcs = KnowledgeComponent.objects.in_bulk(data['kc_ids'], field_name='kc_id')
+            unknown_kc_ids = [kc_id for kc_id in data['kc_ids'] if kc_id not in kcs]
+            if unknown_kc_ids:
+                return Response({'kc_ids': ['Unknown KC ids: {}'.format(unknown_kc_ids)]},
+                                status=status.HTTP_400_BAD_REQUEST)
+            kcs = [kcs[kc_id] for kc_id in data['kc_ids']]
+        elif 'collection' in data:
+            kcs = list(get_kcs_in_activity_set(data['collection'].activity_set).order_by('kc_id'))
+        else:
+            kcs = list(KnowledgeComponent.objects.order_by('kc_id'))
+
+        # learner axis
+        identities = [(learner['user_id'], learner['tool_consumer_instance_guid']) for learner in data['learners']]
+        learners = learner_cache.get_many(identities)
+        learner_pks = [learners[identity].pk if identity in learners else None for identity in identities]
+
+        mastery = get_mastery_matrix(learner_pks, [kc.pk for kc in kcs])
+        priors = np.array([kc.mastery_prior for kc in kcs], dtype=np.float64)
+        mastery = np.where(np.isnan(mastery), priors, mastery)
+        if not isinstance(request.accepted_renderer, NpyRenderer):
+            # nan is not valid json
+            missing = np.isnan(mastery)
+            mastery = mastery.astype(object)
+            mastery[missing] = None
+            mastery = mastery.tolist()
+        return Response({
+            'learners': [{'user_id': user_id, 'tool_consumer_instance_guid': guid} for user_id, guid in identities],
+            'kc_ids': [kc.kc_id for kc in kcs],
+            'mastery': mastery,
+        })
+
 
 class KnowledgeComponentViewSet(viewsets.ModelViewSet):
     """
@@ -257,7 +624,7 @@ class KnowledgeComponentViewSet(viewsets.ModelViewSet):
     lookup_field = 'kc_id'  # lookup based on kc_id slug field
     filter_fields = ['kc_id', 'name']
 
-class ScoreViewSet(viewsets.ModelViewSet):
+class ScoreViewSet(ExportMixin, viewsets.ModelViewSet):
     """
     Standard CRUD endpoints:
         GET /grade - list
@@ -268,9 +635,24 @@ class ScoreViewSet(viewsets.ModelViewSet):
 
     Modified CRUD endpoints:
         POST /grade - create, also supports auto creation of related learners
+
+    Additional endpoints:
+        GET /score/export - stream all scores as NDJSON or CSV
+
+    List endpoint uses limit/offset pagination by default, and keyset pagination if a "cursor" query parameter is
+    included (start with GET /score?cursor= and follow "next" links).
     """
-    queryset = Score.objects.all()
+    queryset = Score.objects.select_related('learner', 'activity')
     serializer_class = ScoreSerializer
+    pagination_class = CursorOrLimitOffsetPagination
+    export_fields = OrderedDict([
+        ('id', 'pk'),
+        ('user_id', 'learner__user_id'),
+        ('tool_consumer_instance_guid', 'learner__tool_consumer_instance_guid'),
+        ('activity', 'activity__url'),
+        ('score', 'score'),
+        ('timestamp', 'timestamp'),
+    ])
 
     def perform_create(self, serializer):
         """
@@ -282,9 +664,12 @@ class ScoreViewSet(viewsets.ModelViewSet):
         # required for perform_create(); creates the score object in database
         score = serializer.save()
 
+        # record score on the learner's server-side sequence item for the activity, if any
+        SequenceItem.record_score(score.learner, score.activity, score.score)
+
         # trigger update function for engine (bayes update if adaptive)
         log.debug("Triggering engine update from score")
-        engine = get_engine()
+        engine = engine_registry.get_engine_for_learner(score.learner)
         engine.update_from_score(score.learner, score.activity, score.score)
 
 
@@ -336,3 +721,89 @@ class CollectionActivityMemberViewSet(viewsets.ModelViewSet):
     serializer_class = CollectionActivityMemberSerializer
     filter_fields = ['collection', 'activity']
 
+
+class ParameterViewSet(viewsets.ViewSet):
+    """
+    Bulk import/export of activity-kc parameter matrices (guess, slip, transit)
+    Values are transferred as stored by the engine (see engine.parameters).
+
+    Endpoints:
+        GET /parameter/{name} - export parameter matrix
+        PUT /parameter/{name} - import parameter matrix
+    """
+    lookup_field = 'name'
+
+    def get_model(self, name):
+        if name not in PARAMETER_MODELS:
+            raise NotFound("Unknown parameter: {}".format(name))
+        return PARAMETER_MODELS[name]
+
+    def get_renderers(self):
+        if self.action == 'retrieve':
+            return [NpzRenderer(), CSVRenderer(), NDJSONRenderer()]
+        return super().get_renderers()
+
+    def retrieve(self, request, name=None):
+        """
+        Export stored values of a parameter
+
+        GET /parameter/{name}[?collection=<collection_id>]
+        Format is selected by Accept header or "format" query parameter:
+            npz (default): dense matrix as .npz file with arrays "values" ((# activities) x (# KCs), nan where no value
+                is stored), "activity_urls" and "kc_ids"
+            csv: sparse (activity_url, kc_id, value) triples, with header row
+            ndjson: sparse triples as newline-delimited JSON objects
+        If collection is specified, only values for activities in the collection are exported.
+        """
+        model = self.get_model(name)
+        collection = None
+        if 'collection' in request.query_params:
+            collection = get_object_or_404(Collection, collection_id=request.query_params['collection'])
+        export_format = request.accepted_renderer.format
+        if export_format in ('csv', 'ndjson'):
+            return export_response(get_parameter_queryset(model, collection), TRIPLE_FIELDS, export_format, name)
+        values, activity_urls, kc_ids = export_dense(model, collection)
+        response = Response({
+            'values': values,
+            'activity_urls': np.array(activity_urls, dtype=np.str_),
+            'kc_ids': np.array(kc_ids, dtype=np.str_),
+        })
+        response['Content-Disposition'] = 'attachment; filename="{}.npz"'.format(name)
+        return response
+
+    def update(self, request, name=None):
+        """
+        Create or update values of a parameter from an uploaded file, in a single transaction
+        Values of activity-kc pairs not included in the file are not changed. Parameter version is incremented.
+
+        PUT /parameter/{name}
+        Request Body (multipart/form-data):
+            file: .npz file (as exported), .npy file with a 2-d matrix, or .csv file with activity_url, kc_id and value
+                columns; format is determined by file name extension. nan values in dense matrices are skipped.
+            activity_urls: activity urls of matrix rows (repeated field), required for .npy files
+            kc_ids: kc_ids of matrix columns (repeated field), required for .npy files
+
+        Response Body:
+            {
+                created: <int>, number of created parameter objects
+                updated: <int>, number of updated parameter objects
+                parameter_version: <int>
+            }
+        Returns 400 if the file is invalid or references unknown activities or knowledge components; nothing is
+        written in that case.
+        """
+        model = self.get_model(name)
+        upload = request.data.get('file')
+        if upload is None or not hasattr(upload, 'read'):
+            return Response({'file': ['A parameter file is required.']}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            triples = read_parameter_file(
+                io.BytesIO(upload.read()),
+                upload.name,
+                activity_urls=request.data.getlist('activity_urls') or None,
+                kc_ids=request.data.getlist('kc_ids') or None
+            )
+            result = import_parameters(model, triples)
+        except ParameterImportError as e:
+            return Response({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(result)
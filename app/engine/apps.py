@@ -6,3 +6,7 @@ from django.apps import AppConfig
 
 class EngineConfig(AppConfig):
     name = 'engine'
+
+    def ready(self):
+        # connect signal handlers
+        from . import signals
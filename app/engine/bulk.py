@@ -0,0 +1,71 @@
+"""
+Set-based database write helpers, for bulk API endpoints
+Bulk writes do not send model save signals; callers are responsible for refreshing process-local caches
+(see engine.caches).
+"""
+from django.db import transaction
+from django.db.models import Case, Value, When
+from .models import Activity, ParameterVersion
+
+
+# maximum number of objects per update query in bulk_update()
+BULK_UPDATE_BATCH_SIZE = 500
+# maximum number of activities or rows per query in replace_tagging()
+TAGGING_BATCH_SIZE = 500
+
+
+def bulk_update(objs, fields, batch_size=BULK_UPDATE_BATCH_SIZE):
+    """
+    Save field values of multiple model instances with one UPDATE query per batch
+    (QuerySet.bulk_update() is not available before Django 2.2)
+    :param objs: list of model instances of the same model, with pks
+    :param fields: list of names of fields to update
+    :param batch_size: int, maximum number of instances per query
+    :return: int, number of updated rows
+    """
+    if not objs or not fields:
+        return 0
+    model = type(objs[0])
+    model_fields = [model._meta.get_field(field) for field in fields]
+    updated = 0
+    for start in range(0, len(objs), batch_size):
+        batch = objs[start:start + batch_size]
+        values = {
+            field.attname: Case(
+                *[When(pk=obj.pk, then=Value(getattr(obj, field.attname))) for obj in batch],
+                output_field=field
+            )
+            for field in model_fields
+        }
+        updated += model.objects.filter(pk__in=[obj.pk for obj in batch]).update(**values)
+    return updated
+
+
+def replace_tagging(activity_pks, pairs, batch_size=TAGGING_BATCH_SIZE):
+    """
+    Replace knowledge component tagging of activities, diffing against the current Activity.knowledge_components
+    through table rows in memory and applying the difference with bulk inserts and deletes in one transaction
+    ParameterVersion is bumped in the same transaction if the tagging changed.
+    :param activity_pks: iterable of pks of activities whose tagging is replaced; activities without pairs are untagged
+    :param pairs: set of (activity pk, kc pk) tuples, new tagging of the activities
+    :param batch_size: int, maximum number of activities or rows per query
+    :return: (number of created rows, number of deleted rows) tuple
+    """
+    through = Activity.knowledge_components.through
+    activity_pks = list(set(activity_pks) | {activity_pk for activity_pk, kc_pk in pairs})
+    with transaction.atomic():
+        current = {}
+        for start in range(0, len(activity_pks), batch_size):
+            rows = through.objects.filter(activity__in=activity_pks[start:start + batch_size]).values_list(
+                'pk', 'activity_id', 'knowledgecomponent_id')
+            for pk, activity_pk, kc_pk in rows:
+                current[(activity_pk, kc_pk)] = pk
+        deleted = [pk for pair, pk in current.items() if pair not in pairs]
+        created = [through(activity_id=activity_pk, knowledgecomponent_id=kc_pk)
+                   for activity_pk, kc_pk in pairs if (activity_pk, kc_pk) not in current]
+        for start in range(0, len(deleted), batch_size):
+            through.objects.filter(pk__in=deleted[start:start + batch_size]).delete()
+        through.objects.bulk_create(created, batch_size=batch_size)
+        if created or deleted:
+            ParameterVersion.bump()
+    return len(created), len(deleted)
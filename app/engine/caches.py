@@ -0,0 +1,456 @@
+"""
+Process-local caches used on the request hot path
+Cache contents are refreshed by model signal handlers (see engine.signals) within a process.
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+from django.db import IntegrityError, transaction
+from .models import Activity, Learner, ParameterVersion
+
+
+# maximum number of learner identities kept in LearnerCache
+LEARNER_CACHE_SIZE = 100000
+# maximum number of learner identities per query in LearnerCache.get_or_create_many()
+LEARNER_QUERY_BATCH_SIZE = 400
+# maximum number of learners with score vectors kept in ScoreVectorCache
+SCORE_VECTOR_CACHE_SIZE = 1000
+# seconds between checks of ParameterVersion in ScoreVectorCache
+PARAMETER_VERSION_CHECK_INTERVAL = 10
+# maximum number of (learner, collection) cursors kept in NonAdaptiveSequenceCache
+NONADAPTIVE_CURSOR_CACHE_SIZE = 100000
+# seconds after which non-adaptive sequences in NonAdaptiveSequenceCache are reloaded from database
+NONADAPTIVE_ORDER_TTL = 60
+
+
+def url_key(url):
+    """
+    Fixed-size hash key for a (possibly long) activity url
+    :param url: str
+    :return: bytes, sha1 digest of url
+    """
+    return hashlib.sha1(url.encode('utf-8')).digest()
+
+
+class ActivityUrlIndex(object):
+    """
+    Map from activity url to Activity pk, keyed by url hash
+    Used to resolve activity urls in incoming requests (sequence items, scores, collection activity lists)
+    without a url lookup query. Entries made stale by writes in other processes are detected and repaired when
+    activities are loaded; callers that only need activity pks can resolve indexed urls without a query (deferred).
+    """
+    def __init__(self):
+        # url hash -> activity pk
+        self._pks = {}
+        # activity pk -> url hash, so that entry can be replaced if activity url changes
+        self._keys = {}
+        self._lock = threading.Lock()
+
+    def get(self, url):
+        """
+        Get cached pk for url
+        :param url: str
+        :return: activity pk, or None if url is not in index
+        """
+        return self._pks.get(url_key(url))
+
+    def set(self, url, pk):
+        """
+        Add or replace index entry for activity
+        :param url: activity url
+        :param pk: activity pk
+        """
+        key = url_key(url)
+        with self._lock:
+            old_key = self._keys.get(pk)
+            if old_key is not None and old_key != key:
+                self._pks.pop(old_key, None)
+            self._pks[key] = pk
+            self._keys[pk] = key
+
+    def discard(self, pk):
+        """
+        Remove index entry for activity, if present
+        :param pk: activity pk
+        """
+        with self._lock:
+            key = self._keys.pop(pk, None)
+            if key is not None and self._pks.get(key) == pk:
+                del self._pks[key]
+
+    def clear(self):
+        with self._lock:
+            self._pks.clear()
+            self._keys.clear()
+
+    def load(self):
+        """
+        Populate index with all existing activities
+        """
+        for pk, url in Activity.objects.order_by('-pk').values_list('pk', 'url'):
+            self.set(url, pk)
+
+    def resolve(self, url, deferred=False):
+        """
+        Get activity with specified url (see resolve_many())
+        :param url: activity url
+        :param deferred: bool, whether to return a deferred instance without a query if url is in index
+        :return: Activity model instance
+        :raises: Activity.DoesNotExist if no activity with url exists
+        """
+        activity = self.resolve_many([url], deferred=deferred).get(url)
+        if activity is None:
+            raise Activity.DoesNotExist("Activity with url {} does not exist".format(url))
+        return activity
+
+    def resolve_many(self, urls, deferred=False):
+        """
+        Get activities for a list of urls, using at most two queries
+        With deferred, activities of indexed urls are returned without a query, as instances with only pk and url
+        loaded (other fields are loaded on access); they are not checked against the database, so an entry made stale
+        by a write in another process (e.g. activity deleted) is returned as is. Only urls not in index are queried.
+        :param urls: list of activity urls
+        :param deferred: bool, whether to return deferred instances for indexed urls, for callers that only use pks
+        :return: dict of url -> Activity model instance; urls with no matching activity are omitted
+        """
+        pks = {url: self.get(url) for url in set(urls)}
+        output = {}
+        if deferred:
+            for url, pk in pks.items():
+                if pk is not None:
+                    output[url] = Activity.from_db(None, ['id', 'url'], [pk, url])
+        else:
+            activities = Activity.objects.in_bulk([pk for pk in pks.values() if pk is not None])
+            for url, pk in pks.items():
+                activity = activities.get(pk)
+                if activity is not None and activity.url == url:
+                    output[url] = activity
+                elif pk is not None:
+                    self.discard(pk)
+        missing = [url for url in pks if url not in output]
+        if missing:
+            # lowest pk wins if multiple activities share a url
+            for activity in Activity.objects.filter(url__in=missing).order_by('-pk'):
+                output[activity.url] = activity
+            for url in missing:
+                if url in output:
+                    self.set(url, output[url].pk)
+        return output
+
+
+class LearnerCache(object):
+    """
+    Bounded LRU cache of learner identity (user_id, tool_consumer_instance_guid) -> (pk, experimental group pk)
+    Cached learners are returned as model instances constructed from the cached values, without a query.
+    Learner deletions or experimental group changes made in other processes are not seen until the entry is evicted.
+    """
+    def __init__(self, maxsize=LEARNER_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id, tool_consumer_instance_guid):
+        """
+        Get cached learner
+        :return: Learner model instance, or None if learner is not in cache
+        """
+        key = (user_id, tool_consumer_instance_guid)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+        pk, experimental_group_id = entry
+        return Learner.from_db(
+            None,
+            ['id', 'user_id', 'tool_consumer_instance_guid', 'experimental_group_id'],
+            [pk, user_id, tool_consumer_instance_guid, experimental_group_id]
+        )
+
+    def set(self, learner):
+        """
+        Add or replace cache entry for learner
+        :param learner: Learner model instance
+        """
+        key = (learner.user_id, learner.tool_consumer_instance_guid)
+        with self._lock:
+            self._entries[key] = (learner.pk, learner.experimental_group_id)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def discard(self, learner):
+        """
+        Remove cache entry for learner, if present
+        :param learner: Learner model instance
+        """
+        with self._lock:
+            self._entries.pop((learner.user_id, learner.tool_consumer_instance_guid), None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def get_or_create(self, user_id, tool_consumer_instance_guid):
+        """
+        Get learner by identity, creating learner if it does not exist yet
+        Concurrent creation of the same learner is resolved by the (user_id, tool_consumer_instance_guid) unique
+        constraint; get_or_create() falls back to fetching the learner created by the other request
+        :param user_id: str
+        :param tool_consumer_instance_guid: str
+        :return: (Learner model instance, created) tuple
+        """
+        learner = self.get(user_id, tool_consumer_instance_guid)
+        if learner is not None:
+            return learner, False
+        learner, created = Learner.objects.get_or_create(
+            user_id=user_id,
+            tool_consumer_instance_guid=tool_consumer_instance_guid
+        )
+        self.set(learner)
+        return learner, created
+
+    def get_or_create_many(self, identities, batch_size=LEARNER_QUERY_BATCH_SIZE):
+        """
+        Get learners by identity, creating learners that do not exist yet with a bulk insert (see get_many())
+        :param identities: iterable of (user_id, tool_consumer_instance_guid) tuples
+        :param batch_size: int, maximum number of identities per query
+        :return: dict of (user_id, tool_consumer_instance_guid) -> Learner model instance
+        """
+        return self.get_many(identities, create=True, batch_size=batch_size)
+
+    def get_many(self, identities, create=False, batch_size=LEARNER_QUERY_BATCH_SIZE):
+        """
+        Get learners by identity, from cache if possible
+        Learners not in cache are fetched with one query per batch_size identities, and added to cache. With create,
+        learners that do not exist yet are created with a bulk insert; if the bulk insert conflicts with learners
+        created concurrently by another request, the learners are created one by one instead.
+        :param identities: iterable of (user_id, tool_consumer_instance_guid) tuples
+        :param create: bool, whether to create learners that do not exist
+        :param batch_size: int, maximum number of identities per query
+        :return: dict of (user_id, tool_consumer_instance_guid) -> Learner model instance; without create, unknown
+            learners are omitted
+        """
+        learners = {}
+        missing = []
+        for identity in set(identities):
+            learner = self.get(*identity)
+            if learner is not None:
+                learners[identity] = learner
+            else:
+                missing.append(identity)
+        learners.update(self._fetch_many(missing, batch_size))
+        created = [identity for identity in missing if identity not in learners]
+        if create and created:
+            # created learners are fetched again for their pks, which bulk_create() does not set on all database
+            # backends
+            try:
+                with transaction.atomic():
+                    Learner.objects.bulk_create([
+                        Learner(user_id=user_id, tool_consumer_instance_guid=guid) for user_id, guid in created
+                    ])
+            except IntegrityError:
+                # some learners were created by another request; create the rest (Django < 2.2 has no
+                # bulk_create(ignore_conflicts=True))
+                for user_id, guid in created:
+                    Learner.objects.get_or_create(user_id=user_id, tool_consumer_instance_guid=guid)
+            learners.update(self._fetch_many(created, batch_size))
+        return learners
+
+    def _fetch_many(self, identities, batch_size):
+        """
+        Fetch existing learners by identity from database, and add them to cache
+        :return: dict of (user_id, tool_consumer_instance_guid) -> Learner model instance
+        """
+        learners = {}
+        for start in range(0, len(identities), batch_size):
+            batch = set(identities[start:start + batch_size])
+            existing = Learner.objects.filter(
+                user_id__in={user_id for user_id, guid in batch},
+                tool_consumer_instance_guid__in={guid for user_id, guid in batch}
+            )
+            for learner in existing:
+                identity = (learner.user_id, learner.tool_consumer_instance_guid)
+                if identity in batch:
+                    learners[identity] = learner
+                    self.set(learner)
+        return learners
+
+
+class ScoreVectorCache(object):
+    """
+    Per-collection score parameters (engine.incremental.CollectionScoreParams) and bounded LRU cache of
+    per-learner, per-collection score vectors (engine.incremental.LearnerScoreVector)
+    Score parameters are cleared on writes to parameter models in this process (see engine.signals), and when
+    ParameterVersion changes (checked at most every version_check_interval seconds), e.g. after a bulk parameter
+    import in another process; other parameter changes made in other processes are only detected if they add
+    activities or KCs to the collection.
+    Learner mastery is checked against the database on each recommendation, so learner vectors do not go stale.
+    """
+    def __init__(self, maxsize=SCORE_VECTOR_CACHE_SIZE, version_check_interval=PARAMETER_VERSION_CHECK_INTERVAL):
+        self.maxsize = maxsize
+        self.version_check_interval = version_check_interval
+        # collection pk -> CollectionScoreParams
+        self._params = {}
+        # learner pk -> {collection pk -> LearnerScoreVector}
+        self._vectors = OrderedDict()
+        self._lock = threading.Lock()
+        # ParameterVersion that cached params were computed with, and time it was last checked
+        self._version = None
+        self._version_checked_at = None
+
+    def check_version(self):
+        """
+        Discard collection parameters if ParameterVersion changed since the last check
+        """
+        now = time.monotonic()
+        if self._version_checked_at is not None and now - self._version_checked_at < self.version_check_interval:
+            return
+        version = ParameterVersion.current()
+        with self._lock:
+            if version != self._version:
+                self._params.clear()
+                self._version = version
+            self._version_checked_at = now
+
+    def get_params(self, collection_pk):
+        self.check_version()
+        return self._params.get(collection_pk)
+
+    def set_params(self, collection_pk, params):
+        self.check_version()
+        with self._lock:
+            self._params[collection_pk] = params
+
+    def get(self, learner_pk, collection_pk):
+        """
+        Get cached score vector
+        :return: LearnerScoreVector, or None if not in cache or computed from outdated collection parameters
+        """
+        with self._lock:
+            vectors = self._vectors.get(learner_pk)
+            if vectors is None:
+                return None
+            self._vectors.move_to_end(learner_pk)
+            vector = vectors.get(collection_pk)
+            if vector is None or vector.params is not self._params.get(collection_pk):
+                return None
+            return vector
+
+    def set(self, learner_pk, collection_pk, vector):
+        with self._lock:
+            self._vectors.setdefault(learner_pk, {})[collection_pk] = vector
+            self._vectors.move_to_end(learner_pk)
+            while len(self._vectors) > self.maxsize:
+                self._vectors.popitem(last=False)
+
+    def get_learner_vectors(self, learner_pk):
+        """
+        Cached score vectors of learner, for all collections
+        :return: list of LearnerScoreVector
+        """
+        with self._lock:
+            vectors = self._vectors.get(learner_pk, {})
+            return [vector for collection_pk, vector in vectors.items()
+                    if vector.params is self._params.get(collection_pk)]
+
+    def clear_params(self):
+        """
+        Discard collection parameters; learner vectors computed from them are discarded on next access
+        """
+        with self._lock:
+            self._params.clear()
+
+    def clear(self):
+        with self._lock:
+            self._params.clear()
+            self._vectors.clear()
+            self._version = None
+            self._version_checked_at = None
+
+
+class NonAdaptiveSequenceCache(object):
+    """
+    Per-collection ordered non-adaptive activity sequences, and bounded LRU cache of per-learner, per-collection
+    cursors into them
+    A cursor is the position of the first sequence item that the learner has not seen; all items before it were seen.
+    Sequences are cleared on writes to activities in this process (see engine.signals), and reloaded at most ttl
+    seconds after loading, to pick up writes made in other processes.
+    """
+    def __init__(self, maxsize=NONADAPTIVE_CURSOR_CACHE_SIZE, ttl=NONADAPTIVE_ORDER_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        # collection pk -> (np.array of activity pks, time loaded)
+        self._orders = {}
+        # (learner pk, collection pk) -> (order, position, sequence length)
+        self._cursors = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_order(self, collection_pk):
+        """
+        Get ordered non-adaptive sequence of collection, loading it if needed
+        :param collection_pk: Collection pk
+        :return: np.array of pks of collection activities with 'nonadaptive_order' populated, ordered by
+            nonadaptive_order (ties broken by pk)
+        """
+        now = time.monotonic()
+        order, loaded_at = self._orders.get(collection_pk, (None, None))
+        if order is None or now - loaded_at > self.ttl:
+            order = np.array(
+                Activity.objects
+                .filter(collections=collection_pk, nonadaptive_order__isnull=False)
+                .order_by('nonadaptive_order', 'pk')
+                .values_list('pk', flat=True),
+                dtype=np.int64
+            )
+            with self._lock:
+                self._orders[collection_pk] = (order, now)
+        return order
+
+    def advance(self, learner_pk, collection_pk, seen):
+        """
+        Advance learner's cursor past seen activities
+        The cursor is reset if the sequence order was reloaded, or if the learner sequence is shorter than on the
+        previous call (i.e. it is not the same, growing sequence history).
+        :param learner_pk: Learner pk
+        :param collection_pk: Collection pk
+        :param seen: set of pks of activities in learner's sequence history
+        :return: (order, position) tuple; position is len(order) if all activities have been seen
+        """
+        order = self.get_order(collection_pk)
+        key = (learner_pk, collection_pk)
+        with self._lock:
+            cursor = self._cursors.get(key)
+        position = 0
+        if cursor is not None:
+            cursor_order, cursor_position, sequence_length = cursor
+            if cursor_order is order and sequence_length <= len(seen):
+                position = cursor_position
+        while position < len(order) and order[position] in seen:
+            position += 1
+        with self._lock:
+            self._cursors[key] = (order, position, len(seen))
+            self._cursors.move_to_end(key)
+            while len(self._cursors) > self.maxsize:
+                self._cursors.popitem(last=False)
+        return order, position
+
+    def clear_orders(self):
+        """
+        Discard collection sequences; cursors into them are reset on next access
+        """
+        with self._lock:
+            self._orders.clear()
+
+    def clear(self):
+        with self._lock:
+            self._orders.clear()
+            self._cursors.clear()
+
+
+activity_url_index = ActivityUrlIndex()
+learner_cache = LearnerCache()
+score_vector_cache = ScoreVectorCache()
+nonadaptive_sequence_cache = NonAdaptiveSequenceCache()
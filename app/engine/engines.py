@@ -1,10 +1,18 @@
 import logging
 import random
+import threading
 from django.db.models import Model
 import numpy as np
-from alosi.engine import BaseAlosiAdaptiveEngine, recommendation_score, odds, EPSILON, calculate_mastery_update
+try:
+    import numba
+except ImportError:
+    numba = None
+from alosi.engine import BaseAlosiAdaptiveEngine, odds, EPSILON, calculate_mastery_update
 from .data_structures import Matrix, Vector, pk_index_map, convert_pk_to_index
 from .models import *
+from .sparse import CSRMatrix, sparse_relevance, sparse_recommendation_score, pruned_recommendation
+from .incremental import CollectionScoreParams, LearnerScoreVector
+from .caches import score_vector_cache, nonadaptive_sequence_cache
 
 
 log = logging.getLogger(__name__)
@@ -13,6 +21,18 @@ GUESS_DEFAULT = odds(0.1)
 SLIP_DEFAULT = odds(0.15)
 TRANSIT_DEFAULT = odds(0.1)
 
+# ActivityKCParameter field -> default value for tagged activity-kc pairs without a stored value
+PARAMETER_DEFAULTS = {
+    'guess': GUESS_DEFAULT,
+    'slip': SLIP_DEFAULT,
+    'transit': TRANSIT_DEFAULT,
+}
+
+# use sparse parameter representation when fraction of tagged activity-kc pairs is below this value
+SPARSE_DENSITY_THRESHOLD = 0.05
+# maximum number of learners per mastery query in get_mastery_matrix()
+MASTERY_QUERY_BATCH_SIZE = 500
+
 
 def inverse_odds(x, epsilon=EPSILON):
     """
@@ -50,6 +70,235 @@ def get_tagging_matrix(activities=None, knowledge_components=None):
     return output_matrix
 
 
+def get_sparse_triples(values_list, row_map, col_map):
+    """
+    Convert rows of (row_pk, col_pk[, value]) to index arrays, dropping rows with pk's outside of the index maps
+    :param values_list: iterable of (row_pk, col_pk) or (row_pk, col_pk, value) tuples
+    :param row_map: dict of row pk -> 0-index
+    :param col_map: dict of col pk -> 0-index
+    :return: tuple of np.arrays (rows, cols) or (rows, cols, values)
+    """
+    output = [
+        (row_map[row[0]], col_map[row[1]]) + tuple(row[2:])
+        for row in values_list if row[0] in row_map and row[1] in col_map
+    ]
+    if not output:
+        return (np.array([], dtype=int), np.array([], dtype=int), np.array([]))
+    return tuple(np.array(column) for column in zip(*output))
+
+
+def get_sparse_tagging(activity_map, kc_map, activities, knowledge_components):
+    """
+    Get tagged activity-kc pairs as index arrays
+    :param activity_map: dict of activity pk -> 0-index
+    :param kc_map: dict of kc pk -> 0-index
+    :param activities: Activity queryset
+    :param knowledge_components: KnowledgeComponent queryset
+    :return: (rows, cols) tuple of np.arrays
+    """
+    pairs = Activity.knowledge_components.through.objects.filter(
+        activity__in=activities,
+        knowledgecomponent__in=knowledge_components
+    ).values_list('activity_id', 'knowledgecomponent_id')
+    return get_sparse_triples(pairs, activity_map, kc_map)[:2]
+
+
+class ScoreWorkspace(object):
+    """
+    Reusable scratch buffers for recommendation_score_kernel
+    Buffers grow to the largest size requested and are reused by subsequent calls
+    """
+    def __init__(self):
+        self._buffers = {}
+
+    def get(self, name, shape, dtype):
+        """
+        Get buffer view of given shape and dtype (contents undefined)
+        :param name: str, buffer name
+        :param shape: tuple
+        :param dtype: np.dtype
+        :return: np.ndarray
+        """
+        size = int(np.prod(shape))
+        key = (name, np.dtype(dtype))
+        buffer = self._buffers.get(key)
+        if buffer is None or buffer.size < size:
+            buffer = np.empty(size, dtype=dtype)
+            self._buffers[key] = buffer
+        return buffer[:size].reshape(shape)
+
+
+_workspaces = threading.local()
+
+
+def get_score_workspace():
+    """
+    Get ScoreWorkspace for current thread, so that each worker reuses its own buffers
+    :return: ScoreWorkspace
+    """
+    workspace = getattr(_workspaces, 'workspace', None)
+    if workspace is None:
+        workspace = _workspaces.workspace = ScoreWorkspace()
+    return workspace
+
+
+def _negative_log_odds(p, epsilon, out, fill_value=None, mask=None):
+    """
+    Compute -log(odds(p)) = log((1-p)/p) into out, with p regularized to range [epsilon, 1-epsilon]
+    :param p: np.array of probability values
+    :param epsilon: regularization cutoff
+    :param out: np.array to write output to
+    :param fill_value: if specified, value to use in place of NaN inputs
+    :param mask: bool np.array same size as out, used as scratch space for NaN filling
+    :return: out
+    """
+    np.copyto(out, p, casting='unsafe')
+    if fill_value is not None:
+        np.isnan(out, out=mask)
+        np.copyto(out, fill_value, where=mask)
+    np.clip(out, epsilon, 1 - epsilon, out=out)
+    np.reciprocal(out, out=out)
+    np.subtract(out, 1, out=out)
+    return np.log(out, out=out)
+
+
+def _relevance(guess, slip, epsilon, out, scratch, mask):
+    """
+    Compute relevance -log(odds(guess))-log(odds(slip)) into out, with 0.0 for elements with missing guess/slip
+    """
+    _negative_log_odds(guess, epsilon, out)
+    np.add(out, _negative_log_odds(slip, epsilon, scratch), out=out)
+    np.isnan(out, out=mask)
+    np.copyto(out, 0.0, where=mask)
+    return out
+
+
+if numba is not None:
+    @numba.njit(cache=True)
+    def _fused_scores(guess, slip, epsilon, v, last_relevance, has_last, L, difficulty, W_d, W_c, out):
+        """
+        Compute scores in a single pass over activity-kc elements; relevance is computed per element and not stored
+        See recommendation_score_kernel for argument definitions
+        """
+        n_activities, n_kcs = guess.shape
+        for q in range(n_activities):
+            pr = 0.0
+            c = 0.0
+            d = 0.0
+            for k in range(n_kcs):
+                g = guess[q, k]
+                s = slip[q, k]
+                if np.isnan(g) or np.isnan(s):
+                    continue
+                g = min(max(g, epsilon), 1 - epsilon)
+                s = min(max(s, epsilon), 1 - epsilon)
+                r = np.log((1 - g) / g) + np.log((1 - s) / s)
+                pr += r * v[k]
+                c += r * last_relevance[k]
+                d += r * abs(L[k] - difficulty[q])
+            out[q] = pr - W_c * d
+            if has_last:
+                out[q] += W_d * np.sqrt(c)
+        return out
+
+
+def recommendation_score_kernel(*, guess, slip, learner_mastery, prereqs, r_star, L_star, difficulty, W_p, W_r, W_d,
+                                W_c, last_attempted_guess=None, last_attempted_slip=None, dtype=None, use_numba=None,
+                                out=None):
+    """
+    Computes recommendation scores for activities
+    Drop-in replacement for alosi.engine.recommendation_score (same arguments and results): computes the P, R, C, D
+    substrategy scores and their weighted sum without intermediate arrays per substrategy, using scratch buffers
+    from the per-worker ScoreWorkspace. Uses a single-pass numba kernel if numba is installed.
+    :param guess: QxK matrix of item-KC guess values
+    :param slip: QxK matrix of item-KC slip values
+    :param learner_mastery: 1xK vector of learner mastery values
+    :param prereqs: KxK np.array, prerequisite matrix
+    :param r_star: Threshold for forgiving lower odds of mastering pre-requisite LOs.
+    :param L_star: Threshold logarithmic odds. If mastery logarithmic odds are >= than L_star, the LO is considered mastered
+    :param difficulty: 1xQ vector of difficulty values
+    :param W_p: (float), weight on substrategy P
+    :param W_r: (float), weight on substrategy R
+    :param W_d: (float), weight on substrategy D
+    :param W_c: (float), weight on substrategy C
+    :param last_attempted_guess: 1xK vector of guess values for last attempted activity, or None
+    :param last_attempted_slip: 1xK vector of slip values for last attempted activity, or None
+    :param dtype: np.float32 or np.float64; defaults to float32 if guess is float32, else float64
+    :param use_numba: bool, whether to use numba kernel; defaults to True if numba is installed
+    :param out: optional np.array of size (Q,) to write scores to
+    :return: np.array of size (Q,) representing [1 x (# activities)] vector of activity recommendation score values
+    """
+    dtype = np.dtype(dtype) if dtype is not None else np.result_type(np.asarray(guess).dtype, np.float32)
+    if dtype not in (np.float32, np.float64):
+        raise ValueError('dtype must be float32 or float64')
+    if use_numba is None:
+        use_numba = numba is not None
+    # regularization cutoff must be representable relative to 1.0
+    epsilon = max(EPSILON, float(np.finfo(dtype).eps))
+    workspace = get_score_workspace()
+    n_activities, n_kcs = np.shape(guess)
+    if out is None:
+        out = np.empty(n_activities, dtype=dtype)
+    has_last = last_attempted_guess is not None or last_attempted_slip is not None
+
+    # per-kc vectors
+    kc_mask = workspace.get('kc_mask', (n_kcs,), np.bool_)
+    L = np.negative(_negative_log_odds(learner_mastery, epsilon, workspace.get('L', (n_kcs,), dtype)))
+    prereq_weights = workspace.get('prereqs', (n_kcs, n_kcs), dtype)
+    np.copyto(prereq_weights, prereqs, casting='unsafe')
+    prereq_mask = workspace.get('prereq_mask', (n_kcs, n_kcs), np.bool_)
+    np.isnan(prereq_weights, out=prereq_mask)
+    np.copyto(prereq_weights, 0.0, where=prereq_mask)
+    # v = W_p * min(m_r + r_star, 0) + W_r * max(L_star - L, 0), so that rel.v = W_p*P + W_r*R
+    scratch = workspace.get('kc_scratch', (n_kcs,), dtype)
+    np.minimum(np.subtract(L, L_star, out=scratch), 0, out=scratch)
+    v = np.dot(scratch, prereq_weights, out=workspace.get('v', (n_kcs,), dtype))
+    np.minimum(np.add(v, r_star, out=v), 0, out=v)
+    np.multiply(v, W_p, out=v)
+    np.maximum(np.subtract(L_star, L, out=scratch), 0, out=scratch)
+    np.add(v, np.multiply(scratch, W_r, out=scratch), out=v)
+    last_relevance = workspace.get('last_relevance', (n_kcs,), dtype)
+    if has_last:
+        _relevance(last_attempted_guess, last_attempted_slip, epsilon, last_relevance, scratch, kc_mask)
+    else:
+        last_relevance.fill(0.0)
+
+    # per-activity difficulty log odds, missing values filled with 0.5
+    activity_mask = workspace.get('activity_mask', (n_activities,), np.bool_)
+    difficulty_log_odds = np.negative(_negative_log_odds(
+        difficulty, epsilon, workspace.get('difficulty', (n_activities,), dtype), fill_value=0.5, mask=activity_mask
+    ))
+
+    if use_numba:
+        _fused_scores(
+            np.ascontiguousarray(guess, dtype=dtype), np.ascontiguousarray(slip, dtype=dtype), epsilon, v,
+            last_relevance, has_last, L, difficulty_log_odds, W_d, W_c, out
+        )
+        return out
+
+    relevance = _relevance(
+        guess, slip, epsilon,
+        workspace.get('relevance', (n_activities, n_kcs), dtype),
+        workspace.get('scratch', (n_activities, n_kcs), dtype),
+        workspace.get('mask', (n_activities, n_kcs), np.bool_),
+    )
+    # W_p * P + W_r * R
+    np.dot(relevance, v, out=out)
+    activity_scratch = workspace.get('activity_scratch', (n_activities,), dtype)
+    # C: sqrt(relevance . last_relevance); weights are paired with subscores in the same order as
+    # alosi.engine.recommendation_score, i.e. W_d is applied to C and W_c to D
+    if has_last:
+        np.sqrt(np.dot(relevance, last_relevance, out=activity_scratch), out=activity_scratch)
+        np.add(out, np.multiply(activity_scratch, W_d, out=activity_scratch), out=out)
+    # D: -sum_k relevance[q,k] * |L[k] - difficulty[q]|
+    distance = np.subtract.outer(difficulty_log_odds, L, out=workspace.get('scratch', (n_activities, n_kcs), dtype))
+    np.abs(distance, out=distance)
+    np.multiply(distance, relevance, out=distance)
+    np.sum(distance, axis=1, out=activity_scratch)
+    np.subtract(out, np.multiply(activity_scratch, W_c, out=activity_scratch), out=out)
+    return out
+
+
 def get_engine(engine_settings=None):
     """
     Get relevant engine for learner based on their experimental group
@@ -64,7 +313,7 @@ def get_engine(engine_settings=None):
             W_p=2.0,  # readiness
             W_d=0.5,  # difficulty
         )
-    return AdaptiveEngine(engine_settings)
+    return AdaptiveEngine(engine_settings, pruning_epsilon=engine_settings.pruning_epsilon)
 
 
 class NonAdaptiveEngine(object):
@@ -72,8 +321,12 @@ class NonAdaptiveEngine(object):
     Engine that serves only activities that have the 'nonadaptive_order' 
     field populated (and in the order specified by that field)
     """
-    def __init__(self):
-        pass
+    def __init__(self, mastery_engine=None):
+        """
+        :param mastery_engine: AdaptiveEngine used to track learner mastery from scores and compute grades, so that
+            mastery is comparable with adaptive experimental groups; mastery is not tracked if None
+        """
+        self.mastery_engine = mastery_engine
 
     def initialize_learner(self, learner):
         """
@@ -82,18 +335,75 @@ class NonAdaptiveEngine(object):
         """
         pass
 
+    def update_from_score(self, learner, activity, score):
+        """
+        Update learner mastery from score, if mastery is tracked
+        :param learner: Learner model instance
+        :param activity: Activity model instance
+        :param score: float
+        """
+        if self.mastery_engine is not None:
+            self.mastery_engine.update_from_score(learner, activity, score)
+
+    def grade(self, learner, collection):
+        """
+        Mastery-based learner grade for collection (see AdaptiveEngine.grade)
+        :param learner: Learner model instance
+        :param collection: Collection model instance
+        :return: float, or None if mastery is not tracked
+        """
+        if self.mastery_engine is None:
+            return None
+        return self.mastery_engine.grade(learner, collection)
+
+    def grade_many(self, learner_pks, collection):
+        """
+        Mastery-based grades for multiple learners (see AdaptiveEngine.grade_many)
+        :param learner_pks: list of learner pks
+        :param collection: Collection model instance
+        :return: np.array of grades, or list of None if mastery is not tracked
+        """
+        if self.mastery_engine is None:
+            return [None] * len(learner_pks)
+        return self.mastery_engine.grade_many(learner_pks, collection)
+
     def recommend(self, learner, collection, sequence=None):
         """
         Recommend activity according to 'nonadaptive_order' field
+        The next activity is found by advancing the learner's cursor into the collection's precomputed
+        non-adaptive sequence past activities in the learner's sequence history (see NonAdaptiveSequenceCache).
         :param learner: Learner model instance
         :param collection: Collection model instance
-        :param sequence: list of activity dicts, learner's sequence history
-        :return: n/a
+        :param sequence: list of activity objects, learner's sequence history
+        :return: Activity model instance, or None if all non-adaptive activities have been seen
         """
+        recommendations = self.recommend_top_n(learner, collection, 1, sequence)
+        return recommendations[0][0] if recommendations else None
 
-        activity_urls = [item['activity'] for item in sequence]
-        candidate_activities = collection.activity_set.exclude(url__in=activity_urls)
-        return candidate_activities.first()
+    def recommend_top_n(self, learner, collection, n, sequence=None):
+        """
+        Return next n unseen activities according to 'nonadaptive_order' field
+        :param learner: Learner model instance
+        :param collection: Collection model instance
+        :param n: int, number of items to return
+        :param sequence: list of activity objects, learner's sequence history
+        :return: list of (Activity instance, score) tuples; score is always None
+        """
+        seen = {activity.pk for activity in sequence or []}
+        for attempt in range(2):
+            order, position = nonadaptive_sequence_cache.advance(learner.pk, collection.pk, seen)
+            pks = []
+            for pk in order[position:]:
+                if len(pks) == n:
+                    break
+                if pk not in seen:
+                    pks.append(int(pk))
+            activities = Activity.objects.in_bulk(pks)
+            if len(activities) == len(pks):
+                return [(activities[pk], None) for pk in pks]
+            # activities deleted in another process; reload sequence
+            nonadaptive_sequence_cache.clear_orders()
+        return [(activities[pk], None) for pk in pks if pk in activities]
 
 
 class AdaptiveEngine(BaseAlosiAdaptiveEngine):
@@ -102,47 +412,96 @@ class AdaptiveEngine(BaseAlosiAdaptiveEngine):
     """
     
 
-    def __init__(self, engine_settings, recommendation_score_function=recommendation_score):
+    def __init__(self, engine_settings, recommendation_score_function=recommendation_score_kernel,
+                 sparse_density_threshold=SPARSE_DENSITY_THRESHOLD, incremental_scores=False, pruning_epsilon=None):
         """
         :param engine_settings: EngineSettings model instance
-        :param recommendation_score_function: function that returns a list of scores (e.g. alosi.engine.recommendation_score)
+        :param recommendation_score_function: function that returns a list of scores (e.g. recommendation_score_kernel
+            or alosi.engine.recommendation_score), used for collections with dense tagging
+        :param sparse_density_threshold: float, sparse parameter representation and scoring is used when the fraction
+            of tagged activity-kc pairs among valid activities/kcs is below this value
+        :param incremental_scores: bool, whether to compute scores from cached per-learner score vectors
+            (see get_incremental_scores()) instead of recomputing them from parameters on each recommendation;
+            cached parameters are only refreshed on parameter writes in this process and on ParameterVersion changes
+            (see caches.ScoreVectorCache), and incremental scores do not use recommendation_score_function or
+            sparse scoring
+        :param pruning_epsilon: float or None; if not None, recommend() uses pruned_recommend(), which skips scoring
+            activities that can not beat the best score found by more than pruning_epsilon. Pruned recommendation
+            computes scores with sparse.pruned_recommendation, so it can not be combined with a custom
+            recommendation_score_function.
+        :raises: ValueError if both pruning_epsilon and a custom recommendation_score_function are given
         """
+        if pruning_epsilon is not None and recommendation_score_function is not recommendation_score_kernel:
+            raise ValueError("pruning_epsilon can not be used with a custom recommendation_score_function")
         self.engine_settings = engine_settings
         self.mastery_threshold = 0.9  # probability threshold
         self.recommendation_score_function = recommendation_score_function
+        self.sparse_density_threshold = sparse_density_threshold
+        self.incremental_scores = incremental_scores
+        self.pruning_epsilon = pruning_epsilon
 
     @staticmethod
-    def get_tagging_parameter_values(model, activities=None, knowledge_components=None, default_value=0.1):
+    def get_tagging_parameters(activities=None, knowledge_components=None, fields=('guess', 'slip', 'transit'),
+                               defaults=None):
         """
-        Base method for retrieving parameters associated with a activity-kc relationship
-        e.g. guess, slip, transit
-        If activity is tagged with a kc, but there is no guess/slip values initialized for that pair,
-            this method fills the output with default values
-        # TODO consider handling activity (model instance) input in addition to queryset
-        :param model: Model, django model class representing parameter (either Guess, Slip, Transit)
-        :param activities: queryset of Activity model instances (convert model to qset before using this method)
+        Retrieve parameters associated with activity-kc relationships, reading all requested parameters with a single
+        ActivityKCParameter query
+        If activity is tagged with a kc, but there is no parameter value stored for that pair,
+            this method fills the output with the default value
+        :param activities: queryset of Activity model instances
         :param knowledge_components: queryset of KnowledgeComponent model instances
-        :param default_value: float, default value to use for parameter if value missing
-        :return: np.ndarray of size [len(activities) x len(knowledge_components)]
+        :param fields: list/tuple of parameter field names ('guess', 'slip' and/or 'transit')
+        :param defaults: dict of field name -> default value, overriding PARAMETER_DEFAULTS
+        :return: dict of field name -> np.ndarray of size [len(activities) x len(knowledge_components)]
         """
         # default to entire set of objects if queryset not specified
         if activities is None:
             activities = Activity.objects.order_by('pk')
         if knowledge_components is None:
             knowledge_components = KnowledgeComponent.objects.order_by('pk')
+        activity_map = pk_index_map(activities)
+        kc_map = pk_index_map(knowledge_components)
+        shape = (len(activity_map), len(kc_map))
 
         # retrieve parameter values
-        output = Matrix(model)[activities, knowledge_components].values()
+        output = {field: np.full(shape, np.nan) for field in fields}
+        values_list = ActivityKCParameter.objects.filter(
+            activity__in=activities,
+            knowledge_component__in=knowledge_components
+        ).values_list('activity_id', 'knowledge_component_id', *fields)
+        for row in values_list:
+            row_idx, col_idx = activity_map[row[0]], kc_map[row[1]]
+            for field, value in zip(fields, row[2:]):
+                if value is not None:
+                    output[field][row_idx, col_idx] = value
 
         # tagging matrix is the same size as the output (activity x kcs)
         # where element = 1 if activity-kc relation exists, else 0
         tagging_matrix = get_tagging_matrix(activities, knowledge_components)
 
         # for activity-kc relationships with no parameter provided, replace with default value
-        output[np.where(tagging_matrix == 1 & np.isnan(output))] = default_value
+        defaults = dict(PARAMETER_DEFAULTS, **(defaults or {}))
+        for field in fields:
+            output[field][np.where((tagging_matrix == 1) & np.isnan(output[field]))] = defaults[field]
 
         return output
 
+    @classmethod
+    def get_tagging_parameter_values(cls, model, activities=None, knowledge_components=None, default_value=None):
+        """
+        Base method for retrieving a parameter associated with a activity-kc relationship
+        e.g. guess, slip, transit
+        :param model: Model, django model class representing parameter (either Guess, Slip, Transit)
+        :param activities: queryset of Activity model instances (convert model to qset before using this method)
+        :param knowledge_components: queryset of KnowledgeComponent model instances
+        :param default_value: float, default value to use for parameter if value missing (default from
+            PARAMETER_DEFAULTS)
+        :return: np.ndarray of size [len(activities) x len(knowledge_components)]
+        """
+        field = model.parameter_field
+        defaults = {field: default_value} if default_value is not None else None
+        return cls.get_tagging_parameters(activities, knowledge_components, fields=(field,), defaults=defaults)[field]
+
     def get_guess(self, activities=None, knowledge_components=None):
         """
         Get guess matrix, or row(s) of guess matrix if activity specified
@@ -195,6 +554,45 @@ class AdaptiveEngine(BaseAlosiAdaptiveEngine):
         """
         return Matrix(PrerequisiteRelation)[knowledge_components, knowledge_components].values()
 
+    @staticmethod
+    def get_sparse_relevance(activity_map, kc_map, activities, knowledge_components):
+        """
+        Get relevance matrix in sparse form, computed from guess/slip values of tagged activity-kc pairs
+        Sparse counterpart of calculating relevance from get_guess() and get_slip() output
+        :param activity_map: dict of activity pk -> 0-index (row axis)
+        :param kc_map: dict of kc pk -> 0-index (col axis)
+        :param activities: Activity queryset, same activities as activity_map
+        :param knowledge_components: KnowledgeComponent queryset, same KCs as kc_map
+        :return: CSRMatrix of size [len(activities) x len(knowledge_components)]
+        """
+        shape = (len(activity_map), len(kc_map))
+        tagging = get_sparse_tagging(activity_map, kc_map, activities, knowledge_components)
+        # guess and slip values are read with one query, and split into triples of stored (non-null) values
+        rows = list(ActivityKCParameter.objects.filter(
+            activity__in=activities,
+            knowledge_component__in=knowledge_components
+        ).order_by('pk').values_list('activity_id', 'knowledge_component_id', 'guess', 'slip'))
+        parameters = [
+            get_sparse_triples([row[:2] + (row[i],) for row in rows if row[i] is not None], activity_map, kc_map)
+            for i in (2, 3)
+        ]
+        return sparse_relevance(shape, tagging, parameters[0], parameters[1], GUESS_DEFAULT, SLIP_DEFAULT)
+
+    @staticmethod
+    def get_sparse_prereqs(kc_map, knowledge_components):
+        """
+        Get prerequisite matrix in sparse form
+        :param kc_map: dict of kc pk -> 0-index
+        :param knowledge_components: KnowledgeComponent queryset, same KCs as kc_map
+        :return: (# LOs) x (# LOs) CSRMatrix
+        """
+        values_list = PrerequisiteRelation.objects.filter(
+            prerequisite__in=knowledge_components,
+            knowledge_component__in=knowledge_components
+        ).order_by('pk').values_list('prerequisite_id', 'knowledge_component_id', 'value')
+        rows, cols, values = get_sparse_triples(values_list, kc_map, kc_map)
+        return CSRMatrix.from_triples(rows, cols, values, (len(kc_map), len(kc_map)))
+
     @staticmethod
     def get_last_attempted_activity(learner):
         """
@@ -277,13 +675,19 @@ class AdaptiveEngine(BaseAlosiAdaptiveEngine):
         activity_qset = Activity.objects.filter(pk=activity.pk)
 
         # flatten from ndarray to vector before passing to calculation methods
-        guess = self.get_guess(activity_qset, knowledge_components).flatten()
-        slip = self.get_slip(activity_qset, knowledge_components).flatten()
-        transit = self.get_transit(activity_qset, knowledge_components).flatten()
+        parameters = self.get_tagging_parameters(activity_qset, knowledge_components)
+        guess = parameters['guess'].flatten()
+        slip = parameters['slip'].flatten()
+        transit = parameters['transit'].flatten()
 
         new_mastery_odds = calculate_mastery_update(mastery_odds, score, guess, slip, transit, EPSILON)
         # save new mastery values in mastery data store
         self.update_learner_mastery(learner, new_mastery_odds, knowledge_components)
+        # update cached score vectors of learner for changed kcs
+        kc_pks = [kc.pk for kc in knowledge_components]
+        for vector in score_vector_cache.get_learner_vectors(learner.pk):
+            with vector.lock:
+                vector.update_knowledge_components(kc_pks, inverse_odds(new_mastery_odds))
 
     @staticmethod
     def update_learner_mastery(learner, new_mastery_odds, knowledge_components=None):
@@ -338,18 +742,63 @@ class AdaptiveEngine(BaseAlosiAdaptiveEngine):
         """
         # retrieve or calculate features
         last_attempted_activity = self.get_last_attempted_activity(learner)
+        parameters = self.get_tagging_parameters(valid_activities, valid_kcs, fields=('guess', 'slip'))
         if last_attempted_activity:
-            # convert to queryset to avoid dimension mismatch between output and tagging matrix in get_tagging_parameter_values()
+            # convert to queryset to avoid dimension mismatch between output and tagging matrix in get_tagging_parameters()
             last_attempted_activity_qs = Activity.objects.filter(pk=last_attempted_activity.pk)
+            last_attempted_parameters = self.get_tagging_parameters(
+                last_attempted_activity_qs, valid_kcs, fields=('guess', 'slip'))
 
         # construct param dict
         return {
-            'guess': self.get_guess(valid_activities, valid_kcs),
-            'slip': self.get_slip(valid_activities, valid_kcs),
+            'guess': parameters['guess'],
+            'slip': parameters['slip'],
             'difficulty': self.get_difficulty(valid_activities),
             'prereqs': self.get_prereqs(valid_kcs),
-            'last_attempted_guess': self.get_guess(last_attempted_activity_qs, valid_kcs)[0] if last_attempted_activity else None,
-            'last_attempted_slip': self.get_slip(last_attempted_activity_qs, valid_kcs)[0] if last_attempted_activity else None,
+            'last_attempted_guess': last_attempted_parameters['guess'][0] if last_attempted_activity else None,
+            'last_attempted_slip': last_attempted_parameters['slip'][0] if last_attempted_activity else None,
+            'learner_mastery': self.get_learner_mastery(learner, valid_kcs),
+            'r_star': self.engine_settings.r_star,
+            'L_star': self.engine_settings.L_star,
+            'W_p': self.engine_settings.W_p,
+            'W_r': self.engine_settings.W_r,
+            'W_d': self.engine_settings.W_d,
+            'W_c': self.engine_settings.W_c,
+        }
+
+    def get_sparse_recommend_params(self, learner, valid_activities, valid_kcs):
+        """
+        Retrieve features/params needed for doing recommendation, using sparse relevance and prerequisite matrices
+        Sparse counterpart of get_recommend_params(); output is used as input to sparse_recommendation_score()
+        :param learner: Learner model instance
+        :param valid_activities: Queryset of Activity objects
+        :param valid_kcs: Queryset of KnowledgeComponent objects
+        :return: dictionary with following keys:
+            relevance: QxK CSRMatrix, relevance values for activities
+            difficulty: 1xQ np.array, difficulty values for activities
+            prereqs: KxK CSRMatrix, prerequisite matrix
+            last_attempted_relevance: 1xK vector of relevance values for last attempted activity (or None)
+            learner_mastery: 1xK vector of learner mastery values
+            r_star, L_star, W_p, W_r, W_d, W_c: engine settings values
+        """
+        activity_map = pk_index_map(valid_activities)
+        kc_map = pk_index_map(valid_kcs)
+        last_attempted_activity = self.get_last_attempted_activity(learner)
+        if last_attempted_activity:
+            last_attempted_relevance = self.get_sparse_relevance(
+                {last_attempted_activity.pk: 0},
+                kc_map,
+                Activity.objects.filter(pk=last_attempted_activity.pk),
+                valid_kcs
+            ).getrow(0)
+        else:
+            last_attempted_relevance = None
+
+        return {
+            'relevance': self.get_sparse_relevance(activity_map, kc_map, valid_activities, valid_kcs),
+            'difficulty': self.get_difficulty(valid_activities),
+            'prereqs': self.get_sparse_prereqs(kc_map, valid_kcs),
+            'last_attempted_relevance': last_attempted_relevance,
             'learner_mastery': self.get_learner_mastery(learner, valid_kcs),
             'r_star': self.engine_settings.r_star,
             'L_star': self.engine_settings.L_star,
@@ -359,10 +808,201 @@ class AdaptiveEngine(BaseAlosiAdaptiveEngine):
             'W_c': self.engine_settings.W_c,
         }
 
+    def use_sparse(self, valid_activities, valid_kcs):
+        """
+        Determine whether to use sparse parameter representation, based on density of tagging matrix
+        :param valid_activities: Queryset of Activity objects
+        :param valid_kcs: Queryset of KnowledgeComponent objects
+        :return: bool
+        """
+        size = valid_activities.count() * valid_kcs.count()
+        if not size:
+            return False
+        n_tagged = Activity.knowledge_components.through.objects.filter(
+            activity__in=valid_activities,
+            knowledgecomponent__in=valid_kcs
+        ).count()
+        return n_tagged / size < self.sparse_density_threshold
+
+    def get_collection_score_params(self, collection):
+        """
+        Get learner-independent parameters for computing score vectors over all activities in collection
+        :param collection: Collection model instance
+        :return: CollectionScoreParams
+        """
+        activities = collection.activity_set.order_by('pk')
+        knowledge_components = get_kcs_in_activity_set(activities).order_by('pk')
+        activity_map = pk_index_map(activities)
+        kc_map = pk_index_map(knowledge_components)
+        return CollectionScoreParams(
+            activity_pks=list(activity_map),
+            kc_pks=list(kc_map),
+            relevance=self.get_sparse_relevance(activity_map, kc_map, activities, knowledge_components),
+            prereqs=self.get_sparse_prereqs(kc_map, knowledge_components),
+            difficulty=self.get_difficulty(activities),
+            mastery_prior=list(knowledge_components.values_list('mastery_prior', flat=True)),
+        )
+
+    def get_cached_score_params(self, collection, valid_activity_pks, valid_kc_pks):
+        """
+        Get score parameters for collection from process cache, computing them if not cached or if they do not
+        include all valid activities/kcs (e.g. collection changed in another process)
+        :param collection: Collection model instance
+        :param valid_activity_pks: list of activity pks
+        :param valid_kc_pks: list of kc pks
+        :return: CollectionScoreParams
+        """
+        params = score_vector_cache.get_params(collection.pk)
+        if params is None or not params.covers(valid_activity_pks, valid_kc_pks):
+            params = self.get_collection_score_params(collection)
+            score_vector_cache.set_params(collection.pk, params)
+        return params
+
     @staticmethod
-    def get_valid_activities(learner, collection, sequence=[]):
+    def get_params_learner_mastery(learner, params):
+        """
+        Get learner mastery for the KCs of score parameters
+        :param learner: Learner model instance
+        :param params: CollectionScoreParams
+        :return: 1 x (# LOs) np.array vector of mastery (probability) values, with kc priors for missing values
+        """
+        learner_mastery = np.copy(params.mastery_prior)
+        mastery_values = Mastery.objects.filter(learner=learner).order_by('pk').values_list(
+            'knowledge_component_id', 'value')
+        for kc_pk, value in mastery_values:
+            if kc_pk in params.kc_map:
+                learner_mastery[params.kc_map[kc_pk]] = value
+        return learner_mastery
+
+    def get_params_last_attempted_relevance(self, last_attempted_activity, params):
+        """
+        Get relevance values of last attempted activity for the KCs of score parameters
+        :param last_attempted_activity: Activity model instance, or None
+        :param params: CollectionScoreParams
+        :return: 1 x (# LOs) np.array vector of relevance values, zero if there is no last attempted activity
+        """
+        if last_attempted_activity is None:
+            return np.zeros(len(params.kc_map))
+        if last_attempted_activity.pk in params.activity_map:
+            return params.relevance.getrow(params.activity_map[last_attempted_activity.pk])
+        return self.get_sparse_relevance(
+            {last_attempted_activity.pk: 0},
+            params.kc_map,
+            Activity.objects.filter(pk=last_attempted_activity.pk),
+            KnowledgeComponent.objects.filter(pk__in=list(params.kc_map))
+        ).getrow(0)
+
+    @staticmethod
+    def get_params_kc_mask(params, valid_kc_pks):
+        """
+        Boolean vector of valid KCs along the KC axis of score parameters
+        """
+        kc_mask = np.zeros(len(params.kc_map), dtype=bool)
+        kc_mask[[params.kc_map[pk] for pk in valid_kc_pks]] = True
+        return kc_mask
+
+    def get_incremental_scores(self, learner, collection, valid_activities, valid_kcs):
+        """
+        Compute recommendation scores for valid activities from the learner's cached score vector for the collection
+        The score vector covers all activities in the collection, and is updated from the current learner mastery,
+        valid kcs and last attempted activity; only activities tagged with changed kcs are recomputed.
+        :param learner: Learner model instance
+        :param collection: Collection model instance
+        :param valid_activities: Queryset of Activity objects
+        :param valid_kcs: Queryset of KnowledgeComponent objects
+        :return: np.array of scores, in the order of valid_activities
+        """
+        valid_activity_pks = list(valid_activities.values_list('pk', flat=True))
+        valid_kc_pks = list(valid_kcs.values_list('pk', flat=True))
+        params = self.get_cached_score_params(collection, valid_activity_pks, valid_kc_pks)
+        kc_mask = self.get_params_kc_mask(params, valid_kc_pks)
+        learner_mastery = self.get_params_learner_mastery(learner, params)
+        last_attempted_activity = self.get_last_attempted_activity(learner)
+        last_attempted_activity_pk = last_attempted_activity.pk if last_attempted_activity else None
+
+        vector = score_vector_cache.get(learner.pk, collection.pk)
+        if vector is not None and (vector.r_star, vector.L_star) != (self.engine_settings.r_star,
+                                                                      self.engine_settings.L_star):
+            vector = None
+        if vector is None or vector.last_attempted_activity_pk != last_attempted_activity_pk:
+            last_attempted_relevance = self.get_params_last_attempted_relevance(last_attempted_activity, params)
+        else:
+            last_attempted_relevance = None
+
+        if vector is None:
+            vector = LearnerScoreVector(params, learner_mastery, kc_mask, last_attempted_relevance,
+                                        self.engine_settings.r_star, self.engine_settings.L_star)
+            vector.last_attempted_activity_pk = last_attempted_activity_pk
+            score_vector_cache.set(learner.pk, collection.pk, vector)
+        with vector.lock:
+            vector.update(learner_mastery, kc_mask, last_attempted_relevance)
+            vector.last_attempted_activity_pk = last_attempted_activity_pk
+            scores = vector.scores(self.engine_settings.W_p, self.engine_settings.W_r, self.engine_settings.W_d,
+                                   self.engine_settings.W_c)
+        return scores[[params.activity_map[pk] for pk in valid_activity_pks]]
+
+    def pruned_recommend(self, learner, collection, sequence=[]):
+        """
+        Return top item by recommendation score, scoring only activities whose score upper bound can beat the best
+        score found so far (see sparse.pruned_recommendation); the returned activity's score is within
+        pruning_epsilon of the top score
+        :param learner: Learner model instance
+        :param collection: Collection model instance
+        :param sequence: list of activity objects, learner's sequence history
+        :return: Activity instance
+        """
+        valid_activities = self.get_valid_activities(learner, collection, sequence)
+        valid_kcs = get_kcs_in_activity_set(valid_activities).order_by('pk')
+        valid_activity_pks = list(valid_activities.values_list('pk', flat=True))
+        if not valid_activity_pks:
+            log.debug("No valid activities left: {}".format(collection))
+            return None
+        if len(valid_activity_pks) == 1 or not valid_kcs.exists():
+            # base cases, as in recommendation_score(): single valid activity, or random activity if no KCs
+            return Activity.objects.get(pk=random.choice(valid_activity_pks))
+        valid_kc_pks = list(valid_kcs.values_list('pk', flat=True))
+        params = self.get_cached_score_params(collection, valid_activity_pks, valid_kc_pks)
+        indices, score, n_scored = pruned_recommendation(
+            relevance=params.relevance,
+            learner_mastery=self.get_params_learner_mastery(learner, params),
+            prereqs=params.prereqs,
+            r_star=self.engine_settings.r_star,
+            L_star=self.engine_settings.L_star,
+            difficulty=params.difficulty_values,
+            W_p=self.engine_settings.W_p,
+            W_r=self.engine_settings.W_r,
+            W_d=self.engine_settings.W_d,
+            W_c=self.engine_settings.W_c,
+            last_attempted_relevance=self.get_params_last_attempted_relevance(
+                self.get_last_attempted_activity(learner), params),
+            candidates=[params.activity_map[pk] for pk in valid_activity_pks],
+            kc_mask=self.get_params_kc_mask(params, valid_kc_pks),
+            relevance_columns=params.relevance_columns,
+            epsilon=self.pruning_epsilon,
+        )
+        log.debug("Pruned recommendation scored {} of {} activities".format(n_scored, len(valid_activity_pks)))
+        # break tie with random selection
+        return Activity.objects.get(pk=params.activity_pks[random.choice(indices)])
+
+    def get_unmastered_kcs(self, learner, knowledge_components):
+        """
+        Subset of knowledge components that learner has not mastered yet, i.e. mastery log odds below L_star
+        :param learner: Learner model instance
+        :param knowledge_components: KnowledgeComponent queryset
+        :return: KnowledgeComponent queryset
+        """
+        knowledge_components = knowledge_components.order_by('pk')
+        L = np.log(odds(self.get_learner_mastery(learner, knowledge_components)))
+        kc_pks = knowledge_components.values_list('pk', flat=True)
+        return KnowledgeComponent.objects.filter(
+            pk__in=[pk for pk, value in zip(kc_pks, L) if not value >= self.engine_settings.L_star]
+        )
+
+    def get_valid_activities(self, learner, collection, sequence=[]):
         """
         Determine valid activities that recommendation can output
+        If engine settings has stop_on_mastery set, activities not tagged with any unmastered KC are excluded,
+        so no activities are valid once all collection KCs are mastered
         :param learner: Learner model instance
         :param collection: Collection model instance
         :param sequence: list of activity objects, learner's sequence history
@@ -377,6 +1017,13 @@ class AdaptiveEngine(BaseAlosiAdaptiveEngine):
         # somewhat redundant but this addresses non-problem activities that don't have associated grades
         # TODO would need to adjust this if we want to support activity repetition
         valid_activities = valid_activities.exclude(pk__in=[activity.pk for activity in sequence])
+        # exclude activities that would only practice mastered KCs (collections without KCs are not affected)
+        collection_kcs = get_kcs_in_activity_set(collection.activity_set)
+        if self.engine_settings.stop_on_mastery and collection_kcs.exists():
+            unmastered_kcs = self.get_unmastered_kcs(learner, collection_kcs)
+            valid_activities = valid_activities.filter(
+                pk__in=Activity.objects.filter(knowledge_components__in=unmastered_kcs).values('pk')
+            )
         # remove activities whose prerequisites are not satisfied yet (this should be the last filter)
         valid_activities = valid_activities.exclude(prerequisite_activities__in=valid_activities)
         return valid_activities
@@ -410,11 +1057,15 @@ class AdaptiveEngine(BaseAlosiAdaptiveEngine):
             # return random.choice(valid_activities)
             return {activity: random.random() for activity in valid_activities}
 
-        # get relevant model parameters
-        recommendation_params = self.get_recommend_params(learner, valid_activities, valid_kcs)
-
-        # compute recommendation scores for activities
-        scores = self.recommendation_score_function(**recommendation_params)
+        # get relevant model parameters and compute recommendation scores for activities
+        if self.incremental_scores:
+            scores = self.get_incremental_scores(learner, collection, valid_activities, valid_kcs)
+        elif self.use_sparse(valid_activities, valid_kcs):
+            recommendation_params = self.get_sparse_recommend_params(learner, valid_activities, valid_kcs)
+            scores = sparse_recommendation_score(**recommendation_params)
+        else:
+            recommendation_params = self.get_recommend_params(learner, valid_activities, valid_kcs)
+            scores = self.recommendation_score_function(**recommendation_params)
 
         return {activity: score for activity, score in zip(valid_activities, scores)}
 
@@ -426,6 +1077,8 @@ class AdaptiveEngine(BaseAlosiAdaptiveEngine):
         :param sequence: list of activity objects, learner's sequence history
         :return: Activity instance
         """
+        if self.pruning_epsilon is not None:
+            return self.pruned_recommend(learner, collection, sequence)
         # activity_scores is a dict of activity object keys with corresponding score values
         activity_scores = self.recommendation_score(learner, collection, sequence)
         # case: no valid activities left to recommend (activity_scores will be an empty dict)
@@ -438,6 +1091,27 @@ class AdaptiveEngine(BaseAlosiAdaptiveEngine):
         # break tie with random selection
         return random.choice(max_activities)
 
+    def recommend_top_n(self, learner, collection, n, sequence=[]):
+        """
+        Return top n items by computed recommendation score, in order of decreasing score
+        Only the top n scores are ordered (np.argpartition), and ties are broken randomly as in recommend()
+        :param learner: Learner model instance
+        :param collection: Collection model instance
+        :param n: int, number of items to return
+        :param sequence: list of activity objects, learner's sequence history
+        :return: list of (Activity instance, score) tuples; empty if no valid activities are left
+        """
+        activity_scores = self.recommendation_score(learner, collection, sequence)
+        if not activity_scores:
+            return []
+        activities = list(activity_scores)
+        random.shuffle(activities)
+        scores = np.array([activity_scores[activity] for activity in activities], dtype=np.float64)
+        n = min(n, len(activities))
+        top = np.argpartition(-scores, n - 1)[:n]
+        top = top[np.argsort(-scores[top], kind='mergesort')]
+        return [(activities[i], float(scores[i])) for i in top]
+
     def grade(self, learner, collection):
         """
         Generate learner grade based on masteries that bridge can query
@@ -452,15 +1126,64 @@ class AdaptiveEngine(BaseAlosiAdaptiveEngine):
         :return: calculated student grade for collection
         :rtype: float
         """
-        # get relevant kcs
-        kcs = get_kcs_in_activity_set(collection.activity_set)
-        # get student masteries for kcs (current value or prior if no value)
-        learner_mastery = self.get_learner_mastery(learner, kcs)
-        priors = np.array([kc.mastery_prior for kc in kcs])
+        return float(self.grade_many([learner.pk], collection)[0])
+
+    def grade_many(self, learner_pks, collection):
+        """
+        Generate grades (see grade()) for multiple learners, from a single fetch of their stored masteries
+        :param learner_pks: list of learner pks; pks without stored masteries (e.g. None) are graded 0.0
+        :param collection: collection model instance
+        :return: np.array of grades, one per learner; np.nan if the collection has no tagged KCs
+        """
+        # get relevant kcs and their priors
+        kc_pks, priors = [], []
+        for kc_pk, prior in get_kcs_in_activity_set(collection.activity_set).values_list('pk', 'mastery_prior'):
+            kc_pks.append(kc_pk)
+            priors.append(prior)
+        priors = np.array(priors, dtype=np.float64)
+        # stored masteries of learners (rows) for kcs (columns); kcs without a stored mastery are at their prior and
+        # have a subscore of 0
+        masteries = get_mastery_matrix(learner_pks, kc_pks)
+        stored = ~np.isnan(masteries)
         # TODO may want to guard against situation where we divide by zero, by checking mastery_threshold > prior
-        score = ((np.maximum(learner_mastery, priors) - priors)/(self.mastery_threshold - priors)).mean()
-        score = min(max(score, 0.), 1.)
-        return score
+        with np.errstate(divide='ignore', invalid='ignore'):
+            subscores = np.where(
+                stored,
+                (np.maximum(masteries, priors) - priors) / (self.mastery_threshold - priors),
+                0.0
+            )
+        if not kc_pks:
+            return np.full(len(learner_pks), np.nan)
+        return np.clip(subscores.sum(axis=1) / len(kc_pks), 0., 1.)
+
+
+def get_mastery_matrix(learner_pks, kc_pks, batch_size=MASTERY_QUERY_BATCH_SIZE):
+    """
+    Stored mastery values of learners for kcs, fetched with one query per batch_size learners
+    :param learner_pks: list of learner pks, defines row axis; pks without stored masteries (e.g. None) give rows of np.nan
+    :param kc_pks: list of kc pks, defines column axis
+    :param batch_size: int, maximum number of learners per query
+    :return: (# learners) x (# kcs) np.array of mastery values, np.nan where no mastery value is stored
+    """
+    masteries = np.full((len(learner_pks), len(kc_pks)), np.nan)
+    if not kc_pks:
+        return masteries
+    learner_map = {}
+    for i, pk in enumerate(learner_pks):
+        if pk is not None:
+            learner_map.setdefault(pk, []).append(i)
+    kc_map = {pk: i for i, pk in enumerate(kc_pks)}
+    unique_learner_pks = list(learner_map)
+    for start in range(0, len(unique_learner_pks), batch_size):
+        mastery_values = (Mastery.objects
+                          .filter(learner__in=unique_learner_pks[start:start + batch_size],
+                                  knowledge_component__in=kc_pks)
+                          .order_by('pk')
+                          .values_list('learner_id', 'knowledge_component_id', 'value'))
+        for learner_pk, kc_pk, value in mastery_values:
+            masteries[learner_map[learner_pk], kc_map[kc_pk]] = value
+    return masteries
+
 
 def get_kcs_in_activity_set(activities):
     """
@@ -0,0 +1,312 @@
+"""
+Evaluation of the predictive accuracy of the engine's model parameters (port of prototypes/r_prototype/evaluate.R)
+Score history is replayed in timestamp order through the Bayesian Knowledge Tracing model with the current (or
+candidate) guess/slip/transit parameters: before each attempt, the probability of a correct answer is predicted from
+the learner's mastery (as in MultiplicativeFormulation.predictCorrectness), and mastery is then updated with the score
+(as in AdaptiveEngine.update_from_score). Predictions on held-out scores are compared with the observed scores
+(log-loss, AUC and accuracy), against chance baselines estimated from the remaining (training) scores: the overall mean
+score, and the mean score of each activity.
+
+Scores are read with a server-side iterator ordered by learner and timestamp, and replayed in chunks of learners, with
+the attempts of all learners in a chunk processed together; metrics are accumulated in fixed-size arrays, so memory use
+does not depend on the number of scores.
+"""
+from collections import namedtuple, OrderedDict
+import numpy as np
+from alosi.engine import calculate_mastery_update, odds, EPSILON
+from .models import Activity, ActivityKCParameter, KnowledgeComponent, Score
+from .engines import PARAMETER_DEFAULTS
+from .parameters import ParameterImportError
+from .simulation.bkt import catalog_positions
+
+
+# number of score rows read from the database per fetch
+EVALUATION_CHUNK_SIZE = 10000
+# number of learners replayed together
+EVALUATION_LEARNER_CHUNK_SIZE = 1000
+# number of probability bins used to compute AUC
+AUC_BINS = 10000
+# mastery prior of KCs without a mastery_prior value
+MASTERY_PRIOR_DEFAULT = 0.5
+
+# Model parameters in compressed sparse row layout (as bkt.SyntheticCatalog): the KCs of activity i are
+# kc_indices[kc_indptr[i]:kc_indptr[i+1]], with guess/slip/transit odds at the same positions
+EvaluationParameters = namedtuple('EvaluationParameters', [
+    # activity pk -> activity index
+    'activity_map',
+    'kc_indptr',
+    'kc_indices',
+    'guess',
+    'slip',
+    'transit',
+    # (# KCs) array of mastery prior odds
+    'prior_odds',
+])
+
+
+def load_parameters(overrides=None):
+    """
+    Read model parameters of all tagged activity-kc pairs, with defaults for pairs without a stored value
+    :param overrides: dict of parameter name ('guess', 'slip' or 'transit') -> list of (activity url, kc_id, value)
+        triples (see parameters.read_parameter_file), candidate values used instead of stored values
+    :return: EvaluationParameters
+    :raises: ParameterImportError if overrides reference unknown activities or knowledge components
+    """
+    activity_map = {pk: i for i, pk in enumerate(Activity.objects.order_by('pk').values_list('pk', flat=True))}
+    kcs = list(KnowledgeComponent.objects.order_by('pk').values_list('pk', 'mastery_prior'))
+    kc_map = {pk: i for i, (pk, prior) in enumerate(kcs)}
+    pairs = sorted(
+        (activity_map[activity_pk], kc_map[kc_pk]) for activity_pk, kc_pk in
+        Activity.knowledge_components.through.objects.values_list('activity_id', 'knowledgecomponent_id')
+    )
+    positions = {pair: position for position, pair in enumerate(pairs)}
+    fields = ('guess', 'slip', 'transit')
+    values = {field: np.full(len(pairs), PARAMETER_DEFAULTS[field]) for field in fields}
+    for activity_pk, kc_pk, *row in ActivityKCParameter.objects.values_list(
+            'activity_id', 'knowledge_component_id', *fields):
+        position = positions.get((activity_map[activity_pk], kc_map[kc_pk]))
+        if position is not None:
+            for field, value in zip(fields, row):
+                if value is not None:
+                    values[field][position] = value
+
+    if overrides:
+        activity_urls = dict(Activity.objects.values_list('url', 'pk'))
+        kc_ids = dict(KnowledgeComponent.objects.values_list('kc_id', 'pk'))
+        for field, triples in overrides.items():
+            for url, kc_id, value in triples:
+                if url not in activity_urls or kc_id not in kc_ids:
+                    raise ParameterImportError("Unknown activity or knowledge component: {} {}".format(url, kc_id))
+                # values of untagged pairs are not used by the model
+                position = positions.get((activity_map[activity_urls[url]], kc_map[kc_ids[kc_id]]))
+                if position is not None:
+                    values[field][position] = value
+
+    priors = np.array([prior if prior is not None else MASTERY_PRIOR_DEFAULT for pk, prior in kcs], dtype=float)
+    return EvaluationParameters(
+        activity_map=activity_map,
+        kc_indptr=np.searchsorted([activity for activity, kc in pairs], np.arange(len(activity_map) + 1)),
+        kc_indices=np.array([kc for activity, kc in pairs], dtype=int),
+        guess=values['guess'],
+        slip=values['slip'],
+        transit=values['transit'],
+        prior_odds=odds(priors),
+    )
+
+
+def predict_correctness(mastery_odds, guess, slip, owners, n):
+    """
+    Probability of a correct answer of each of a set of attempts (see MultiplicativeFormulation.predictCorrectness):
+    the odds of a correct answer are the product over the activity's KCs of (L(1-slip) + guess) / (L slip + 1 - guess),
+    with L the mastery odds of the learner and guess/slip probabilities
+    :param mastery_odds: np.array of mastery odds of the attempting learner, for each attempt-kc element
+    :param guess: np.array of guess odds, for each attempt-kc element
+    :param slip: np.array of slip odds, for each attempt-kc element
+    :param owners: np.array of attempt index of each element
+    :param n: int, number of attempts
+    :return: np.array of n probabilities
+    """
+    guess, slip = guess / (1 + guess), slip / (1 + slip)
+    factors = (mastery_odds * (1 - slip) + guess) / (mastery_odds * slip + 1 - guess)
+    correct_odds = np.exp(np.bincount(owners, weights=np.log(factors), minlength=n))
+    return np.clip(correct_odds / (1 + correct_odds), EPSILON, 1 - EPSILON)
+
+
+def binned_auc(positive, negative):
+    """
+    Area under the ROC curve, from counts of positive and negative examples in bins of increasing predicted
+    probability; examples in the same bin count as ties
+    :param positive: np.array of counts of positive examples per bin
+    :param negative: np.array of counts of negative examples per bin
+    :return: float, or None if there are no positive or no negative examples
+    """
+    n_positive, n_negative = positive.sum(), negative.sum()
+    if not n_positive or not n_negative:
+        return None
+    negative_below = np.cumsum(negative) - negative
+    return float(np.sum(positive * (negative_below + 0.5 * negative)) / (n_positive * n_negative))
+
+
+def _log_loss(target_sum, n, p):
+    p = np.clip(p, EPSILON, 1 - EPSILON)
+    return -(target_sum * np.log(p) + (n - target_sum) * np.log(1 - p))
+
+
+class PredictionMetrics(object):
+    """
+    Streaming accumulator of prediction metrics and of the training statistics of chance baselines
+    Scores are the targets of log-loss; an attempt counts as correct (for AUC and accuracy) if its score is >= 0.5,
+    and is predicted correct if its predicted probability is > 0.5.
+    """
+    def __init__(self, n_activities, bins=AUC_BINS):
+        self.bins = bins
+        self.n = 0
+        # evaluated attempts of activities without KCs, which are not predicted
+        self.untagged = 0
+        self.log_loss_sum = 0.0
+        self.accurate = 0
+        self.positive = np.zeros(bins)
+        self.negative = np.zeros(bins)
+        # per-activity sums of evaluated targets, numbers of evaluated and of correct attempts
+        self.target_sums = np.zeros(n_activities)
+        self.counts = np.zeros(n_activities)
+        self.correct_counts = np.zeros(n_activities)
+        # per-activity sums and numbers of training targets
+        self.training_sums = np.zeros(n_activities)
+        self.training_counts = np.zeros(n_activities)
+
+    def add(self, activities, targets, predictions):
+        """
+        Add evaluated attempts
+        :param activities: np.array of activity indices
+        :param targets: np.array of scores
+        :param predictions: np.array of predicted probabilities
+        """
+        correct = targets >= 0.5
+        self.n += len(targets)
+        self.log_loss_sum += float(np.sum(_log_loss(targets, 1, predictions)))
+        self.accurate += int(np.sum((predictions > 0.5) == correct))
+        bins = np.minimum((predictions * self.bins).astype(int), self.bins - 1)
+        self.positive += np.bincount(bins[correct], minlength=self.bins)
+        self.negative += np.bincount(bins[~correct], minlength=self.bins)
+        self.target_sums += np.bincount(activities, weights=targets, minlength=len(self.counts))
+        self.counts += np.bincount(activities, minlength=len(self.counts))
+        self.correct_counts += np.bincount(activities[correct], minlength=len(self.counts))
+
+    def add_training(self, activities, targets):
+        """
+        Add training attempts, used for chance baselines
+        :param activities: np.array of activity indices
+        :param targets: np.array of scores
+        """
+        self.training_sums += np.bincount(activities, weights=targets, minlength=len(self.counts))
+        self.training_counts += np.bincount(activities, minlength=len(self.counts))
+
+    def baseline(self, chance):
+        """
+        Metrics of a predictor of constant probability per activity
+        :param chance: np.array of predicted probability for each activity
+        :return: OrderedDict of metrics
+        """
+        evaluated = self.counts > 0
+        chance, counts = chance[evaluated], self.counts[evaluated]
+        correct_counts, target_sums = self.correct_counts[evaluated], self.target_sums[evaluated]
+        order = np.argsort(chance, kind='mergesort')
+        # activities with equal chance count as ties
+        boundaries = np.flatnonzero(np.diff(chance[order])) + 1
+        positive = np.add.reduceat(correct_counts[order], np.r_[0, boundaries]) if len(order) else np.zeros(0)
+        negative = np.add.reduceat((counts - correct_counts)[order], np.r_[0, boundaries]) if len(order) else \
+            np.zeros(0)
+        return OrderedDict([
+            ('log_loss', float(np.sum(_log_loss(target_sums, counts, chance)) / self.n)),
+            ('auc', binned_auc(positive, negative)),
+            ('accuracy', float(np.sum(np.where(chance > 0.5, correct_counts, counts - correct_counts)) / self.n)),
+        ])
+
+    def result(self):
+        """
+        :return: OrderedDict of metrics of the model and chance baselines, or of counts only if no attempts were
+            evaluated
+        """
+        output = OrderedDict([
+            ('evaluated', self.n),
+            ('untagged', self.untagged),
+            ('training', int(self.training_counts.sum())),
+        ])
+        if not self.n:
+            return output
+        overall_chance = self.training_sums.sum() / self.training_counts.sum() if self.training_counts.sum() else 0.5
+        activity_chance = np.where(
+            self.training_counts > 0, self.training_sums / np.maximum(self.training_counts, 1), overall_chance)
+        output['model'] = OrderedDict([
+            ('log_loss', self.log_loss_sum / self.n),
+            ('auc', binned_auc(self.positive, self.negative)),
+            ('accuracy', self.accurate / self.n),
+        ])
+        output['overall_chance'] = self.baseline(np.full(len(self.counts), overall_chance))
+        output['activity_chance'] = self.baseline(activity_chance)
+        return output
+
+
+def is_holdout_learner(learner_pks, holdout_fraction):
+    """
+    Deterministic pseudo-random split of learners
+    :param learner_pks: np.array of learner pks
+    :param holdout_fraction: float, approximate fraction of learners held out
+    :return: bool np.array
+    """
+    return (np.asarray(learner_pks, dtype=np.uint64) * np.uint64(2654435761) % np.uint64(2 ** 32)) < \
+        holdout_fraction * 2 ** 32
+
+
+def replay_chunk(parameters, metrics, rows, holdout_fraction=None, since=None):
+    """
+    Replay the scores of a chunk of learners, and add predictions and training scores to metrics
+    :param parameters: EvaluationParameters
+    :param metrics: PredictionMetrics
+    :param rows: list of (learner pk, activity pk, score, timestamp) tuples, ordered by learner and timestamp
+    :param holdout_fraction: float, see evaluate_predictions
+    :param since: datetime, see evaluate_predictions
+    """
+    learner_pks = np.array([row[0] for row in rows])
+    activities = np.array([parameters.activity_map[row[1]] for row in rows], dtype=int)
+    scores = np.array([row[2] for row in rows], dtype=float)
+    evaluated = np.ones(len(rows), dtype=bool)
+    if holdout_fraction is not None:
+        evaluated &= is_holdout_learner(learner_pks, holdout_fraction)
+    if since is not None:
+        # scores without timestamp count as earlier
+        evaluated &= np.array([row[3] is not None and row[3] >= since for row in rows])
+    metrics.add_training(activities[~evaluated], scores[~evaluated])
+
+    # rank of each attempt in its learner's history; attempts of equal rank are replayed together
+    unique_pks, learners, counts = np.unique(learner_pks, return_inverse=True, return_counts=True)
+    ranks = np.arange(len(rows)) - np.repeat(np.cumsum(counts) - counts, counts)
+    order = np.argsort(ranks, kind='mergesort')
+    mastery_odds = np.tile(parameters.prior_odds, (len(unique_pks), 1))
+    for attempts in np.split(order, np.cumsum(np.bincount(ranks))[:-1]):
+        owners, positions = catalog_positions(parameters, activities[attempts])
+        learner_rows, kcs = learners[attempts][owners], parameters.kc_indices[positions]
+        guess, slip = parameters.guess[positions], parameters.slip[positions]
+        # activities without KCs are not predicted
+        tagged = np.bincount(owners, minlength=len(attempts)) > 0
+        predicted = attempts[tagged & evaluated[attempts]]
+        metrics.untagged += int(np.sum(~tagged & evaluated[attempts]))
+        if len(predicted):
+            predictions = predict_correctness(mastery_odds[learner_rows, kcs], guess, slip, owners, len(attempts))
+            metrics.add(activities[predicted], scores[predicted], predictions[tagged & evaluated[attempts]])
+        mastery_odds[learner_rows, kcs] = calculate_mastery_update(
+            mastery_odds[learner_rows, kcs], scores[attempts][owners], guess, slip, parameters.transit[positions],
+            EPSILON
+        )
+
+
+def evaluate_predictions(holdout_fraction=None, since=None, parameter_overrides=None,
+                         chunk_size=EVALUATION_CHUNK_SIZE, learner_chunk_size=EVALUATION_LEARNER_CHUNK_SIZE):
+    """
+    Evaluate predictions of correctness of scores, replaying the full score history
+    Scores are evaluated if they belong to held-out learners (if holdout_fraction is given) and are at or after
+    since (if given); all other scores are training scores, used for chance baselines. If neither is given, all scores
+    are evaluated (in-sample) and chance baselines default to 0.5.
+    :param holdout_fraction: float, approximate fraction of learners whose scores are evaluated
+    :param since: datetime, only scores at or after this time are evaluated
+    :param parameter_overrides: candidate parameter values, see load_parameters
+    :param chunk_size: int, number of score rows per database fetch
+    :param learner_chunk_size: int, number of learners replayed together
+    :return: OrderedDict of metrics, see PredictionMetrics.result
+    """
+    parameters = load_parameters(parameter_overrides)
+    metrics = PredictionMetrics(len(parameters.activity_map))
+    rows = Score.objects.order_by('learner_id', 'timestamp', 'pk').values_list(
+        'learner_id', 'activity_id', 'score', 'timestamp').iterator(chunk_size=chunk_size)
+    chunk, n_learners = [], 0
+    for row in rows:
+        if not chunk or row[0] != chunk[-1][0]:
+            if n_learners == learner_chunk_size:
+                replay_chunk(parameters, metrics, chunk, holdout_fraction, since)
+                chunk, n_learners = [], 0
+            n_learners += 1
+        chunk.append(row)
+    if chunk:
+        replay_chunk(parameters, metrics, chunk, holdout_fraction, since)
+    return metrics.result()
@@ -0,0 +1,81 @@
+"""
+Streaming export of large tables as newline-delimited JSON or CSV
+Rows are read with a server-side iterator and written as they are read, so memory use does not depend on table size.
+"""
+import csv
+import io
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
+
+
+# number of rows read from the database per fetch, and written per response chunk
+EXPORT_CHUNK_SIZE = 2000
+
+EXPORT_CONTENT_TYPES = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+
+def _chunks(rows, chunk_size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def ndjson_lines(rows, fields, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Encode rows as newline-delimited JSON objects
+    :param rows: iterable of row tuples
+    :param fields: list of field names, keys of row objects
+    :param chunk_size: int, number of rows per yielded string
+    :return: generator of str
+    """
+    encoder = DjangoJSONEncoder()
+    for chunk in _chunks(rows, chunk_size):
+        yield ''.join(encoder.encode(dict(zip(fields, row))) + '\n' for row in chunk)
+
+
+def csv_lines(rows, fields, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Encode rows as CSV, with a header row
+    :param rows: iterable of row tuples
+    :param fields: list of field names, header row
+    :param chunk_size: int, number of rows per yielded string
+    :return: generator of str
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(fields)
+    for chunk in _chunks(rows, chunk_size):
+        writer.writerows(chunk)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def export_response(queryset, fields, export_format, filename, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Streaming response with queryset rows
+    :param queryset: queryset to export, ordered
+    :param fields: dict of output field name -> queryset field lookup, in output order
+    :param export_format: 'ndjson' or 'csv'
+    :param filename: attachment file name, without extension
+    :param chunk_size: int, number of rows per database fetch and per response chunk
+    :return: StreamingHttpResponse
+    """
+    rows = queryset.values_list(*fields.values()).iterator(chunk_size=chunk_size)
+    encode = ndjson_lines if export_format == 'ndjson' else csv_lines
+    response = StreamingHttpResponse(
+        encode(rows, list(fields), chunk_size=chunk_size),
+        content_type=EXPORT_CONTENT_TYPES[export_format]
+    )
+    response['Content-Disposition'] = 'attachment; filename="{}.{}"'.format(filename, export_format)
+    return response
@@ -0,0 +1,189 @@
+"""
+Incrementally updated recommendation score components
+Score components for every activity in a collection are kept per learner, and updated when learner mastery changes
+using only the relevance columns of the changed KCs, instead of recomputing scores for all activities on each request
+"""
+import threading
+import numpy as np
+from alosi.engine import odds, fillna
+
+
+class CollectionScoreParams(object):
+    """
+    Learner-independent parameters used to compute score components for the activities of a collection
+    """
+    def __init__(self, activity_pks, kc_pks, relevance, prereqs, difficulty, mastery_prior):
+        """
+        :param activity_pks: list of activity pks, defines activity (row) axis
+        :param kc_pks: list of kc pks, defines kc (column) axis
+        :param relevance: QxK CSRMatrix of relevance values
+        :param prereqs: KxK CSRMatrix of prerequisite values
+        :param difficulty: 1xQ vector of activity difficulty values, np.nan if missing; stored as difficulty_values,
+            and as log odds (missing values filled with 0.5) as difficulty
+        :param mastery_prior: 1xK vector of kc mastery prior values, used for KCs without learner mastery value
+        """
+        self.activity_pks = list(activity_pks)
+        self.activity_map = {pk: i for i, pk in enumerate(self.activity_pks)}
+        self.kc_map = {pk: i for i, pk in enumerate(kc_pks)}
+        self.relevance = relevance
+        # column access to relevance, for updating activities tagged with a kc
+        self.relevance_columns = relevance.transpose()
+        self.prereqs = prereqs
+        self.difficulty_values = np.array(difficulty, dtype=np.float64)
+        self.difficulty = np.log(odds(fillna(np.copy(self.difficulty_values), value=0.5)))
+        self.mastery_prior = np.array(mastery_prior, dtype=np.float64)
+
+    def covers(self, activity_pks, kc_pks):
+        """
+        Whether parameters include all of the specified activities and kcs
+        :param activity_pks: iterable of activity pks
+        :param kc_pks: iterable of kc pks
+        :return: bool
+        """
+        return all(pk in self.activity_map for pk in activity_pks) and all(pk in self.kc_map for pk in kc_pks)
+
+
+class LearnerScoreVector(object):
+    """
+    Recommendation score components (substrategies P, R, C, D) of a learner for all activities in a collection
+    Scores are equal to sparse_recommendation_score() output (up to floating point error) for the same inputs.
+    Access from multiple threads should hold the instance lock.
+    """
+    def __init__(self, params, learner_mastery, kc_mask, last_attempted_relevance, r_star, L_star):
+        """
+        :param params: CollectionScoreParams
+        :param learner_mastery: 1xK vector of learner mastery (probability) values
+        :param kc_mask: 1xK boolean vector, KCs of currently valid activities; prerequisite contributions
+            to substrategy P are limited to these KCs
+        :param last_attempted_relevance: 1xK vector of relevance values for last attempted activity, or None
+        :param r_star: Threshold for forgiving lower odds of mastering pre-requisite LOs.
+        :param L_star: Threshold logarithmic odds. If mastery logarithmic odds are >= than L_star, the LO is considered mastered
+        """
+        self.params = params
+        self.r_star = r_star
+        self.L_star = L_star
+        self.lock = threading.Lock()
+        # pk of activity that last_attempted_relevance was computed from
+        self.last_attempted_activity_pk = None
+
+        relevance = params.relevance
+        n_activities, n_kcs = relevance.shape
+        self.learner_mastery = np.array(learner_mastery, dtype=np.float64)
+        self.kc_mask = np.array(kc_mask, dtype=np.bool_)
+        self.L = np.log(odds(self.learner_mastery))
+        if last_attempted_relevance is None:
+            last_attempted_relevance = np.zeros(n_kcs)
+        self.last_attempted_relevance = np.array(last_attempted_relevance, dtype=np.float64)
+
+        # P: readiness, from prerequisite weights of valid kcs
+        self.prereq_weights = self._prereq_weights(self.L, self.kc_mask)
+        self.m_r = params.prereqs.rdot(self.prereq_weights)
+        self.P = relevance.dot(np.minimum(self.m_r + r_star, 0))
+        # R: demand
+        self.R = relevance.dot(np.maximum(L_star - self.L, 0))
+        # C: continuity, stored before square root
+        self.C2 = relevance.dot(self.last_attempted_relevance)
+        # D: appropriate difficulty
+        rows = relevance.row_indices
+        self.D = -np.bincount(
+            rows,
+            weights=relevance.data * np.abs(self.L[relevance.indices] - params.difficulty[rows]),
+            minlength=n_activities
+        )
+
+    def _prereq_weights(self, L, kc_mask):
+        return np.where(kc_mask, np.minimum(L - self.L_star, 0), 0.0)
+
+    def _column_update(self, kcs, deltas):
+        """
+        Sum of relevance columns of kcs, weighted by per-kc deltas
+        :param kcs: np.array of kc indices
+        :param deltas: function of (kc position in kcs, activity indices) returning per-element delta values
+        :return: 1xQ vector
+        """
+        positions, activities, values = self.params.relevance_columns.select_rows(kcs)
+        return np.bincount(activities, weights=values * deltas(positions, activities), minlength=len(self.P))
+
+    def update(self, learner_mastery=None, kc_mask=None, last_attempted_relevance=None):
+        """
+        Update score components for changes in learner mastery, valid kcs or last attempted activity
+        Only activities tagged with KCs whose values changed are updated.
+        :param learner_mastery: 1xK vector of learner mastery (probability) values, or None if unchanged
+        :param kc_mask: 1xK boolean vector of valid kcs, or None if unchanged
+        :param last_attempted_relevance: 1xK vector of relevance values for last attempted activity, or None if unchanged
+        """
+        L_star = self.L_star
+        difficulty = self.params.difficulty
+
+        if learner_mastery is not None:
+            learner_mastery = np.asarray(learner_mastery, dtype=np.float64)
+            changed = np.flatnonzero(
+                (learner_mastery != self.learner_mastery) &
+                ~(np.isnan(learner_mastery) & np.isnan(self.learner_mastery))
+            )
+            if len(changed):
+                L_old = self.L[changed]
+                L_new = np.log(odds(learner_mastery[changed]))
+                self.R += self._column_update(
+                    changed,
+                    lambda p, q: np.maximum(L_star - L_new[p], 0) - np.maximum(L_star - L_old[p], 0)
+                )
+                self.D -= self._column_update(
+                    changed,
+                    lambda p, q: np.abs(L_new[p] - difficulty[q]) - np.abs(L_old[p] - difficulty[q])
+                )
+                self.L[changed] = L_new
+                self.learner_mastery[changed] = learner_mastery[changed]
+
+        if kc_mask is not None:
+            self.kc_mask = np.array(kc_mask, dtype=np.bool_)
+
+        # P depends on prerequisite weights, which change with mastery or kc validity
+        prereq_weights = self._prereq_weights(self.L, self.kc_mask)
+        sources = np.flatnonzero(prereq_weights != self.prereq_weights)
+        if len(sources):
+            positions, kcs, values = self.params.prereqs.select_rows(sources)
+            weight_delta = (prereq_weights - self.prereq_weights)[sources]
+            m_r = self.m_r + np.bincount(kcs, weights=values * weight_delta[positions], minlength=len(self.m_r))
+            p_old = np.minimum(self.m_r + self.r_star, 0)
+            p_new = np.minimum(m_r + self.r_star, 0)
+            changed = np.flatnonzero(p_new != p_old)
+            if len(changed):
+                p_delta = (p_new - p_old)[changed]
+                self.P += self._column_update(changed, lambda p, q: p_delta[p])
+            self.m_r = m_r
+            self.prereq_weights = prereq_weights
+
+        if last_attempted_relevance is not None:
+            last_attempted_relevance = np.array(last_attempted_relevance, dtype=np.float64)
+            if not np.array_equal(last_attempted_relevance, self.last_attempted_relevance):
+                # recomputed from the last attempted activity's kcs, rather than updated, so that C is exactly 0.0
+                # for activities that share no kcs with it
+                kcs = np.flatnonzero(last_attempted_relevance)
+                self.C2 = self._column_update(kcs, lambda p, q: last_attempted_relevance[kcs][p])
+                self.last_attempted_relevance = last_attempted_relevance
+
+    def update_knowledge_components(self, kc_pks, values):
+        """
+        Update mastery values for a subset of kcs
+        :param kc_pks: list of kc pks; kcs not in collection are ignored
+        :param values: list of new mastery (probability) values
+        """
+        learner_mastery = np.copy(self.learner_mastery)
+        for pk, value in zip(kc_pks, values):
+            idx = self.params.kc_map.get(pk)
+            if idx is not None:
+                learner_mastery[idx] = value
+        self.update(learner_mastery=learner_mastery)
+
+    def scores(self, W_p, W_r, W_d, W_c):
+        """
+        Weighted recommendation scores
+        :param W_p: (float), weight on substrategy P
+        :param W_r: (float), weight on substrategy R
+        :param W_d: (float), weight on substrategy D
+        :param W_c: (float), weight on substrategy C
+        :return: 1xQ vector of activity recommendation scores
+        """
+        # weights are paired with subscores in the same order as alosi.engine.recommendation_score
+        return W_p * self.P + W_r * self.R + W_d * np.sqrt(self.C2) + W_c * self.D
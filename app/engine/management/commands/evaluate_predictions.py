@@ -0,0 +1,119 @@
+import datetime
+import json
+import time
+from collections import OrderedDict
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from engine.evaluation import evaluate_predictions
+from engine.parameters import PARAMETER_MODELS, ParameterImportError, read_parameter_file
+
+
+class Command(BaseCommand):
+    """
+    Evaluates how well the model parameters predict correctness of held-out scores (log-loss, AUC and accuracy,
+    compared with overall and per-activity chance), replaying the score history
+
+    Usage:
+        python manage.py evaluate_predictions [--holdout-fraction 0.2] [--since 2018-09-01T00:00]
+            [--guess guess.npz] [--slip slip.npz] [--transit transit.npz] [--activity-urls] [--kc-ids]
+            [--max-log-loss] [--min-auc] [--tolerance 0.0] [--output evaluation.json]
+
+    Example (gate a recalibration before importing its parameters):
+        python manage.py evaluate_predictions --holdout-fraction 0.2 --guess guess.npz --slip slip.npz \
+            --transit transit.npz --tolerance 0.005
+
+    With candidate parameter files (in export_parameters formats, stored values are used for parameters not given),
+    both the stored and the candidate parameters are evaluated, and the command fails if the candidate log-loss
+    exceeds the stored log-loss by more than the tolerance. The command also fails if the evaluated parameters do not
+    meet --max-log-loss or --min-auc.
+    """
+
+    help = 'Evaluates predictive accuracy of model parameters'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--holdout-fraction', type=float, default=None,
+                            help='fraction of learners whose scores are evaluated (default: all learners)')
+        parser.add_argument('--since', default=None, help='evaluate only scores at or after this ISO 8601 date or time')
+        for name in PARAMETER_MODELS:
+            parser.add_argument('--{}'.format(name), default=None, help='candidate {} parameter file'.format(name))
+        parser.add_argument('--activity-urls', default=None, help='file with activity url of each matrix row (.npy)')
+        parser.add_argument('--kc-ids', default=None, help='file with kc_id of each matrix column (.npy)')
+        parser.add_argument('--max-log-loss', type=float, default=None)
+        parser.add_argument('--min-auc', type=float, default=None)
+        parser.add_argument('--tolerance', type=float, default=0.0,
+                            help='allowed increase of log-loss of candidate over stored parameters')
+        parser.add_argument('--output', default=None, help='path of JSON results file')
+
+    def read_axis(self, path):
+        if path is None:
+            return None
+        with open(path) as f:
+            return [line.rstrip('\n') for line in f if line.strip()]
+
+    def handle(self, *args, **options):
+        since = None
+        if options['since']:
+            since = parse_datetime(options['since'])
+            if since is None and parse_date(options['since']) is not None:
+                since = datetime.datetime.combine(parse_date(options['since']), datetime.time())
+            if since is None:
+                raise CommandError("Invalid --since time: {}".format(options['since']))
+            if timezone.is_naive(since):
+                since = timezone.make_aware(since)
+        overrides = OrderedDict()
+        try:
+            for name in PARAMETER_MODELS:
+                if options[name]:
+                    with open(options[name], 'rb') as f:
+                        overrides[name] = read_parameter_file(
+                            f,
+                            options[name],
+                            activity_urls=self.read_axis(options['activity_urls']),
+                            kc_ids=self.read_axis(options['kc_ids'])
+                        )
+        except (ParameterImportError, OSError) as e:
+            raise CommandError(str(e))
+
+        results = OrderedDict()
+        runs = [('stored', None)] + ([('candidate', overrides)] if overrides else [])
+        for label, parameter_overrides in runs:
+            start = time.perf_counter()
+            try:
+                results[label] = evaluate_predictions(
+                    holdout_fraction=options['holdout_fraction'], since=since, parameter_overrides=parameter_overrides)
+            except ParameterImportError as e:
+                raise CommandError(str(e))
+            self.write_result(label, results[label], time.perf_counter() - start)
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, indent=2)
+
+        result = results[runs[-1][0]]
+        if not result['evaluated']:
+            raise CommandError('No scores evaluated')
+        failures = []
+        if options['max_log_loss'] is not None and result['model']['log_loss'] > options['max_log_loss']:
+            failures.append('log-loss {:.4f} above {}'.format(result['model']['log_loss'], options['max_log_loss']))
+        if options['min_auc'] is not None and (result['model']['auc'] or 0.0) < options['min_auc']:
+            failures.append('AUC {} below {}'.format(result['model']['auc'], options['min_auc']))
+        if overrides and result['model']['log_loss'] > results['stored']['model']['log_loss'] + options['tolerance']:
+            failures.append('candidate log-loss {:.4f} above stored log-loss {:.4f}'.format(
+                result['model']['log_loss'], results['stored']['model']['log_loss']))
+        if failures:
+            raise CommandError('Evaluation failed: {}'.format('; '.join(failures)))
+        self.stdout.write(self.style.SUCCESS('Evaluation passed'))
+
+    def write_result(self, label, result, elapsed):
+        self.stdout.write('{} parameters: {} scores evaluated ({} of activities without KCs skipped), {} training '
+                          'scores, in {:.1f}s'.format(label, result['evaluated'], result['untagged'],
+                                                      result['training'], elapsed))
+        if not result['evaluated']:
+            return
+        self.stdout.write('{:>16} {:>10} {:>10} {:>10}'.format('', 'log_loss', 'auc', 'accuracy'))
+        for name in ('model', 'overall_chance', 'activity_chance'):
+            metrics = result[name]
+            self.stdout.write('{:>16} {:>10.4f} {:>10} {:>10.4f}'.format(
+                name, metrics['log_loss'], '{:.4f}'.format(metrics['auc']) if metrics['auc'] is not None else '-',
+                metrics['accuracy']))
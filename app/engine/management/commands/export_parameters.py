@@ -0,0 +1,59 @@
+import csv
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+from engine.models import Collection
+from engine.parameters import PARAMETER_MODELS, TRIPLE_FIELDS, get_parameter_queryset, export_dense, write_npz
+
+
+class Command(BaseCommand):
+    """
+    Exports stored values of an activity-kc parameter (guess, slip or transit) to a file
+
+    Usage:
+        python manage.py export_parameters <name> <path> [--collection]
+
+    Example:
+        python manage.py export_parameters guess guess.npz --collection my_collection
+
+    File format is determined by extension:
+        .npz: dense matrix with "values", "activity_urls" and "kc_ids" arrays
+        .npy: dense matrix only; axis lists are written to <path>.activity_urls.txt and <path>.kc_ids.txt
+        .csv: sparse (activity_url, kc_id, value) triples
+    """
+
+    help = 'Exports activity-kc parameter matrix'
+
+    def add_arguments(self, parser):
+        parser.add_argument('name', choices=list(PARAMETER_MODELS))
+        parser.add_argument('path')
+        parser.add_argument('--collection', default=None, help='collection_id; export only activities in collection')
+
+    def handle(self, *args, **options):
+        model = PARAMETER_MODELS[options['name']]
+        path = options['path']
+        collection = None
+        if options['collection']:
+            try:
+                collection = Collection.objects.get(collection_id=options['collection'])
+            except Collection.DoesNotExist:
+                raise CommandError('Collection {} does not exist'.format(options['collection']))
+
+        if path.endswith('.csv'):
+            queryset = get_parameter_queryset(model, collection)
+            with open(path, 'w', newline='') as f:
+                writer = csv.writer(f)
+                writer.writerow(list(TRIPLE_FIELDS))
+                writer.writerows(queryset.values_list(*TRIPLE_FIELDS.values()).iterator())
+        elif path.endswith('.npz') or path.endswith('.npy'):
+            values, activity_urls, kc_ids = export_dense(model, collection)
+            if path.endswith('.npz'):
+                write_npz(path, values, activity_urls, kc_ids)
+            else:
+                np.save(path, values, allow_pickle=False)
+                for axis_name, axis in (('activity_urls', activity_urls), ('kc_ids', kc_ids)):
+                    with open('{}.{}.txt'.format(path, axis_name), 'w') as f:
+                        f.writelines(value + '\n' for value in axis)
+        else:
+            raise CommandError('Unsupported file type: {} (use .npz, .npy or .csv)'.format(path))
+
+        self.stdout.write(self.style.SUCCESS('Exported {} to {}'.format(options['name'], path)))
@@ -0,0 +1,60 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from engine.simulation.synthetic import SyntheticDataError, copy_available, generate_synthetic_data
+
+
+class Command(BaseCommand):
+    """
+    Generates a synthetic catalog (collections, activities, KCs, tagging, guess/slip/transit parameters and
+    prerequisites) and learners with scores simulated by Bayesian Knowledge Tracing, for performance testing
+
+    Usage:
+        python manage.py generate_synthetic_data [--activities 1000] [--kcs 100] [--kcs-per-activity 2]
+            [--collections 10] [--prerequisite-density 0.01] [--learners 1000] [--scores-per-learner 50]
+            [--seed 0] [--prefix synthetic]
+
+    Example:
+        python manage.py generate_synthetic_data --activities 100000 --kcs 2000 --learners 100000 \
+            --scores-per-learner 100
+
+    Rows are inserted with PostgreSQL COPY when the database is PostgreSQL, and with bulk_create otherwise.
+    """
+
+    help = 'Generates synthetic catalog and learner data'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--activities', type=int, default=1000)
+        parser.add_argument('--kcs', type=int, default=100)
+        parser.add_argument('--kcs-per-activity', type=int, default=2)
+        parser.add_argument('--collections', type=int, default=10)
+        parser.add_argument('--prerequisite-density', type=float, default=0.01,
+                            help='approximate fraction of KC pairs with a prerequisite relation')
+        parser.add_argument('--learners', type=int, default=1000)
+        parser.add_argument('--scores-per-learner', type=int, default=50)
+        parser.add_argument('--prior', type=float, default=0.2, help='KC mastery prior')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--prefix', default='synthetic', help='prefix of identifiers of created objects')
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        try:
+            counts = generate_synthetic_data(
+                n_activities=options['activities'],
+                n_kcs=options['kcs'],
+                kcs_per_activity=options['kcs_per_activity'],
+                n_collections=options['collections'],
+                prerequisite_density=options['prerequisite_density'],
+                n_learners=options['learners'],
+                scores_per_learner=options['scores_per_learner'],
+                seed=options['seed'],
+                prefix=options['prefix'],
+                prior=options['prior'],
+            )
+        except SyntheticDataError as e:
+            raise CommandError(str(e))
+
+        self.stdout.write(self.style.SUCCESS('Generated synthetic data ({}) in {:.1f}s: {}'.format(
+            'COPY' if copy_available() else 'bulk_create',
+            time.perf_counter() - start,
+            ', '.join('{} {}'.format(count, name) for name, count in counts.items())
+        )))
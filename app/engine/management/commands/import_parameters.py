@@ -0,0 +1,50 @@
+from django.core.management.base import BaseCommand, CommandError
+from engine.parameters import PARAMETER_MODELS, ParameterImportError, read_parameter_file, import_parameters
+
+
+class Command(BaseCommand):
+    """
+    Imports values of an activity-kc parameter (guess, slip or transit) from a file, in a single transaction
+
+    Usage:
+        python manage.py import_parameters <name> <path> [--activity-urls] [--kc-ids]
+
+    Example:
+        python manage.py import_parameters slip slip.npy --activity-urls slip.npy.activity_urls.txt \
+            --kc-ids slip.npy.kc_ids.txt
+
+    File format is determined by extension (.npz, .npy or .csv, see export_parameters). For .npy files, axis lists
+    are read from text files with one activity url / kc_id per line.
+    """
+
+    help = 'Imports activity-kc parameter matrix'
+
+    def add_arguments(self, parser):
+        parser.add_argument('name', choices=list(PARAMETER_MODELS))
+        parser.add_argument('path')
+        parser.add_argument('--activity-urls', default=None, help='file with activity url of each matrix row')
+        parser.add_argument('--kc-ids', default=None, help='file with kc_id of each matrix column')
+
+    def read_axis(self, path):
+        if path is None:
+            return None
+        with open(path) as f:
+            return [line.rstrip('\n') for line in f if line.strip()]
+
+    def handle(self, *args, **options):
+        try:
+            with open(options['path'], 'rb') as f:
+                triples = read_parameter_file(
+                    f,
+                    options['path'],
+                    activity_urls=self.read_axis(options['activity_urls']),
+                    kc_ids=self.read_axis(options['kc_ids'])
+                )
+            result = import_parameters(PARAMETER_MODELS[options['name']], triples)
+        except (ParameterImportError, OSError) as e:
+            raise CommandError(str(e))
+
+        self.stdout.write(self.style.SUCCESS(
+            'Imported {name}: {created} created, {updated} updated, parameter version {parameter_version}'.format(
+                name=options['name'], **result)
+        ))
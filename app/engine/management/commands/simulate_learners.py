@@ -0,0 +1,96 @@
+import json
+from collections import OrderedDict
+from django.core.management.base import BaseCommand, CommandError
+from engine.models import Collection, EngineSettings
+from engine.simulation.driver import HttpEngineClient, InProcessEngineClient, run_simulation
+
+
+class Command(BaseCommand):
+    """
+    Simulates a population of learners working through a collection, with responses simulated by Bayesian Knowledge
+    Tracing from the stored guess/slip/transit parameters, and reports throughput, request latencies and learning
+    outcomes
+
+    Usage:
+        python manage.py simulate_learners <collection_id> [--learners 100] [--steps 20] [--concurrency 1]
+            [--engine-settings <id> ...] [--api-url http://localhost:8000 --token <token>] [--seed 0]
+            [--prefix simulation] [--output report.json]
+
+    Examples:
+        # compare two engine settings on the same simulated population, in-process
+        python manage.py simulate_learners synthetic-collection-0 --learners 500 --engine-settings 1 2
+        # load test a running engine
+        python manage.py simulate_learners synthetic-collection-0 --learners 1000 --concurrency 16 \
+            --api-url http://localhost:8000 --token <token>
+
+    Without --api-url, the engine is called in-process (with the engine of each learner's experimental group, or
+    with each of the --engine-settings); scores and learners created by the simulation are written to the database.
+    Learners are identified by prefix (and engine settings id), so repeated runs should use a new prefix.
+    Load tests through the HTTP API should target a production server (e.g. gunicorn); the Django 2.0 development
+    server closes reused connections.
+    """
+
+    help = 'Simulates learners working through a collection'
+
+    def add_arguments(self, parser):
+        parser.add_argument('collection_id')
+        parser.add_argument('--learners', type=int, default=100)
+        parser.add_argument('--steps', type=int, default=20, help='maximum number of attempts per learner')
+        parser.add_argument('--concurrency', type=int, default=1, help='number of concurrent request workers')
+        parser.add_argument('--engine-settings', type=int, nargs='+', default=None,
+                            help='ids of engine settings to compare (in-process only)')
+        parser.add_argument('--api-url', default=None, help='engine base url, to simulate through the HTTP API')
+        parser.add_argument('--token', default=None, help='API token')
+        parser.add_argument('--prior', type=float, default=0.2, help='probability that a KC is initially known')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--prefix', default='simulation', help='prefix of simulated learner identifiers')
+        parser.add_argument('--output', default=None, help='path of JSON report file')
+
+    def handle(self, *args, **options):
+        try:
+            collection = Collection.objects.get(collection_id=options['collection_id'])
+        except Collection.DoesNotExist:
+            raise CommandError("Collection '{}' does not exist".format(options['collection_id']))
+
+        if options['api_url']:
+            if options['engine_settings']:
+                raise CommandError('--engine-settings is only supported for in-process simulation')
+            runs = [(options['prefix'], HttpEngineClient(options['api_url'], options['token']))]
+        elif options['engine_settings']:
+            runs = []
+            for pk in options['engine_settings']:
+                try:
+                    engine_settings = EngineSettings.objects.get(pk=pk)
+                except EngineSettings.DoesNotExist:
+                    raise CommandError("EngineSettings {} does not exist".format(pk))
+                runs.append(('{}-{}'.format(options['prefix'], pk), InProcessEngineClient(engine_settings)))
+        else:
+            runs = [(options['prefix'], InProcessEngineClient())]
+
+        reports = OrderedDict()
+        for prefix, client in runs:
+            report = run_simulation(
+                client,
+                collection,
+                n_learners=options['learners'],
+                n_steps=options['steps'],
+                concurrency=options['concurrency'],
+                seed=options['seed'],
+                prefix=prefix,
+                prior=options['prior'],
+            )
+            reports[prefix] = report
+            outcomes = report['outcomes']
+            self.stdout.write(self.style.SUCCESS(
+                '{}: {} requests in {:.1f}s ({:.1f}/s), recommend p50/p99 {:.1f}/{:.1f} ms, '
+                'score p50/p99 {:.1f}/{:.1f} ms, mean score {:.3f}, knowledge gain {:.3f}, {} completed'.format(
+                    prefix, report['requests'], report['elapsed_s'], report['throughput_rps'],
+                    report['recommend_latency_ms'].get('p50', 0), report['recommend_latency_ms'].get('p99', 0),
+                    report['score_latency_ms'].get('p50', 0), report['score_latency_ms'].get('p99', 0),
+                    outcomes['mean_score'] or 0, outcomes['knowledge_gain'], outcomes['completed']
+                )
+            ))
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(reports, f, indent=2)
@@ -0,0 +1,135 @@
+import itertools
+import json
+import time
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+from engine.engines import get_engine
+from engine.models import Collection, EngineSettings
+from engine.simulation.sweep import (SWEEP_FIELDS, load_replay_prior, load_sweep_arrays, run_sweep,
+                                     settings_values)
+
+
+def parse_param(spec):
+    """
+    Parse a --param specification
+    :param spec: str, NAME=v1,v2,... (values), NAME=low:high (range) or NAME=low:high:num (num evenly spaced values)
+    :return: (name, values, range) tuple; values is a list of floats or None, range is a (low, high) tuple or None
+    """
+    try:
+        name, values = spec.split('=', 1)
+        if name not in SWEEP_FIELDS:
+            raise CommandError("Unknown parameter '{}', expected one of {}".format(name, ', '.join(SWEEP_FIELDS)))
+        if ':' in values:
+            bounds = [float(value) for value in values.split(':')]
+            if len(bounds) == 3:
+                return name, [float(value) for value in np.linspace(bounds[0], bounds[1], int(bounds[2]))], None
+            low, high = bounds
+            return name, None, (low, high)
+        return name, [float(value) for value in values.split(',')], None
+    except ValueError:
+        raise CommandError("Invalid parameter specification '{}'".format(spec))
+
+
+class Command(BaseCommand):
+    """
+    Evaluates a grid or random sample of engine settings (W_p, W_r, W_c, W_d, L_star, r_star) offline, on a
+    population of learners simulated by Bayesian Knowledge Tracing from the collection's stored parameters, in
+    parallel over a process pool; reports expected mastery gain per item served and time to mastery of each candidate
+
+    Usage:
+        python manage.py sweep_engine_settings <collection_id> --param NAME=SPEC [--param ...] [--samples N]
+            [--base-settings <id>] [--learners 200] [--steps 30] [--replay] [--processes N] [--seed 0]
+            [--output sweep.json]
+
+    SPEC is a list of values (W_p=0,1,2), a range with a number of evenly spaced values (W_p=0:4:5), or, with
+    --samples, a range to sample uniformly from (W_p=0:4). Without --samples, every combination of values is
+    evaluated. Settings that are not swept are taken from --base-settings, or the default engine settings.
+
+    Example:
+        python manage.py sweep_engine_settings synthetic-collection-0 --param W_p=0:4 --param W_r=0:4 \
+            --param W_c=0:2 --param W_d=0:2 --samples 200 --learners 500
+
+    With --replay, simulated learners start from the stored mastery of (up to --learners) existing learners with
+    scores in the collection, instead of a random population.
+    """
+
+    help = 'Evaluates engine settings candidates on simulated learners'
+
+    def add_arguments(self, parser):
+        parser.add_argument('collection_id')
+        parser.add_argument('--param', action='append', default=[], help='NAME=SPEC, repeated for each parameter')
+        parser.add_argument('--samples', type=int, default=None,
+                            help='number of random candidates (default: full grid of values)')
+        parser.add_argument('--base-settings', type=int, default=None, help='id of engine settings to start from')
+        parser.add_argument('--learners', type=int, default=200)
+        parser.add_argument('--steps', type=int, default=30, help='maximum number of activities served per learner')
+        parser.add_argument('--prior', type=float, default=0.2, help='probability that a KC is initially known')
+        parser.add_argument('--replay', action='store_true', help='start from the mastery of existing learners')
+        parser.add_argument('--processes', type=int, default=None, help='number of processes (default: CPU count)')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--top', type=int, default=10, help='number of best candidates to print')
+        parser.add_argument('--output', default=None, help='path of JSON results file')
+
+    def handle(self, *args, **options):
+        try:
+            collection = Collection.objects.get(collection_id=options['collection_id'])
+        except Collection.DoesNotExist:
+            raise CommandError("Collection '{}' does not exist".format(options['collection_id']))
+        if options['base_settings'] is not None:
+            try:
+                base = settings_values(EngineSettings.objects.get(pk=options['base_settings']))
+            except EngineSettings.DoesNotExist:
+                raise CommandError("EngineSettings {} does not exist".format(options['base_settings']))
+        else:
+            base = settings_values(get_engine().engine_settings)
+        candidates = self.get_candidates(base, [parse_param(spec) for spec in options['param']], options)
+
+        arrays = load_sweep_arrays(collection)
+        prior = options['prior']
+        if options['replay']:
+            prior = load_replay_prior(collection, options['learners'], options['prior'])
+            if not len(prior):
+                raise CommandError('No learners with scores in collection {}'.format(collection.collection_id))
+
+        start = time.perf_counter()
+        results = run_sweep(arrays, candidates, options['learners'], options['steps'], seed=options['seed'],
+                            prior=prior, processes=options['processes'])
+        self.stdout.write('Evaluated {} candidates in {:.1f}s'.format(len(results), time.perf_counter() - start))
+
+        ranked = sorted(results, key=lambda result: -result['gain_per_item'])
+        self.stdout.write(' '.join('{:>8}'.format(field) for field in SWEEP_FIELDS) +
+                          ' {:>14} {:>9} {:>16}'.format('gain_per_item', 'mastered', 'time_to_mastery'))
+        for result in ranked[:options['top']]:
+            self.stdout.write(' '.join('{:>8.3g}'.format(result[field]) for field in SWEEP_FIELDS) +
+                              ' {:>14.4f} {:>9.3f} {:>16}'.format(
+                                  result['gain_per_item'], result['mastered'],
+                                  '{:.1f}'.format(result['mean_time_to_mastery'])
+                                  if result['mean_time_to_mastery'] is not None else '-'))
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(ranked, f, indent=2)
+
+    @staticmethod
+    def get_candidates(base, params, options):
+        """
+        :param base: dict of base engine settings values
+        :param params: list of (name, values, range) tuples from parse_param()
+        :param options: command options
+        :return: list of dicts of engine settings values
+        """
+        if options['samples'] is None:
+            for name, values, bounds in params:
+                if values is None:
+                    raise CommandError("A number of values is required for '{}' without --samples".format(name))
+            return [dict(base, **dict(zip([name for name, values, bounds in params], combination)))
+                    for combination in itertools.product(*[values for name, values, bounds in params])]
+        rng = np.random.RandomState(options['seed'])
+        return [
+            dict(base, **{
+                name: float(rng.uniform(*bounds)) if values is None else
+                float(values[rng.randint(len(values))])
+                for name, values, bounds in params
+            })
+            for i in range(options['samples'])
+        ]
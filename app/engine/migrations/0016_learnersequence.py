@@ -0,0 +1,36 @@
+# Generated by Django 2.0.13 on 2026-10-19 00:21
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('engine', '0015_activity_prerequisite_activities'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LearnerSequence',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.PositiveIntegerField(default=0)),
+                ('collection', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='engine.Collection')),
+                ('learner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='engine.Learner')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='SequenceItem',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('score', models.FloatField(blank=True, null=True)),
+                ('activity', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='engine.Activity')),
+                ('sequence', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='engine.LearnerSequence')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='learnersequence',
+            unique_together={('learner', 'collection')},
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.0.13 on 2026-10-19 00:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('engine', '0016_learnersequence'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='activity',
+            name='url',
+            field=models.CharField(db_index=True, default='', max_length=500),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.0.13 on 2026-10-19 00:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('engine', '0017_activity_url_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='enginesettings',
+            name='stop_on_mastery',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 2.0.13 on 2026-10-19 00:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('engine', '0018_enginesettings_stop_on_mastery'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ParameterVersion',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.PositiveIntegerField(default=0)),
+                ('timestamp', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,129 @@
+# Generated by Django 2.0.13 on 2026-10-19 01:03
+
+from django.db import migrations, models
+import django.db.models.deletion
+import engine.models
+
+
+PARAMETER_MODEL_NAMES = (('guess', 'Guess'), ('slip', 'Slip'), ('transit', 'Transit'))
+
+
+def merge_parameters(apps, schema_editor):
+    """
+    Copy Guess/Slip/Transit values into ActivityKCParameter rows; if a pair has more than one value for a parameter,
+    the value with the highest pk is used
+    """
+    ActivityKCParameter = apps.get_model('engine', 'ActivityKCParameter')
+    rows = {}
+    for field, model_name in PARAMETER_MODEL_NAMES:
+        model = apps.get_model('engine', model_name)
+        for activity_pk, kc_pk, value in model.objects.order_by('pk').values_list(
+                'activity_id', 'knowledge_component_id', 'value').iterator():
+            rows.setdefault((activity_pk, kc_pk), {})[field] = value
+    ActivityKCParameter.objects.bulk_create([
+        ActivityKCParameter(activity_id=activity_pk, knowledge_component_id=kc_pk, **values)
+        for (activity_pk, kc_pk), values in rows.items()
+    ], batch_size=500)
+
+
+def split_parameters(apps, schema_editor):
+    """
+    Copy ActivityKCParameter values back into Guess/Slip/Transit rows
+    """
+    ActivityKCParameter = apps.get_model('engine', 'ActivityKCParameter')
+    for field, model_name in PARAMETER_MODEL_NAMES:
+        model = apps.get_model('engine', model_name)
+        model.objects.bulk_create([
+            model(activity_id=activity_pk, knowledge_component_id=kc_pk, value=value)
+            for activity_pk, kc_pk, value in ActivityKCParameter.objects.filter(
+                **{field + '__isnull': False}).values_list('activity_id', 'knowledge_component_id', field).iterator()
+        ], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('engine', '0019_parameterversion'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ActivityKCParameter',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('guess', models.FloatField(blank=True, null=True)),
+                ('slip', models.FloatField(blank=True, null=True)),
+                ('transit', models.FloatField(blank=True, null=True)),
+                ('activity', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='engine.Activity')),
+                ('knowledge_component', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='engine.KnowledgeComponent')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='activitykcparameter',
+            unique_together={('activity', 'knowledge_component')},
+        ),
+        migrations.RunPython(merge_parameters, reverse_code=split_parameters),
+        migrations.RemoveField(
+            model_name='guess',
+            name='activity',
+        ),
+        migrations.RemoveField(
+            model_name='guess',
+            name='knowledge_component',
+        ),
+        migrations.RemoveField(
+            model_name='slip',
+            name='activity',
+        ),
+        migrations.RemoveField(
+            model_name='slip',
+            name='knowledge_component',
+        ),
+        migrations.RemoveField(
+            model_name='transit',
+            name='activity',
+        ),
+        migrations.RemoveField(
+            model_name='transit',
+            name='knowledge_component',
+        ),
+        migrations.DeleteModel(
+            name='Guess',
+        ),
+        migrations.DeleteModel(
+            name='Slip',
+        ),
+        migrations.DeleteModel(
+            name='Transit',
+        ),
+        migrations.CreateModel(
+            name='Guess',
+            fields=[
+            ],
+            options={
+                'proxy': True,
+                'indexes': [],
+            },
+            bases=(engine.models.ParameterColumnMixin, 'engine.activitykcparameter'),
+        ),
+        migrations.CreateModel(
+            name='Slip',
+            fields=[
+            ],
+            options={
+                'proxy': True,
+                'indexes': [],
+            },
+            bases=(engine.models.ParameterColumnMixin, 'engine.activitykcparameter'),
+        ),
+        migrations.CreateModel(
+            name='Transit',
+            fields=[
+            ],
+            options={
+                'proxy': True,
+                'indexes': [],
+            },
+            bases=(engine.models.ParameterColumnMixin, 'engine.activitykcparameter'),
+        ),
+    ]
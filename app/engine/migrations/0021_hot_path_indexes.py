@@ -0,0 +1,38 @@
+# Generated by Django 2.0.13 on 2026-10-19 01:07
+
+from django.db import migrations, models
+from django.db.models import Count, Max
+
+
+def dedupe_mastery(apps, schema_editor):
+    """
+    Delete duplicate Mastery rows of a learner-kc pair, keeping the most recently created row (highest pk)
+    """
+    Mastery = apps.get_model('engine', 'Mastery')
+    duplicates = list(Mastery.objects.values('learner_id', 'knowledge_component_id').annotate(
+        n=Count('pk'), max_pk=Max('pk')).filter(n__gt=1).values_list('learner_id', 'knowledge_component_id', 'max_pk'))
+    for learner_pk, kc_pk, max_pk in duplicates:
+        Mastery.objects.filter(learner_id=learner_pk, knowledge_component_id=kc_pk, pk__lt=max_pk).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('engine', '0020_activitykcparameter'),
+    ]
+
+    operations = [
+        migrations.RunPython(dedupe_mastery, reverse_code=migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='mastery',
+            unique_together={('learner', 'knowledge_component')},
+        ),
+        migrations.AddIndex(
+            model_name='score',
+            index=models.Index(fields=['learner', 'timestamp'], name='engine_score_learner_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='score',
+            index=models.Index(fields=['learner', 'activity'], name='engine_score_learner_act_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.0.8 on 2026-10-19 01:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('engine', '0021_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='enginesettings',
+            name='pruning_epsilon',
+            field=models.FloatField(blank=True, null=True),
+        ),
+    ]
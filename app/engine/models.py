@@ -2,6 +2,7 @@
 from __future__ import unicode_literals
 
 from django.db import models
+from django.utils import timezone
 
 
 def first_and_last_n_chars(s, n1=30, n2=30):
@@ -66,7 +67,7 @@ class Activity(models.Model):
     """
     Activity model
     """
-    url = models.CharField(max_length=500, default='')
+    url = models.CharField(max_length=500, default='', db_index=True)
     name = models.CharField(max_length=200, default='')
     collections = models.ManyToManyField(Collection, blank=True)
     knowledge_components = models.ManyToManyField(KnowledgeComponent, blank=True)
@@ -94,6 +95,11 @@ class EngineSettings(models.Model):
     W_r = models.FloatField()  # Importance of demand in recommending the next item
     W_c = models.FloatField()  # Importance of continuity in recommending the next item
     W_d = models.FloatField()  # Importance of appropriate difficulty in recommending the next item
+    # exclude activities whose knowledge components are all mastered, and complete when all collection KCs are mastered
+    stop_on_mastery = models.BooleanField(default=False)
+    # if set, recommend an activity whose score is within this value of the top score, skipping activities that can
+    # not beat the best score found (see AdaptiveEngine.pruned_recommend); exact scoring of all activities if null
+    pruning_epsilon = models.FloatField(null=True, blank=True)
 
     def __str__(self):
         return "EngineSettings: {}".format(self.name if self.name else self.pk)
@@ -147,39 +153,248 @@ class Score(models.Model):
     # creation time
     timestamp = models.DateTimeField(null=True, auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # last attempted activity of a learner (latest score)
+            models.Index(fields=['learner', 'timestamp'], name='engine_score_learner_time_idx'),
+            # scores of a learner on given activities
+            models.Index(fields=['learner', 'activity'], name='engine_score_learner_act_idx'),
+        ]
+
     def __str__(self):
         return "Score: {} [{} - {}]".format(
             self.score, self.learner, self.activity)
 
 
-class Transit(models.Model):
+class LearnerSequence(models.Model):
+    """
+    Server-side record of a learner's activity sequence within a collection
+    Used when the bridge opts out of sending the full sequence with each recommendation request;
+    version is the number of items in the sequence, and is echoed back to the bridge so it can send only new items
+    """
+    learner = models.ForeignKey(Learner, on_delete=models.CASCADE)
+    collection = models.ForeignKey(Collection, on_delete=models.CASCADE)
+    version = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = (('learner', 'collection'),)
+
+    def __str__(self):
+        return "LearnerSequence: {} [{} - {}]".format(
+            self.version, self.learner, self.collection)
+
+    def activities(self):
+        """
+        Activities in the sequence, in the order they were added
+        :return: Activity queryset
+        """
+        return Activity.objects.filter(sequenceitem__sequence=self).order_by('sequenceitem__pk')
+
+    def extend(self, activities, scores=None):
+        """
+        Append activities to the end of the sequence and increment the sequence version
+        :param activities: list of Activity model instances
+        :param scores: optional list of score values (or None) corresponding to activities
+        """
+        if not activities:
+            return
+        if scores is None:
+            scores = [None] * len(activities)
+        SequenceItem.objects.bulk_create([
+            SequenceItem(sequence=self, activity=activity, score=score)
+            for activity, score in zip(activities, scores)
+        ])
+        LearnerSequence.objects.filter(pk=self.pk).update(version=models.F('version') + len(activities))
+        self.refresh_from_db(fields=['version'])
+
+
+class SequenceItem(models.Model):
+    """
+    Activity served to a learner, as an element of a LearnerSequence
+    """
+    sequence = models.ForeignKey(LearnerSequence, on_delete=models.CASCADE)
+    activity = models.ForeignKey(Activity, on_delete=models.CASCADE)
+    # score value, populated once a score is received for the activity
+    score = models.FloatField(null=True, blank=True)
+
+    def __str__(self):
+        return "SequenceItem: {} [{}]".format(self.score, self.activity)
+
+    @classmethod
+    def record_score(cls, learner, activity, score):
+        """
+        Record a score on the item it answers: the learner's most recently served unscored item for the activity,
+        in the sequence of a collection that contains the activity
+        :param learner: Learner model instance
+        :param activity: Activity model instance
+        :param score: float, score value
+        :return: int, number of updated items (0 or 1)
+        """
+        pk = cls.objects.filter(
+            sequence__learner=learner,
+            sequence__collection__in=activity.collections.all(),
+            activity=activity,
+            score__isnull=True
+        ).order_by('-pk').values_list('pk', flat=True).first()
+        if pk is None:
+            return 0
+        return cls.objects.filter(pk=pk).update(score=score)
+
+
+class ActivityKCParameter(models.Model):
+    """
+    Engine model parameters (guess, slip, transit) of an activity-kc pair, stored as odds
+    A parameter is null if no value is stored for the pair; the engine uses default values for tagged pairs
+    (see engine.engines). Storing all parameters of a pair in one row lets the engine read every parameter for a set
+    of activities with a single query.
+    """
     activity = models.ForeignKey(Activity, on_delete=models.CASCADE)
     knowledge_component = models.ForeignKey(KnowledgeComponent, on_delete=models.CASCADE)
-    value = models.FloatField()
+    guess = models.FloatField(null=True, blank=True)
+    slip = models.FloatField(null=True, blank=True)
+    transit = models.FloatField(null=True, blank=True)
+
+    class Meta:
+        unique_together = (('activity', 'knowledge_component'),)
 
     def __str__(self):
-        return "Transit: {} [{} - {}]".format(
-            self.value, self.activity, self.knowledge_component)
+        return "ActivityKCParameter: {}/{}/{} [{} - {}]".format(
+            self.guess, self.slip, self.transit, self.activity, self.knowledge_component)
 
 
-class Guess(models.Model):
-    activity = models.ForeignKey(Activity, on_delete=models.CASCADE)
-    knowledge_component = models.ForeignKey(KnowledgeComponent, on_delete=models.CASCADE)
-    value = models.FloatField()
+class ParameterColumnQuerySet(models.QuerySet):
+    """
+    QuerySet of a single parameter column of ActivityKCParameter, for the Guess/Slip/Transit compatibility models
+    """
+    def create(self, **kwargs):
+        """
+        Set parameter value of an activity-kc pair, creating the ActivityKCParameter row if it does not exist
+        """
+        obj = self.model(**kwargs)
+        obj.save(force_insert=True, using=self.db)
+        return obj
+
+    def update(self, **kwargs):
+        """
+        Update rows, with 'value' referring to the parameter column
+        """
+        if 'value' in kwargs:
+            kwargs[self.model.parameter_field] = kwargs.pop('value')
+        return super().update(**kwargs)
+
+    def delete(self):
+        """
+        Clear parameter values; rows are kept since they may store other parameters of the pair
+        """
+        count = self.update(**{self.model.parameter_field: None})
+        return count, {self.model._meta.label: count}
+
+    delete.queryset_only = True
+
+
+class ParameterColumnManager(models.Manager.from_queryset(ParameterColumnQuerySet)):
+    """
+    Manager of objects with a stored value in the parameter column, available as a 'value' annotation
+    """
+    def get_queryset(self):
+        field = self.model.parameter_field
+        return super().get_queryset().filter(**{field + '__isnull': False}).annotate(value=models.F(field))
+
+
+class ParameterColumnMixin(object):
+    """
+    Exposes one parameter column of ActivityKCParameter as a 'value' attribute, as stored by the former
+    Guess/Slip/Transit tables
+    Saving a new instance sets the parameter on the existing row of the activity-kc pair, if any; saving an existing
+    instance only writes the parameter column, so other parameters of the pair are not overwritten.
+    """
+    parameter_field = None
+
+    @property
+    def value(self):
+        return getattr(self, self.parameter_field)
+
+    @value.setter
+    def value(self, value):
+        setattr(self, self.parameter_field, value)
+
+    def save(self, force_insert=False, force_update=False, using=None, update_fields=None):
+        if self._state.adding:
+            obj, created = ActivityKCParameter.objects.using(using).update_or_create(
+                activity_id=self.activity_id,
+                knowledge_component_id=self.knowledge_component_id,
+                defaults={self.parameter_field: self.value}
+            )
+            for field in obj._meta.concrete_fields:
+                setattr(self, field.attname, getattr(obj, field.attname))
+            self._state.adding = False
+            self._state.db = obj._state.db
+            return
+        if update_fields is None:
+            update_fields = [self.parameter_field]
+        super().save(force_update=force_update, using=using, update_fields=update_fields)
+
+    def delete(self, using=None, keep_parents=False):
+        setattr(self, self.parameter_field, None)
+        self.save(using=using, update_fields=[self.parameter_field])
 
     def __str__(self):
-        return "Guess: {} [{} - {}]".format(
-            self.value, self.activity, self.knowledge_component)
+        return "{}: {} [{} - {}]".format(
+            self.__class__.__name__, self.value, self.activity, self.knowledge_component)
 
 
-class Slip(models.Model):
-    activity = models.ForeignKey(Activity, on_delete=models.CASCADE)
-    knowledge_component = models.ForeignKey(KnowledgeComponent, on_delete=models.CASCADE)
-    value = models.FloatField()
+class Transit(ParameterColumnMixin, ActivityKCParameter):
+    parameter_field = 'transit'
+    objects = ParameterColumnManager()
+
+    class Meta:
+        proxy = True
+
+
+class Guess(ParameterColumnMixin, ActivityKCParameter):
+    parameter_field = 'guess'
+    objects = ParameterColumnManager()
+
+    class Meta:
+        proxy = True
+
+
+class Slip(ParameterColumnMixin, ActivityKCParameter):
+    parameter_field = 'slip'
+    objects = ParameterColumnManager()
+
+    class Meta:
+        proxy = True
+
+
+class ParameterVersion(models.Model):
+    """
+    Version counter of engine model parameters (guess, slip, transit) and tagging, incremented by bulk parameter and
+    tagging writes
+    Used by process-local caches to detect parameter changes made in other processes (see engine.caches)
+    """
+    version = models.PositiveIntegerField(default=0)
+    timestamp = models.DateTimeField(auto_now=True)
 
     def __str__(self):
-        return "Slip: {} [{} - {}]".format(
-            self.value, self.activity, self.knowledge_component)
+        return "ParameterVersion: {} ({})".format(self.version, self.timestamp)
+
+    @classmethod
+    def current(cls):
+        """
+        :return: int, current parameter version (0 if parameters were never bulk written)
+        """
+        return cls.objects.filter(pk=1).values_list('version', flat=True).first() or 0
+
+    @classmethod
+    def bump(cls):
+        """
+        Increment parameter version
+        :return: int, new parameter version
+        """
+        cls.objects.get_or_create(pk=1)
+        cls.objects.filter(pk=1).update(version=models.F('version') + 1, timestamp=timezone.now())
+        return cls.current()
 
 
 class Mastery(models.Model):
@@ -187,6 +402,9 @@ class Mastery(models.Model):
     knowledge_component = models.ForeignKey(KnowledgeComponent, on_delete=models.CASCADE)
     value = models.FloatField()
 
+    class Meta:
+        unique_together = (('learner', 'knowledge_component'),)
+
     def __str__(self):
         return "Mastery: {} [{} - {}]".format(
             self.value, self.learner, self.knowledge_component)
@@ -0,0 +1,47 @@
+"""
+Pagination classes for large tables
+"""
+from rest_framework.pagination import BasePagination, CursorPagination, LimitOffsetPagination
+
+
+class PkCursorPagination(CursorPagination):
+    """
+    Keyset pagination on primary key; page cost does not depend on page depth, and no count query is made
+    """
+    ordering = 'pk'
+    page_size_query_param = 'page_size'
+    max_page_size = 10000
+
+
+class CursorOrLimitOffsetPagination(BasePagination):
+    """
+    Keyset (cursor) pagination when the request includes a "cursor" query parameter, and limit/offset pagination
+    (the API default) otherwise, for backwards compatibility
+
+    Cursor pagination is started with an empty cursor (e.g. GET /score?cursor=), and continued by following the
+    "next" links in responses.
+    """
+    cursor_query_param = PkCursorPagination.cursor_query_param
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.cursor_query_param in request.query_params:
+            self.pagination = PkCursorPagination()
+        else:
+            self.pagination = LimitOffsetPagination()
+        return self.pagination.paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        return self.pagination.get_paginated_response(data)
+
+    def to_html(self):
+        return self.pagination.to_html()
+
+    def get_results(self, data):
+        return self.pagination.get_results(data)
+
+    def get_schema_fields(self, view):
+        return LimitOffsetPagination().get_schema_fields(view) + PkCursorPagination().get_schema_fields(view)
+
+    @property
+    def display_page_controls(self):
+        return self.pagination.display_page_controls
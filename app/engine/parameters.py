@@ -0,0 +1,222 @@
+"""
+Bulk import and export of activity-kc parameter matrices (guess, slip, transit)
+Parameter values are transferred as stored by the engine (odds, see GUESS_DEFAULT/SLIP_DEFAULT/TRANSIT_DEFAULT in
+engine.engines). Matrices are represented either densely, as a (# activities) x (# KCs) array with activity url and
+kc_id axis lists (np.nan where no value is stored), or sparsely, as (activity url, kc_id, value) triples.
+"""
+import csv
+import io
+from collections import OrderedDict
+import numpy as np
+from django.db import transaction
+from .models import ActivityKCParameter, Guess, KnowledgeComponent, ParameterVersion, Slip, Transit
+from .caches import activity_url_index, score_vector_cache
+from .bulk import bulk_update
+
+
+PARAMETER_MODELS = OrderedDict([
+    ('guess', Guess),
+    ('slip', Slip),
+    ('transit', Transit),
+])
+
+# output field name -> queryset field lookup, for exporting parameters as triples
+TRIPLE_FIELDS = OrderedDict([
+    ('activity_url', 'activity__url'),
+    ('kc_id', 'knowledge_component__kc_id'),
+    ('value', 'value'),
+])
+
+# maximum number of activities per query when fetching existing parameter objects
+PARAMETER_QUERY_BATCH_SIZE = 500
+
+
+class ParameterImportError(ValueError):
+    """
+    Parameter data references unknown activities or knowledge components, or is malformed
+    """
+    pass
+
+
+def get_parameter_queryset(model, collection=None):
+    """
+    Parameter objects, optionally limited to activities of a collection
+    :param model: Guess, Slip or Transit
+    :param collection: Collection model instance, or None for all activities
+    :return: queryset ordered by pk
+    """
+    queryset = model.objects.order_by('pk')
+    if collection is not None:
+        queryset = queryset.filter(activity__collections=collection)
+    return queryset
+
+
+def export_dense(model, collection=None):
+    """
+    Export stored parameter values as a dense matrix
+    Axes include the activities and KCs that have at least one stored value, ordered by pk.
+    :param model: Guess, Slip or Transit
+    :param collection: Collection model instance, or None for all activities
+    :return: (values, activity_urls, kc_ids) tuple; values is a (# activities) x (# KCs) np.array with np.nan where
+        no value is stored
+    """
+    rows = list(get_parameter_queryset(model, collection).values_list(
+        'activity_id', 'activity__url', 'knowledge_component_id', 'knowledge_component__kc_id', 'value'))
+    activity_urls = dict((activity_pk, url) for activity_pk, url, kc_pk, kc_id, value in rows)
+    kc_ids = dict((kc_pk, kc_id) for activity_pk, url, kc_pk, kc_id, value in rows)
+    activity_map = {pk: i for i, pk in enumerate(sorted(activity_urls))}
+    kc_map = {pk: i for i, pk in enumerate(sorted(kc_ids))}
+    values = np.full((len(activity_map), len(kc_map)), np.nan)
+    for activity_pk, url, kc_pk, kc_id, value in rows:
+        values[activity_map[activity_pk], kc_map[kc_pk]] = value
+    return (
+        values,
+        [activity_urls[pk] for pk in sorted(activity_urls)],
+        [kc_ids[pk] for pk in sorted(kc_ids)],
+    )
+
+
+def dense_to_triples(values, activity_urls, kc_ids):
+    """
+    Convert dense matrix to triples of non-nan values
+    :param values: (# activities) x (# KCs) array
+    :param activity_urls: list of activity urls, row axis
+    :param kc_ids: list of kc_ids, column axis
+    :return: list of (activity url, kc_id, value) tuples
+    :raises: ParameterImportError if axis lists do not match matrix shape
+    """
+    values = np.asarray(values, dtype=np.float64)
+    if values.ndim != 2 or values.shape != (len(activity_urls), len(kc_ids)):
+        raise ParameterImportError("Matrix of shape {} does not match axes of length {} and {}".format(
+            values.shape, len(activity_urls), len(kc_ids)))
+    rows, cols = np.nonzero(~np.isnan(values))
+    return [(activity_urls[i], kc_ids[j], float(values[i, j])) for i, j in zip(rows, cols)]
+
+
+def read_npz(file):
+    """
+    Read dense parameter matrix from .npz file with 'values', 'activity_urls' and 'kc_ids' arrays
+    :param file: file-like object or path
+    :return: list of (activity url, kc_id, value) tuples
+    """
+    try:
+        with np.load(file, allow_pickle=False) as data:
+            return dense_to_triples(data['values'], [str(x) for x in data['activity_urls']],
+                                    [str(x) for x in data['kc_ids']])
+    except (KeyError, ValueError, OSError) as e:
+        raise ParameterImportError("Invalid .npz parameter file: {}".format(e))
+
+
+def write_npz(file, values, activity_urls, kc_ids):
+    """
+    Write dense parameter matrix as .npz file, readable by read_npz()
+    :param file: file-like object or path
+    """
+    np.savez_compressed(file, values=values, activity_urls=np.array(activity_urls, dtype=np.str_),
+                        kc_ids=np.array(kc_ids, dtype=np.str_))
+
+
+def read_npy(file, activity_urls, kc_ids):
+    """
+    Read dense parameter matrix from .npy file; axes are provided separately
+    :param file: file-like object or path
+    :param activity_urls: list of activity urls, row axis
+    :param kc_ids: list of kc_ids, column axis
+    :return: list of (activity url, kc_id, value) tuples
+    """
+    try:
+        values = np.load(file, allow_pickle=False)
+    except (ValueError, OSError) as e:
+        raise ParameterImportError("Invalid .npy parameter file: {}".format(e))
+    return dense_to_triples(values, activity_urls, kc_ids)
+
+
+def read_csv(file):
+    """
+    Read parameter triples from CSV text with activity_url, kc_id and value columns (header row required)
+    :param file: text file-like object
+    :return: list of (activity url, kc_id, value) tuples
+    """
+    triples = []
+    reader = csv.DictReader(file)
+    missing_fields = set(TRIPLE_FIELDS) - set(reader.fieldnames or [])
+    if missing_fields:
+        raise ParameterImportError("CSV parameter file is missing columns: {}".format(sorted(missing_fields)))
+    for line, row in enumerate(reader, start=2):
+        try:
+            triples.append((row['activity_url'], row['kc_id'], float(row['value'])))
+        except (TypeError, ValueError):
+            raise ParameterImportError("Invalid value on line {}: {}".format(line, row['value']))
+    return triples
+
+
+def read_parameter_file(file, name, activity_urls=None, kc_ids=None):
+    """
+    Read parameter triples from an uploaded or local file, with format determined by file name extension
+    :param file: binary file-like object
+    :param name: file name, ending in .npz, .npy or .csv
+    :param activity_urls: list of activity urls (row axis), required for .npy files
+    :param kc_ids: list of kc_ids (column axis), required for .npy files
+    :return: list of (activity url, kc_id, value) tuples
+    """
+    if name.endswith('.npz'):
+        return read_npz(file)
+    elif name.endswith('.npy'):
+        if activity_urls is None or kc_ids is None:
+            raise ParameterImportError("Axis lists (activity urls and kc_ids) are required for .npy files")
+        return read_npy(file, activity_urls, kc_ids)
+    elif name.endswith('.csv'):
+        return read_csv(io.StringIO(file.read().decode('utf-8')))
+    raise ParameterImportError("Unsupported parameter file type: {}".format(name))
+
+
+def import_parameters(model, triples):
+    """
+    Create or update parameter values in a single transaction, and bump ParameterVersion
+    Activities and KCs are resolved in bulk; the parameter column of existing ActivityKCParameter rows is updated with
+    bulk_update() and rows for new pairs are bulk created. If a pair occurs more than once, the last value is used.
+    :param model: Guess, Slip or Transit
+    :param triples: list of (activity url, kc_id, value) tuples
+    :return: dict with number of 'created' and 'updated' parameter values, and new 'parameter_version'
+    :raises: ParameterImportError if any activity url or kc_id does not exist; nothing is written in that case
+    """
+    activities = activity_url_index.resolve_many([url for url, kc_id, value in triples])
+    kcs = KnowledgeComponent.objects.in_bulk(list({kc_id for url, kc_id, value in triples}), field_name='kc_id')
+    unknown_urls = sorted({url for url, kc_id, value in triples if url not in activities})
+    unknown_kc_ids = sorted({kc_id for url, kc_id, value in triples if kc_id not in kcs})
+    if unknown_urls or unknown_kc_ids:
+        raise ParameterImportError("Unknown activity urls: {}; unknown kc_ids: {}".format(unknown_urls, unknown_kc_ids))
+
+    values = OrderedDict()
+    for url, kc_id, value in triples:
+        values[(activities[url].pk, kcs[kc_id].pk)] = value
+
+    field = model.parameter_field
+    with transaction.atomic():
+        activity_pks = list({activity_pk for activity_pk, kc_pk in values})
+        kc_pks = list({kc_pk for activity_pk, kc_pk in values})
+        existing = {}
+        for start in range(0, len(activity_pks), PARAMETER_QUERY_BATCH_SIZE):
+            objects = ActivityKCParameter.objects.filter(
+                activity__in=activity_pks[start:start + PARAMETER_QUERY_BATCH_SIZE],
+                knowledge_component__in=kc_pks
+            ).values_list('pk', 'activity_id', 'knowledge_component_id', field)
+            for pk, activity_pk, kc_pk, current_value in objects:
+                existing[(activity_pk, kc_pk)] = (pk, current_value)
+
+        updated, created = [], []
+        for (activity_pk, kc_pk), value in values.items():
+            if (activity_pk, kc_pk) in existing:
+                updated.append(ActivityKCParameter(pk=existing[(activity_pk, kc_pk)][0], **{field: value}))
+            else:
+                created.append(ActivityKCParameter(activity_id=activity_pk, knowledge_component_id=kc_pk,
+                                                   **{field: value}))
+        bulk_update(updated, [field])
+        ActivityKCParameter.objects.bulk_create(created, batch_size=PARAMETER_QUERY_BATCH_SIZE)
+        version = ParameterVersion.bump()
+
+    # bulk writes do not send the model signals that clear score parameters
+    score_vector_cache.clear_params()
+    # counts refer to parameter values: a value set on an existing row that had no value for the parameter is created
+    n_replaced = sum(1 for pk, current_value in existing.values() if current_value is not None)
+    return {'created': len(values) - n_replaced, 'updated': n_replaced, 'parameter_version': version}
@@ -0,0 +1,173 @@
+"""
+Process-local registry of engine instances, one per experimental group
+Engine settings are loaded once and shared by requests; the registry is reloaded when experimental groups or
+engine settings are modified in this process (see engine.signals), and at most ENGINE_REGISTRY_TTL seconds after
+loading, to pick up modifications made in other processes.
+"""
+import threading
+import time
+import numpy as np
+from .models import ExperimentalGroup, Learner
+from .caches import learner_cache
+from .engines import AdaptiveEngine, NonAdaptiveEngine, get_engine
+
+
+# seconds after which registry is reloaded from database
+ENGINE_REGISTRY_TTL = 60
+
+
+def build_alias_table(weights):
+    """
+    Build alias table (Vose's method) for drawing indices with probability proportional to weights in O(1)
+    All-zero weights are treated as equal weights; negative weights are treated as zero.
+    :param weights: list-like of non-negative weights
+    :return: (probability, alias) tuple of np.arrays of size (len(weights),)
+    """
+    weights = np.maximum(np.asarray(weights, dtype=np.float64), 0.0)
+    n = len(weights)
+    if not weights.sum():
+        weights = np.ones(n)
+    scaled = weights * n / weights.sum()
+    probability = np.ones(n)
+    alias = np.arange(n)
+    small = [i for i in range(n) if scaled[i] < 1.0]
+    large = [i for i in range(n) if scaled[i] >= 1.0]
+    while small and large:
+        i, j = small.pop(), large.pop()
+        probability[i] = scaled[i]
+        alias[i] = j
+        scaled[j] -= 1.0 - scaled[i]
+        if scaled[j] < 1.0:
+            small.append(j)
+        else:
+            large.append(j)
+    return probability, alias
+
+
+def alias_draw(probability, alias, random_state=np.random):
+    """
+    Draw an index from alias table
+    :param probability: np.array, from build_alias_table()
+    :param alias: np.array, from build_alias_table()
+    :param random_state: np.random.RandomState or np.random module
+    :return: int
+    """
+    i = random_state.randint(len(probability))
+    return int(i) if random_state.random_sample() < probability[i] else int(alias[i])
+
+
+class EngineRegistry(object):
+    """
+    Engine instances per experimental group, and experimental group assignment for new learners
+    Learners in a group with engine settings get an AdaptiveEngine with those settings, learners in a group without
+    engine settings get a NonAdaptiveEngine, and learners without a group get the default engine (get_engine()).
+    """
+    def __init__(self, ttl=ENGINE_REGISTRY_TTL):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._loaded_at = None
+        self._default_engine = None
+        # experimental group pk -> engine instance
+        self._engines = {}
+        # experimental group pks and alias table for group weights
+        self._group_pks = []
+        self._alias_table = None
+
+    def _load(self):
+        """
+        Load experimental groups and engine settings; called with lock held
+        """
+        default_engine = get_engine()
+        engines = {}
+        group_pks = []
+        weights = []
+        for group in ExperimentalGroup.objects.select_related('engine_settings').order_by('pk'):
+            if group.engine_settings is not None:
+                engines[group.pk] = AdaptiveEngine(group.engine_settings,
+                                                   pruning_epsilon=group.engine_settings.pruning_epsilon)
+            else:
+                engines[group.pk] = NonAdaptiveEngine(mastery_engine=default_engine)
+            group_pks.append(group.pk)
+            weights.append(group.weight)
+        self._default_engine = default_engine
+        self._engines = engines
+        self._group_pks = group_pks
+        self._alias_table = build_alias_table(weights) if group_pks else None
+        self._loaded_at = time.monotonic()
+
+    def _ensure_loaded(self):
+        with self._lock:
+            if self._loaded_at is None or time.monotonic() - self._loaded_at > self.ttl:
+                self._load()
+
+    def clear(self):
+        """
+        Discard loaded engines; registry is reloaded on next access
+        """
+        with self._lock:
+            self._loaded_at = None
+
+    def get_engine(self, experimental_group_id=None):
+        """
+        Get engine for experimental group
+        :param experimental_group_id: ExperimentalGroup pk, or None
+        :return: AdaptiveEngine or NonAdaptiveEngine instance; default engine if group is None or unknown
+        """
+        self._ensure_loaded()
+        return self._engines.get(experimental_group_id, self._default_engine)
+
+    def get_engine_settings(self, experimental_group_id=None):
+        """
+        Get engine settings used for experimental group
+        :param experimental_group_id: ExperimentalGroup pk, or None
+        :return: EngineSettings model instance, or None for non-adaptive groups
+        """
+        return getattr(self.get_engine(experimental_group_id), 'engine_settings', None)
+
+    def pick_experimental_group_id(self, random_state=np.random):
+        """
+        Randomly pick an experimental group, with probability proportional to group weights
+        (equal probabilities if all weights are zero)
+        :return: ExperimentalGroup pk, or None if there are no experimental groups
+        """
+        self._ensure_loaded()
+        with self._lock:
+            if not self._group_pks:
+                return None
+            group_pks, alias_table = self._group_pks, self._alias_table
+        return group_pks[alias_draw(*alias_table, random_state=random_state)]
+
+    def assign_experimental_group(self, learner):
+        """
+        Assign learner to a randomly picked experimental group, if learner has no group and groups exist
+        The group is only stored if the learner has no stored group, so concurrent requests for a new learner agree on
+        the group (the group stored by the first request is used).
+        :param learner: Learner model instance
+        """
+        if learner.experimental_group_id is not None:
+            return
+        experimental_group_id = self.pick_experimental_group_id()
+        if experimental_group_id is None:
+            return
+        updated = Learner.objects.filter(pk=learner.pk, experimental_group__isnull=True).update(
+            experimental_group_id=experimental_group_id)
+        if updated:
+            learner.experimental_group_id = experimental_group_id
+        else:
+            # assigned by another request
+            learner.experimental_group_id = Learner.objects.filter(pk=learner.pk).values_list(
+                'experimental_group_id', flat=True).first()
+        # update() does not send the save signal that updates the learner cache
+        learner_cache.set(learner)
+
+    def get_engine_for_learner(self, learner):
+        """
+        Get engine for learner's experimental group, assigning learner to a group first if needed
+        :param learner: Learner model instance
+        :return: AdaptiveEngine or NonAdaptiveEngine instance
+        """
+        self.assign_experimental_group(learner)
+        return self.get_engine(learner.experimental_group_id)
+
+
+engine_registry = EngineRegistry()
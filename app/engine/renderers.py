@@ -0,0 +1,102 @@
+"""
+Renderers for array-valued and export API responses
+"""
+import io
+import numpy as np
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+class JSONErrorRenderer(BaseRenderer):
+    """
+    Base class for non-JSON renderers
+    Responses that are not successful (e.g. validation errors) are rendered as JSON instead.
+    """
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        response = (renderer_context or {}).get('response')
+        if response is not None and response.status_code >= 400:
+            response['Content-Type'] = JSONRenderer.media_type
+            return JSONRenderer().render(data, accepted_media_type, renderer_context)
+        return self.render_data(data)
+
+    def render_data(self, data):
+        raise NotImplementedError
+
+
+class ArrayRenderer(JSONErrorRenderer):
+    """
+    Base class for binary renderers of array data
+    """
+    charset = None
+    render_style = 'binary'
+
+
+class NpyRenderer(ArrayRenderer):
+    """
+    Renders the 'mastery' array of response data in NumPy .npy format
+    Other response fields (e.g. axis labels) are not included; the view documents how rows and columns are aligned.
+    """
+    media_type = 'application/x-npy'
+    format = 'npy'
+    array_field = 'mastery'
+
+    def render_data(self, data):
+        buffer = io.BytesIO()
+        np.save(buffer, np.asarray(data[self.array_field], dtype=np.float64), allow_pickle=False)
+        return buffer.getvalue()
+
+
+class NpzRenderer(ArrayRenderer):
+    """
+    Renders arrays in response data (values and axis lists) as a compressed NumPy .npz file
+    """
+    media_type = 'application/x-npz'
+    format = 'npz'
+
+    def render_data(self, data):
+        buffer = io.BytesIO()
+        np.savez_compressed(buffer, **{key: np.asarray(value) for key, value in data.items()})
+        return buffer.getvalue()
+
+
+class MessagePackRenderer(ArrayRenderer):
+    """
+    Renders response data in MessagePack format; requires the msgpack package
+    """
+    media_type = 'application/x-msgpack'
+    format = 'msgpack'
+
+    def render_data(self, data):
+        return msgpack.packb(data, use_bin_type=True)
+
+
+class ExportRenderer(JSONErrorRenderer):
+    """
+    Base class for export formats; successful exports are streamed by the view (see engine.export), so only
+    error responses are rendered
+    """
+    charset = 'utf-8'
+
+
+class NDJSONRenderer(ExportRenderer):
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+
+
+class CSVRenderer(ExportRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+
+
+def array_renderer_classes():
+    """
+    Renderer classes for array-valued endpoints: JSON, .npy, and MessagePack if msgpack is installed
+    :return: list of renderer classes
+    """
+    renderer_classes = [JSONRenderer, NpyRenderer]
+    if msgpack is not None:
+        renderer_classes.append(MessagePackRenderer)
+    return renderer_classes
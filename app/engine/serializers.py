@@ -1,5 +1,11 @@
+from collections import OrderedDict
+from django.db import IntegrityError, transaction
+from django.utils.encoding import smart_text
 from rest_framework import serializers, validators
 from .models import *
+from .caches import (activity_url_index, learner_cache, score_vector_cache, nonadaptive_sequence_cache,
+                     LEARNER_QUERY_BATCH_SIZE)
+from .bulk import bulk_update
 
 
 class LearnerSerializer(serializers.ModelSerializer):
@@ -126,7 +132,7 @@ class MasterySerializer(serializers.ModelSerializer):
         """
         # create referenced learner if it doesn't exist already
         learner_data = validated_data.pop('learner')
-        learner, created = Learner.objects.get_or_create(**learner_data)
+        learner, created = learner_cache.get_or_create(**learner_data)
         # get referenced knowledge component
         knowledge_component_data = validated_data.pop('knowledge_component')
         knowledge_component = KnowledgeComponent.objects.get(**knowledge_component_data)
@@ -143,15 +149,131 @@ class MasterySerializer(serializers.ModelSerializer):
         return mastery
 
 
+class KnowledgeComponentIdSerializer(serializers.Serializer):
+    """
+    Nested serializer for knowledge_component foreign key field, without per-item existence check
+    (checked for all items at once by MasteryListSerializer)
+    """
+    kc_id = serializers.CharField()
+
+
+class MasteryListSerializer(serializers.ListSerializer):
+    """
+    Validates and writes lists of mastery values with set-based queries
+    """
+    def to_internal_value(self, data):
+        """
+        Validate items, and check that all referenced knowledge components exist with a single query
+        Validated items include the KnowledgeComponent model instance as 'knowledge_component'.
+        """
+        validated_data = super().to_internal_value(data)
+        kc_ids = {item['knowledge_component']['kc_id'] for item in validated_data}
+        knowledge_components = KnowledgeComponent.objects.in_bulk(list(kc_ids), field_name='kc_id')
+        errors = [
+            {} if item['knowledge_component']['kc_id'] in knowledge_components else
+            {'knowledge_component': {'kc_id': ["Knowledge component with specified kc_id does not exist"]}}
+            for item in validated_data
+        ]
+        if any(errors):
+            raise serializers.ValidationError(errors)
+        for item in validated_data:
+            item['knowledge_component'] = knowledge_components[item['knowledge_component']['kc_id']]
+        return validated_data
+
+    def create(self, validated_data):
+        """
+        Create or update mastery values in a single transaction
+        Learners are resolved (and created if they do not exist yet) in bulk, existing mastery objects are fetched
+        with one query per batch of learners and updated with bulk_update(), and new mastery objects are bulk created.
+        If the bulk insert conflicts with mastery objects created concurrently by another request, new mastery objects
+        are created or updated one by one instead.
+        If an item occurs more than once for a learner/kc, the last value is used.
+        :param validated_data: list of validated items
+        :return: list of Mastery model instances, one per item
+        """
+        learners = learner_cache.get_or_create_many(
+            (item['learner']['user_id'], item['learner']['tool_consumer_instance_guid']) for item in validated_data
+        )
+        values = OrderedDict()
+        for item in validated_data:
+            learner = learners[(item['learner']['user_id'], item['learner']['tool_consumer_instance_guid'])]
+            values[(learner.pk, item['knowledge_component'].pk)] = (learner, item['knowledge_component'], item['value'])
+
+        with transaction.atomic():
+            learner_pks = list({learner.pk for learner, kc, value in values.values()})
+            kc_pks = list({kc.pk for learner, kc, value in values.values()})
+            existing = {}
+            for start in range(0, len(learner_pks), LEARNER_QUERY_BATCH_SIZE):
+                masteries = Mastery.objects.filter(
+                    learner__in=learner_pks[start:start + LEARNER_QUERY_BATCH_SIZE],
+                    knowledge_component__in=kc_pks
+                ).values_list('pk', 'learner_id', 'knowledge_component_id')
+                for pk, learner_pk, kc_pk in masteries:
+                    existing[(learner_pk, kc_pk)] = pk
+
+            updated, created, results = [], [], {}
+            for key, (learner, knowledge_component, value) in values.items():
+                mastery = Mastery(pk=existing.get(key), learner=learner, knowledge_component=knowledge_component,
+                                  value=value)
+                if key in existing:
+                    updated.append(mastery)
+                else:
+                    created.append(mastery)
+                results[key] = mastery
+            bulk_update(updated, ['value'])
+            try:
+                with transaction.atomic():
+                    Mastery.objects.bulk_create(created)
+            except IntegrityError:
+                # some mastery objects were created by another request
+                for mastery in created:
+                    key = (mastery.learner_id, mastery.knowledge_component_id)
+                    results[key], _ = Mastery.objects.update_or_create(
+                        learner=mastery.learner, knowledge_component=mastery.knowledge_component,
+                        defaults={'value': mastery.value}
+                    )
+
+        return [results[(learners[(item['learner']['user_id'], item['learner']['tool_consumer_instance_guid'])].pk,
+                         item['knowledge_component'].pk)] for item in validated_data]
+
+
+class BulkMasterySerializer(MasterySerializer):
+    """
+    Mastery serializer for bulk writes (many=True), see MasteryListSerializer
+    """
+    knowledge_component = KnowledgeComponentIdSerializer()
+
+    class Meta(MasterySerializer.Meta):
+        list_serializer_class = MasteryListSerializer
+
+
+class ActivityUrlField(serializers.SlugRelatedField):
+    """
+    Related field for activities referenced by url
+    Resolves url through the process-local activity url index instead of a url lookup query; with deferred, indexed
+    urls resolve without a query, to activities with only pk and url loaded (see ActivityUrlIndex.resolve_many)
+    """
+    def __init__(self, deferred=False, **kwargs):
+        self.deferred = deferred
+        kwargs.setdefault('queryset', Activity.objects.all())
+        super().__init__(slug_field='url', **kwargs)
+
+    def to_internal_value(self, data):
+        try:
+            return activity_url_index.resolve(data, deferred=self.deferred)
+        except Activity.DoesNotExist:
+            self.fail('does_not_exist', slug_name=self.slug_field, value=smart_text(data))
+        except (TypeError, ValueError, AttributeError):
+            self.fail('invalid')
+
+
 class ScoreSerializer(serializers.ModelSerializer):
     """
     Score model serializer
     """
     learner = LearnerSerializer()
-    activity = serializers.SlugRelatedField(
-        slug_field='url',
-        queryset=Activity.objects.all()
-    )
+    # score writes only use the activity pk
+    activity = ActivityUrlField(deferred=True)
 
     class Meta:
         model = Score
@@ -167,15 +289,21 @@ class ScoreSerializer(serializers.ModelSerializer):
         """
         # create related learner if it doesn't exist already
         learner_data = validated_data.pop('learner')
-        learner, created = Learner.objects.get_or_create(**learner_data)
+        learner, created = learner_cache.get_or_create(**learner_data)
         # get related activity
         activity = validated_data.pop('activity')
         # create the score object
-        score = Score.objects.create(
-            learner=learner,
-            activity=activity,
-            score=validated_data.pop('score')
-        )
+        try:
+            with transaction.atomic():
+                score = Score.objects.create(learner=learner, activity=activity, score=validated_data['score'])
+        except IntegrityError:
+            # activity deleted in another process since it was indexed; resolve url from database
+            activity_url_index.discard(activity.pk)
+            try:
+                activity = activity_url_index.resolve(activity.url)
+            except Activity.DoesNotExist:
+                raise serializers.ValidationError({'activity': ["Activity with specified url does not exist"]})
+            score = Score.objects.create(learner=learner, activity=activity, score=validated_data['score'])
         return score
 
 
@@ -200,6 +328,19 @@ class ActivityRecommendationSerializer(serializers.ModelSerializer):
         fields = ('source_launch_url',)
 
 
+class RankedActivityRecommendationSerializer(serializers.ModelSerializer):
+    """
+    Serializer for an item of a top-n recommendation response; score is set on activity instance by the view
+    (null for non-adaptive engines)
+    """
+    source_launch_url = serializers.CharField(source='url')
+    score = serializers.FloatField()
+
+    class Meta:
+        model = Activity
+        fields = ('source_launch_url', 'score')
+
+
 class SequenceActivitySerializer(serializers.Serializer):
     """
     Serializer for activity in a sequence list
@@ -214,16 +355,95 @@ class SequenceActivitySerializer(serializers.Serializer):
         fields = ('activity', 'score', 'is_problem')
 
 
+class CollectionGradesRequestSerializer(serializers.Serializer):
+    """
+    Serializer for incoming batched grade request data
+    If learners is omitted, all learners with scores on activities in the collection are graded.
+    """
+    learners = LearnerSerializer(many=True, required=False)
+
+
+class MasteryMatrixRequestSerializer(serializers.Serializer):
+    """
+    Serializer for incoming mastery matrix request data
+    KC axis is defined by kc_ids if provided, otherwise by the KCs of collection if provided, otherwise by all KCs.
+    """
+    learners = LearnerSerializer(many=True)
+    kc_ids = serializers.ListField(child=serializers.CharField(), required=False)
+    collection = serializers.SlugRelatedField(
+        slug_field='collection_id',
+        queryset=Collection.objects.all(),
+        required=False
+    )
+
+
+class TaggingMatrixSerializer(serializers.Serializer):
+    """
+    Sparse (coordinate format) activity x KC tagging matrix: activity activity_urls[rows[i]] is tagged with KC
+    kc_ids[cols[i]]
+    """
+    activity_urls = serializers.ListField(child=serializers.CharField())
+    kc_ids = serializers.ListField(child=serializers.CharField())
+    rows = serializers.ListField(child=serializers.IntegerField(min_value=0))
+    cols = serializers.ListField(child=serializers.IntegerField(min_value=0))
+
+    def validate(self, data):
+        if len(data['rows']) != len(data['cols']):
+            raise serializers.ValidationError("rows and cols must have the same length")
+        if any(i >= len(data['activity_urls']) for i in data['rows']):
+            raise serializers.ValidationError("row index out of range of activity_urls")
+        if any(j >= len(data['kc_ids']) for j in data['cols']):
+            raise serializers.ValidationError("col index out of range of kc_ids")
+        return data
+
+
+class TaggingRequestSerializer(serializers.Serializer):
+    """
+    Serializer for incoming bulk tagging request data
+    Tagging is specified either as a list of [activity url, kc_id] pairs, or as a sparse tagging matrix.
+    """
+    pairs = serializers.ListField(
+        child=serializers.ListField(child=serializers.CharField(), min_length=2, max_length=2),
+        required=False
+    )
+    matrix = TaggingMatrixSerializer(required=False)
+    collection = serializers.SlugRelatedField(
+        slug_field='collection_id',
+        queryset=Collection.objects.all(),
+        required=False
+    )
+
+    def validate(self, data):
+        if ('pairs' in data) == ('matrix' in data):
+            raise serializers.ValidationError("Exactly one of pairs or matrix is required")
+        return data
+
+
 class ActivityRecommendationRequestSerializer(serializers.Serializer):
     """
     Serializer for incoming activity recommendation request data
+    If sequence is omitted (or null), the learner's server-side sequence is used instead; in that case the request
+    can include the sequence version the bridge last received, and any sequence items added since then.
     """
     learner = LearnerSerializer()
     collection = serializers.SlugRelatedField(
             slug_field='collection_id',
             queryset=Collection.objects.all()
         )
-    sequence = SequenceActivitySerializer(many=True)
+    sequence = SequenceActivitySerializer(many=True, required=False, allow_null=True)
+    sequence_version = serializers.IntegerField(required=False, min_value=0)
+    sequence_delta = SequenceActivitySerializer(many=True, required=False)
+    top_n = serializers.IntegerField(required=False, min_value=1)
+
+    def validate(self, data):
+        """
+        Full sequence and server-side sequence fields are mutually exclusive
+        """
+        if data.get('sequence') is not None and ('sequence_version' in data or 'sequence_delta' in data):
+            raise serializers.ValidationError(
+                "sequence_version/sequence_delta cannot be used together with a full sequence"
+            )
+        return data
 
 
 class CollectionActivityListSerializer(serializers.ListSerializer):
@@ -235,25 +455,52 @@ class CollectionActivityListSerializer(serializers.ListSerializer):
         Adds activities to the collection if they are not already in collection,
         and create new activities or updates fields of existing activities if needed.
         "instance" argument is the queryset of activities currently in the collection
+        Activities are diffed by url in memory, and written with set-based queries in a single transaction.
         """
+        collection = self.context['collection']
         # Maps for id->instance and id->data item.
         activity_mapping = {activity.url: activity for activity in instance}
         data_mapping = {item['url']: item for item in validated_data}
 
-        # Perform creations, updates and additions to collection
-        results = []
-        for activity_url, data in data_mapping.items():
-            # check if activity with url id exists anywhere
-            activity, created = Activity.objects.update_or_create(data, url=activity_url)
-            # make sure it is added to collection if within collection context
-            activity.collections.add(self.context['collection'])
-            results.append(activity)
-
-        # Perform removals from collection.
-        for activity_url, activity in activity_mapping.items():
-            if activity_url not in data_mapping:
-                activity.collections.remove(self.context['collection'])
-
+        with transaction.atomic():
+            # check if activities with url ids exist anywhere
+            existing = activity_url_index.resolve_many(list(data_mapping))
+
+            # updates of existing activities, for fields that changed
+            updated, updated_fields = [], set()
+            for activity_url, activity in existing.items():
+                changed = [field for field, value in data_mapping[activity_url].items()
+                           if getattr(activity, field) != value]
+                for field in changed:
+                    setattr(activity, field, data_mapping[activity_url][field])
+                if changed:
+                    updated.append(activity)
+                    updated_fields.update(changed)
+            bulk_update(updated, sorted(updated_fields))
+
+            # creations; created activities are fetched again for their pks, which bulk_create() does not set on
+            # all database backends
+            created_urls = [activity_url for activity_url in data_mapping if activity_url not in existing]
+            if created_urls:
+                Activity.objects.bulk_create([Activity(**data_mapping[activity_url]) for activity_url in created_urls])
+                for activity in Activity.objects.filter(url__in=created_urls).order_by('-pk'):
+                    existing[activity.url] = activity
+                    activity_url_index.set(activity.url, activity.pk)
+
+            # additions to and removals from collection
+            results = [existing[activity_url] for activity_url in data_mapping]
+            added = [activity for activity in results if activity.url not in activity_mapping]
+            removed = [activity for activity_url, activity in activity_mapping.items()
+                       if activity_url not in data_mapping]
+            if added:
+                collection.activity_set.add(*added)
+            if removed:
+                collection.activity_set.remove(*removed)
+
+        if updated or created_urls:
+            # bulk writes do not send the model signals that refresh these caches
+            score_vector_cache.clear_params()
+            nonadaptive_sequence_cache.clear_orders()
         return results
 
 
@@ -0,0 +1,69 @@
+"""
+Signal handlers that keep process-local caches (engine.caches) in sync with model writes
+"""
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+from .models import (Activity, ActivityKCParameter, Collection, EngineSettings, ExperimentalGroup, Guess,
+                     KnowledgeComponent, Learner, PrerequisiteRelation, Slip)
+from .caches import activity_url_index, learner_cache, score_vector_cache, nonadaptive_sequence_cache
+from .registry import engine_registry
+
+
+@receiver(post_save, sender=Activity)
+def update_activity_url_index(sender, instance, **kwargs):
+    activity_url_index.set(instance.url, instance.pk)
+
+
+@receiver(post_delete, sender=Activity)
+def remove_from_activity_url_index(sender, instance, **kwargs):
+    activity_url_index.discard(instance.pk)
+
+
+@receiver(post_save, sender=Learner)
+def update_learner_cache(sender, instance, **kwargs):
+    learner_cache.set(instance)
+
+
+@receiver(post_delete, sender=Learner)
+def remove_from_learner_cache(sender, instance, **kwargs):
+    learner_cache.discard(instance)
+
+
+# models that score parameters (engine.incremental.CollectionScoreParams) are computed from
+# (Guess and Slip are proxies of ActivityKCParameter; signals are sent with the proxy class as sender)
+SCORE_PARAMETER_MODELS = (Activity, ActivityKCParameter, Collection, Guess, KnowledgeComponent, PrerequisiteRelation,
+                          Slip)
+
+
+@receiver(post_save)
+@receiver(post_delete)
+def clear_score_params(sender, **kwargs):
+    if sender in SCORE_PARAMETER_MODELS:
+        score_vector_cache.clear_params()
+
+
+@receiver(m2m_changed, sender=Activity.knowledge_components.through)
+@receiver(m2m_changed, sender=Activity.collections.through)
+def clear_score_params_on_membership_change(sender, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        score_vector_cache.clear_params()
+
+
+@receiver(post_save, sender=Activity)
+@receiver(post_delete, sender=Activity)
+def clear_nonadaptive_sequences(sender, **kwargs):
+    nonadaptive_sequence_cache.clear_orders()
+
+
+@receiver(m2m_changed, sender=Activity.collections.through)
+def clear_nonadaptive_sequences_on_membership_change(sender, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        nonadaptive_sequence_cache.clear_orders()
+
+
+@receiver(post_save, sender=EngineSettings)
+@receiver(post_delete, sender=EngineSettings)
+@receiver(post_save, sender=ExperimentalGroup)
+@receiver(post_delete, sender=ExperimentalGroup)
+def clear_engine_registry(sender, **kwargs):
+    engine_registry.clear()
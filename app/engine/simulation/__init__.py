@@ -0,0 +1,4 @@
+"""
+Synthetic data for performance testing: random activity/KC catalogs, and learner responses generated by a
+Bayesian Knowledge Tracing (BKT) simulator (see bkt), loaded into the database in bulk (see synthetic)
+"""
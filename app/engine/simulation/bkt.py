@@ -0,0 +1,153 @@
+"""
+Random activity/KC catalogs and Bayesian Knowledge Tracing (BKT) simulation of learner responses
+Does not depend on django models; parameters are probabilities (the engine stores them as odds).
+"""
+from collections import namedtuple
+import numpy as np
+from alosi.engine import calculate_mastery_update, odds, EPSILON
+
+
+# Activity-kc tagging and parameters of a catalog, in compressed sparse row layout: the KCs of activity i are
+# kc_indices[kc_indptr[i]:kc_indptr[i+1]], with guess/slip/transit probabilities at the same positions
+SyntheticCatalog = namedtuple('SyntheticCatalog', [
+    'n_kcs',
+    'kc_indptr',
+    'kc_indices',
+    'guess',
+    'slip',
+    'transit',
+    # difficulty (probability scale) of each activity
+    'difficulty',
+    # collection index of each activity
+    'activity_collections',
+    # (prerequisite kc indices, kc indices, values) tuple of prerequisite relations
+    'prerequisites',
+])
+
+GUESS_RANGE = (0.05, 0.3)
+SLIP_RANGE = (0.05, 0.2)
+TRANSIT_RANGE = (0.05, 0.2)
+
+
+def random_catalog(rng, n_activities, n_kcs, kcs_per_activity, n_collections, prerequisite_density):
+    """
+    Generate a random catalog
+    Each activity is tagged with kcs_per_activity distinct KCs and belongs to one collection; prerequisite relations
+    only point from lower to higher KC indices, so that the prerequisite graph is acyclic.
+    :param rng: np.random.RandomState
+    :param n_activities: int, number of activities
+    :param n_kcs: int, number of KCs
+    :param kcs_per_activity: int, number of KCs tagged per activity (at most n_kcs)
+    :param n_collections: int, number of collections
+    :param prerequisite_density: float, approximate fraction of KC pairs with a prerequisite relation
+    :return: SyntheticCatalog
+    """
+    kcs_per_activity = min(kcs_per_activity, n_kcs)
+    kc_indptr = np.arange(n_activities + 1) * kcs_per_activity
+    kc_indices = np.concatenate([
+        rng.choice(n_kcs, size=kcs_per_activity, replace=False) for i in range(n_activities)
+    ]) if n_activities else np.array([], dtype=int)
+    n_tagged = len(kc_indices)
+
+    n_pairs = n_kcs * (n_kcs - 1) // 2
+    n_prerequisites = rng.binomial(n_pairs, prerequisite_density) if n_pairs else 0
+    a, b = rng.randint(n_kcs, size=n_prerequisites), rng.randint(n_kcs, size=n_prerequisites)
+    keys = np.unique(np.minimum(a, b) * n_kcs + np.maximum(a, b))
+    keys = keys[keys // n_kcs != keys % n_kcs]
+
+    return SyntheticCatalog(
+        n_kcs=n_kcs,
+        kc_indptr=kc_indptr,
+        kc_indices=kc_indices,
+        guess=rng.uniform(*GUESS_RANGE, size=n_tagged),
+        slip=rng.uniform(*SLIP_RANGE, size=n_tagged),
+        transit=rng.uniform(*TRANSIT_RANGE, size=n_tagged),
+        difficulty=rng.rand(n_activities),
+        activity_collections=rng.randint(max(n_collections, 1), size=n_activities),
+        prerequisites=(keys // n_kcs, keys % n_kcs, rng.rand(len(keys))),
+    )
+
+
+def catalog_positions(catalog, activities):
+    """
+    Positions (in kc_indices and parameter arrays) of the KCs of each of a list of activities
+    :param catalog: SyntheticCatalog
+    :param activities: np.array of activity indices
+    :return: (owners, positions) tuple of np.arrays; owners[j] is the index into activities that positions[j]
+        belongs to
+    """
+    starts = catalog.kc_indptr[activities]
+    lengths = catalog.kc_indptr[activities + 1] - starts
+    owners = np.repeat(np.arange(len(activities)), lengths)
+    offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    return owners, np.repeat(starts, lengths) + offsets
+
+
+class LearnerPopulation(object):
+    """
+    Latent knowledge and tracked mastery of a population of simulated learners, with vectorized BKT responses
+    A learner initially knows each KC with probability prior. An attempt is correct with probability
+    prod(1 - slip) over the activity's KCs if all are known, and with the product of guess (unknown KCs) and 1 - slip
+    (known KCs) probabilities otherwise; afterwards, each unknown KC of the activity is learned with its transit
+    probability. Mastery is tracked with the engine's update rule (alosi.engine.calculate_mastery_update).
+    """
+    def __init__(self, rng, catalog, n_learners, prior):
+        """
+        :param rng: np.random.RandomState
+        :param catalog: SyntheticCatalog
+        :param n_learners: int, number of learners
+        :param prior: float, probability that a KC is initially known (also the mastery prior), or
+            (# learners) x (# KCs) np.array of per-learner probabilities
+        """
+        self.rng = rng
+        self.catalog = catalog
+        # (# learners) x (# KCs) arrays
+        shape = (n_learners, catalog.n_kcs)
+        self.known = rng.rand(*shape) < prior
+        self.mastery_odds = np.array(np.broadcast_to(odds(np.asarray(prior, dtype=float)), shape))
+
+    @property
+    def mastery(self):
+        """
+        Tracked mastery probabilities, (# learners) x (# KCs) np.array
+        """
+        return self.mastery_odds / (1 + self.mastery_odds)
+
+    def attempt(self, learners, activities):
+        """
+        Simulate one attempt for each of a set of learners, and update knowledge and tracked mastery
+        :param learners: np.array of distinct learner indices
+        :param activities: np.array of activity indices, attempted by the corresponding learners
+        :return: np.array of scores (0.0 or 1.0)
+        """
+        catalog = self.catalog
+        learners, activities = np.asarray(learners, dtype=int), np.asarray(activities, dtype=int)
+        owners, positions = catalog_positions(catalog, activities)
+        rows, kcs = learners[owners], catalog.kc_indices[positions]
+        guess, slip, transit = catalog.guess[positions], catalog.slip[positions], catalog.transit[positions]
+
+        # product of per-KC probabilities of each attempt, as a sum of logs
+        log_p = np.log(np.where(self.known[rows, kcs], 1 - slip, guess))
+        p_correct = np.exp(np.bincount(owners, weights=log_p, minlength=len(activities)))
+        scores = (self.rng.rand(len(activities)) < p_correct).astype(float)
+
+        self.known[rows, kcs] |= self.rng.rand(len(positions)) < transit
+        self.mastery_odds[rows, kcs] = calculate_mastery_update(
+            self.mastery_odds[rows, kcs], scores[owners], odds(guess), odds(slip), odds(transit), EPSILON)
+        return scores
+
+
+def simulate_learner(rng, catalog, activities, n_scores, prior):
+    """
+    Simulate a learner attempting random activities, with BKT responses (see LearnerPopulation)
+    :param rng: np.random.RandomState
+    :param catalog: SyntheticCatalog
+    :param activities: np.array of indices of activities available to the learner
+    :param n_scores: int, number of attempts
+    :param prior: float, probability that a KC is initially known (also the mastery prior)
+    :return: (activity indices, scores, mastery) tuple; mastery is a (# KCs) np.array of probabilities
+    """
+    population = LearnerPopulation(rng, catalog, 1, prior)
+    attempts = rng.choice(activities, size=n_scores) if len(activities) else np.array([], dtype=int)
+    scores = np.array([population.attempt([0], [activity])[0] for activity in attempts])
+    return attempts, scores, population.mastery[0]
@@ -0,0 +1,252 @@
+"""
+Drive the engine with a population of simulated learners (see bkt.LearnerPopulation), in-process or through the
+HTTP API, for load generation and for comparing engine settings
+Learners request recommendations for a collection and submit BKT-simulated scores in rounds: in each round, every
+learner who has not completed the collection gets one recommendation, and the population answers all recommended
+activities at once. Requests within a round are issued by a pool of concurrent workers.
+"""
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from django.db import connection
+from alosi.engine_api import EngineApi
+from ..models import Activity, ActivityKCParameter, Score, SequenceItem
+from ..caches import activity_url_index, learner_cache
+from ..engines import AdaptiveEngine, PARAMETER_DEFAULTS
+from ..registry import engine_registry
+from .bkt import LearnerPopulation, SyntheticCatalog
+
+
+LATENCY_PERCENTILES = (50, 90, 99)
+
+
+class InProcessEngineClient(object):
+    """
+    Calls the engine in the current process, with the same database writes as the recommend and score endpoints
+    """
+    def __init__(self, engine_settings=None):
+        """
+        :param engine_settings: EngineSettings model instance used for all learners; if None, the engine of each
+            learner's experimental group is used
+        """
+        self.engine = AdaptiveEngine(engine_settings) if engine_settings is not None else None
+
+    def get_engine(self, learner):
+        return self.engine or engine_registry.get_engine_for_learner(learner)
+
+    def recommend(self, learner, collection, sequence):
+        """
+        :param learner: dict with user_id and tool_consumer_instance_guid
+        :param collection: Collection model instance
+        :param sequence: list of (activity url, score) tuples, learner's sequence history
+        :return: url of recommended activity, or None if the learner completed the collection
+        """
+        learner, created = learner_cache.get_or_create(**learner)
+        activities = activity_url_index.resolve_many([url for url, score in sequence], deferred=True)
+        sequence = [activities[url] for url, score in sequence]
+        activity = self.get_engine(learner).recommend(learner, collection, sequence)
+        return activity.url if activity else None
+
+    def submit_score(self, learner, url, score):
+        """
+        :param learner: dict with user_id and tool_consumer_instance_guid
+        :param url: activity url
+        :param score: float
+        """
+        learner, created = learner_cache.get_or_create(**learner)
+        activity = activity_url_index.resolve(url, deferred=True)
+        Score.objects.create(learner=learner, activity=activity, score=score)
+        SequenceItem.record_score(learner, activity, score)
+        self.get_engine(learner).update_from_score(learner, activity, score)
+
+
+class HttpEngineClient(object):
+    """
+    Calls the engine HTTP API, with one connection session per worker thread
+    """
+    def __init__(self, url, token=None):
+        """
+        :param url: engine base url, e.g. http://localhost:8000
+        :param token: API token
+        """
+        self.url = url
+        self.token = token
+        self._local = threading.local()
+
+    @property
+    def api(self):
+        if not hasattr(self._local, 'api'):
+            self._local.api = EngineApi(self.url, token=self.token)
+        return self._local.api
+
+    def recommend(self, learner, collection, sequence):
+        # client-side sequence mode, see ActivityViewSet.recommend
+        response = self.api.recommend(
+            learner=learner,
+            collection=collection.collection_id,
+            sequence=[{'activity': url, 'score': score, 'is_problem': True} for url, score in sequence]
+        )
+        response.raise_for_status()
+        data = response.json()
+        return None if data.get('complete') else data['source_launch_url']
+
+    def submit_score(self, learner, url, score):
+        self.api.submit_score(learner=learner, activity=url, score=score).raise_for_status()
+
+
+def load_catalog(collection):
+    """
+    Catalog of the activities of a collection, with guess/slip/transit from stored parameters (defaults for tagged
+    activity-kc pairs without a stored value), converted from odds to probabilities
+    :param collection: Collection model instance
+    :return: (SyntheticCatalog, list of activity urls in catalog order) tuple
+    """
+    activities = list(collection.activity_set.order_by('pk').values_list('pk', 'url'))
+    activity_map = {pk: i for i, (pk, url) in enumerate(activities)}
+    pairs = sorted(
+        (activity_map[activity_pk], kc_pk) for activity_pk, kc_pk in
+        Activity.knowledge_components.through.objects.filter(activity__collections=collection)
+        .values_list('activity_id', 'knowledgecomponent_id')
+    )
+    kc_map = {kc_pk: i for i, kc_pk in enumerate(sorted({kc_pk for i, kc_pk in pairs}))}
+    stored = {
+        (activity_map[activity_pk], kc_pk): values
+        for activity_pk, kc_pk, *values in ActivityKCParameter.objects.filter(activity__collections=collection)
+        .values_list('activity_id', 'knowledge_component_id', 'guess', 'slip', 'transit')
+    }
+    parameters = np.array([
+        [value if value is not None else PARAMETER_DEFAULTS[field]
+         for field, value in zip(('guess', 'slip', 'transit'), stored.get(pair, (None, None, None)))]
+        for pair in pairs
+    ]).reshape(-1, 3)
+    probabilities = parameters / (1 + parameters)
+    catalog = SyntheticCatalog(
+        n_kcs=len(kc_map),
+        kc_indptr=np.searchsorted([i for i, kc_pk in pairs], np.arange(len(activities) + 1)),
+        kc_indices=np.array([kc_map[kc_pk] for i, kc_pk in pairs], dtype=int),
+        guess=probabilities[:, 0],
+        slip=probabilities[:, 1],
+        transit=probabilities[:, 2],
+        difficulty=np.zeros(len(activities)),
+        activity_collections=np.zeros(len(activities), dtype=int),
+        prerequisites=(np.array([], dtype=int), np.array([], dtype=int), np.array([])),
+    )
+    return catalog, [url for pk, url in activities]
+
+
+def _timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def _closing_connection(function):
+    """
+    Wrap a function called from worker threads to close the thread's database connection after each call, as Django
+    does at the end of each request (connections of worker threads are not closed when the threads exit)
+    """
+    def wrapper(*args):
+        try:
+            return function(*args)
+        finally:
+            connection.close()
+    return wrapper
+
+
+def latency_summary(latencies):
+    """
+    :param latencies: list of latencies in seconds
+    :return: OrderedDict of latency percentiles and mean in milliseconds
+    """
+    if not latencies:
+        return OrderedDict()
+    latencies = 1000 * np.asarray(latencies)
+    return OrderedDict(
+        [('p{}'.format(q), float(np.percentile(latencies, q))) for q in LATENCY_PERCENTILES] +
+        [('mean', float(latencies.mean()))]
+    )
+
+
+def run_simulation(client, collection, n_learners, n_steps, concurrency=1, seed=0, prefix='simulation', prior=0.2):
+    """
+    Simulate learners working through a collection
+    :param client: InProcessEngineClient or HttpEngineClient
+    :param collection: Collection model instance
+    :param n_learners: int, number of simulated learners
+    :param n_steps: int, maximum number of attempts per learner
+    :param concurrency: int, number of concurrent request workers; with 1, requests are made from the calling
+        thread (required for in-process simulation inside a database transaction, e.g. in tests)
+    :param seed: int, random seed
+    :param prefix: str, learner identifier prefix (learners are created by the engine if they do not exist)
+    :param prior: float, probability that a KC is initially known
+    :return: OrderedDict report of throughput, request latencies and learning outcomes
+    """
+    catalog, urls = load_catalog(collection)
+    url_index = {url: i for i, url in enumerate(urls)}
+    population = LearnerPopulation(np.random.RandomState(seed), catalog, n_learners, prior)
+    initial_knowledge = population.known.mean(axis=1) if catalog.n_kcs else np.zeros(n_learners)
+    learners = [{'user_id': '{}-{}'.format(prefix, i), 'tool_consumer_instance_guid': prefix}
+                for i in range(n_learners)]
+    sequences = [[] for i in range(n_learners)]
+    active = np.ones(n_learners, dtype=bool)
+    recommend_latencies, score_latencies, scores = [], [], []
+
+    if concurrency > 1:
+        executor = ThreadPoolExecutor(max_workers=concurrency)
+
+        def map_function(function, iterable):
+            return executor.map(_closing_connection(function), iterable)
+    else:
+        executor, map_function = None, map
+    start = time.perf_counter()
+    try:
+        for step in range(n_steps):
+            indices = np.flatnonzero(active)
+            if not len(indices):
+                break
+            results = list(map_function(
+                lambda i: _timed(client.recommend, learners[i], collection, sequences[i]), indices))
+            recommend_latencies.extend(latency for url, latency in results)
+            # learners are done when the engine has no further recommendation
+            attempting = [(i, url_index[url]) for i, (url, latency) in zip(indices, results) if url in url_index]
+            active[indices] = False
+            if not attempting:
+                break
+            learner_indices, activity_indices = (np.array(column) for column in zip(*attempting))
+            active[learner_indices] = True
+            step_scores = population.attempt(learner_indices, activity_indices)
+            scores.extend(step_scores)
+            results = list(map_function(
+                lambda args: _timed(client.submit_score, learners[args[0]], urls[args[1]], args[2]),
+                zip(learner_indices, activity_indices, step_scores)
+            ))
+            score_latencies.extend(latency for result, latency in results)
+            for i, activity, score in zip(learner_indices, activity_indices, step_scores):
+                sequences[i].append((urls[activity], float(score)))
+    finally:
+        if executor:
+            executor.shutdown()
+    elapsed = time.perf_counter() - start
+
+    final_knowledge = population.known.mean(axis=1) if catalog.n_kcs else np.zeros(n_learners)
+    n_requests = len(recommend_latencies) + len(score_latencies)
+    return OrderedDict([
+        ('learners', n_learners),
+        ('concurrency', concurrency),
+        ('elapsed_s', elapsed),
+        ('requests', n_requests),
+        ('throughput_rps', n_requests / elapsed if elapsed else 0.0),
+        ('recommend_latency_ms', latency_summary(recommend_latencies)),
+        ('score_latency_ms', latency_summary(score_latencies)),
+        ('outcomes', OrderedDict([
+            ('attempts', len(scores)),
+            ('mean_score', float(np.mean(scores)) if scores else None),
+            ('completed', int(n_learners - active.sum())),
+            ('initial_knowledge', float(initial_knowledge.mean())),
+            ('final_knowledge', float(final_knowledge.mean())),
+            ('knowledge_gain', float((final_knowledge - initial_knowledge).mean())),
+            ('mastered', float(population.known.all(axis=1).mean()) if catalog.n_kcs else None),
+        ])),
+    ])
@@ -0,0 +1,248 @@
+"""
+Offline evaluation of engine settings on simulated learner populations, in parallel over a process pool
+The activity/KC arrays of a collection are read from the database once; each engine settings candidate is then
+evaluated without database access, by replaying the adaptive engine's recommendation rule (valid activities and
+recommendation_score_kernel, as in AdaptiveEngine.recommend) against a BKT learner population (bkt.LearnerPopulation).
+Worker processes are forked after the arrays are loaded, so that they share them read-only instead of receiving a copy
+per task. Every candidate is evaluated on the same population and random draws (same seed), so that differences between
+candidates are not due to sampling.
+"""
+import multiprocessing
+from collections import namedtuple, OrderedDict
+import numpy as np
+from alosi.engine import odds
+from ..models import Activity, Mastery, Score
+from ..engines import AdaptiveEngine, get_kcs_in_activity_set, recommendation_score_kernel
+from .bkt import LearnerPopulation
+from .driver import load_catalog
+
+
+# EngineSettings fields that can be swept
+SWEEP_FIELDS = ('W_p', 'W_r', 'W_c', 'W_d', 'L_star', 'r_star')
+
+# Collection arrays used in evaluation; guess/slip/difficulty/prereqs are the values passed to the engine's score
+# function, catalog holds the BKT parameters (probabilities) of the simulated responses
+SweepArrays = namedtuple('SweepArrays', [
+    'catalog',
+    # (# activities) x (# KCs) stored guess/slip values, NaN for untagged pairs
+    'guess',
+    'slip',
+    # (# activities) array of difficulty values
+    'difficulty',
+    # (# KCs) x (# KCs) prerequisite matrix
+    'prereqs',
+    # (activity indices, prerequisite activity indices) tuple of activity prerequisite relations
+    'activity_prereqs',
+])
+
+# arrays of the sweep being run, set before worker processes are forked
+_sweep_arrays = None
+
+
+def load_sweep_arrays(collection):
+    """
+    Read the arrays needed to evaluate engine settings on a collection
+    :param collection: Collection model instance
+    :return: SweepArrays
+    """
+    catalog, urls = load_catalog(collection)
+    activities = collection.activity_set.order_by('pk')
+    knowledge_components = get_kcs_in_activity_set(activities).order_by('pk')
+    parameters = AdaptiveEngine.get_tagging_parameters(activities, knowledge_components, fields=('guess', 'slip'))
+    activity_map = {pk: i for i, pk in enumerate(activities.values_list('pk', flat=True))}
+    activity_prereqs = [
+        (activity_map[from_pk], activity_map[to_pk]) for from_pk, to_pk in
+        Activity.prerequisite_activities.through.objects.filter(
+            from_activity__in=activities, to_activity__in=activities
+        ).values_list('from_activity_id', 'to_activity_id')
+    ]
+    return SweepArrays(
+        catalog=catalog,
+        guess=parameters['guess'],
+        slip=parameters['slip'],
+        difficulty=AdaptiveEngine.get_difficulty(activities),
+        prereqs=AdaptiveEngine.get_prereqs(knowledge_components),
+        activity_prereqs=tuple(np.array(column, dtype=int) for column in zip(*activity_prereqs))
+        if activity_prereqs else (np.array([], dtype=int), np.array([], dtype=int)),
+    )
+
+
+def load_replay_prior(collection, n_learners, default_prior=0.2):
+    """
+    Mastery of existing learners who have scores in a collection, to start simulated learners from
+    :param collection: Collection model instance
+    :param n_learners: int, maximum number of learners (lowest learner pks are used)
+    :param default_prior: float, mastery of KCs with neither stored mastery nor mastery_prior
+    :return: (# learners) x (# KCs) np.array of mastery probabilities, with KC priors where no mastery is stored
+    """
+    knowledge_components = get_kcs_in_activity_set(collection.activity_set).order_by('pk')
+    kc_map = {pk: i for i, pk in enumerate(knowledge_components.values_list('pk', flat=True))}
+    learner_pks = list(Score.objects.filter(activity__collections=collection).order_by('learner_id')
+                       .values_list('learner_id', flat=True).distinct()[:n_learners])
+    learner_map = {pk: i for i, pk in enumerate(learner_pks)}
+    kc_priors = np.array(knowledge_components.values_list('mastery_prior', flat=True), dtype=float)
+    prior = np.tile(np.where(np.isnan(kc_priors), default_prior, kc_priors), (len(learner_pks), 1))
+    for learner_pk, kc_pk, value in Mastery.objects.filter(
+            learner__in=learner_pks, knowledge_component__in=knowledge_components
+    ).values_list('learner_id', 'knowledge_component_id', 'value'):
+        prior[learner_map[learner_pk], kc_map[kc_pk]] = value
+    return prior
+
+
+def settings_values(engine_settings):
+    """
+    :param engine_settings: EngineSettings model instance
+    :return: OrderedDict of swept field values and stop_on_mastery
+    """
+    values = OrderedDict((field, getattr(engine_settings, field)) for field in SWEEP_FIELDS)
+    values['stop_on_mastery'] = engine_settings.stop_on_mastery
+    return values
+
+
+def valid_activity_mask(arrays, attempted, mastery, settings):
+    """
+    Activities that the engine can recommend to a learner (see AdaptiveEngine.get_valid_activities)
+    :param arrays: SweepArrays
+    :param attempted: (# activities) bool np.array, activities attempted by the learner
+    :param mastery: (# KCs) np.array, learner's tracked mastery probabilities
+    :param settings: dict of engine settings values
+    :return: (# activities) bool np.array
+    """
+    valid = ~attempted
+    if settings['stop_on_mastery'] and arrays.catalog.n_kcs:
+        unmastered = ~(np.log(odds(mastery)) >= settings['L_star'])
+        valid &= (~np.isnan(arrays.guess) & unmastered).any(axis=1)
+    activities, prerequisites = arrays.activity_prereqs
+    blocked = np.zeros(len(valid), dtype=bool)
+    blocked[activities[valid[prerequisites]]] = True
+    return valid & ~blocked
+
+
+def recommend(arrays, valid, mastery, last_activity, settings, rng):
+    """
+    Index of the activity the engine recommends (see AdaptiveEngine.recommend), ties broken randomly
+    :param arrays: SweepArrays
+    :param valid: (# activities) bool np.array, valid activities
+    :param mastery: (# KCs) np.array, learner's tracked mastery probabilities
+    :param last_activity: index of last attempted activity, or None
+    :param settings: dict of engine settings values
+    :param rng: np.random.RandomState
+    :return: activity index, or None if no activity is valid
+    """
+    candidates = np.flatnonzero(valid)
+    if not len(candidates):
+        return None
+    # score only KCs of valid activities, as the engine does
+    kcs = np.flatnonzero((~np.isnan(arrays.guess[candidates])).any(axis=0))
+    if len(candidates) == 1 or not len(kcs):
+        return candidates[rng.randint(len(candidates))]
+    scores = recommendation_score_kernel(
+        guess=arrays.guess[np.ix_(candidates, kcs)],
+        slip=arrays.slip[np.ix_(candidates, kcs)],
+        learner_mastery=mastery[kcs],
+        prereqs=arrays.prereqs[np.ix_(kcs, kcs)],
+        r_star=settings['r_star'],
+        L_star=settings['L_star'],
+        difficulty=arrays.difficulty[candidates],
+        W_p=settings['W_p'],
+        W_r=settings['W_r'],
+        W_d=settings['W_d'],
+        W_c=settings['W_c'],
+        last_attempted_guess=arrays.guess[last_activity, kcs] if last_activity is not None else None,
+        last_attempted_slip=arrays.slip[last_activity, kcs] if last_activity is not None else None,
+    )
+    best = np.flatnonzero(scores == scores.max())
+    return candidates[best[rng.randint(len(best))]]
+
+
+def evaluate_settings(arrays, settings, n_learners, n_steps, seed=0, prior=0.2):
+    """
+    Simulate a learner population served by the engine with given settings
+    :param arrays: SweepArrays
+    :param settings: dict of engine settings values (SWEEP_FIELDS and stop_on_mastery)
+    :param n_learners: int, number of learners (ignored if prior is an array)
+    :param n_steps: int, maximum number of activities served per learner
+    :param seed: int, random seed
+    :param prior: float, probability that a KC is initially known, or (# learners) x (# KCs) np.array
+    :return: OrderedDict of outcome metrics; gain is the number of KCs learned (latent knowledge), and a learner
+        reaches mastery when all collection KCs are known
+    """
+    catalog = arrays.catalog
+    if np.ndim(prior) == 2:
+        n_learners = len(prior)
+    rng = np.random.RandomState(seed)
+    population = LearnerPopulation(rng, catalog, n_learners, prior)
+    initial_known = population.known.sum(axis=1)
+    attempted = np.zeros((n_learners, len(catalog.kc_indptr) - 1), dtype=bool)
+    last_activities = [None] * n_learners
+    served = np.zeros(n_learners, dtype=int)
+    time_to_mastery = np.where(population.known.all(axis=1), 0, -1)
+    active = np.ones(n_learners, dtype=bool)
+
+    for step in range(n_steps):
+        mastery = population.mastery
+        learners, activities = [], []
+        for i in np.flatnonzero(active):
+            activity = recommend(arrays, valid_activity_mask(arrays, attempted[i], mastery[i], settings),
+                                 mastery[i], last_activities[i], settings, rng)
+            if activity is None:
+                active[i] = False
+            else:
+                learners.append(i)
+                activities.append(activity)
+        if not learners:
+            break
+        learners, activities = np.array(learners), np.array(activities)
+        population.attempt(learners, activities)
+        attempted[learners, activities] = True
+        for i, activity in zip(learners, activities):
+            last_activities[i] = activity
+        served[learners] += 1
+        mastered = population.known[learners].all(axis=1) & (time_to_mastery[learners] < 0)
+        time_to_mastery[learners[mastered]] = served[learners[mastered]]
+
+    gain = population.known.sum(axis=1) - initial_known
+    reached = time_to_mastery >= 0
+    return OrderedDict([
+        ('learners', n_learners),
+        ('items_served', int(served.sum())),
+        ('gain_per_item', float(gain.sum() / served.sum()) if served.sum() else 0.0),
+        ('mean_gain', float(gain.mean()) if n_learners else 0.0),
+        ('mastered', float(reached.mean()) if n_learners else 0.0),
+        ('mean_time_to_mastery', float(time_to_mastery[reached].mean()) if reached.any() else None),
+        ('median_time_to_mastery', float(np.median(time_to_mastery[reached])) if reached.any() else None),
+    ])
+
+
+def _evaluate(args):
+    settings, n_learners, n_steps, seed, prior = args
+    return evaluate_settings(_sweep_arrays, settings, n_learners, n_steps, seed, prior)
+
+
+def run_sweep(arrays, candidates, n_learners, n_steps, seed=0, prior=0.2, processes=None):
+    """
+    Evaluate engine settings candidates, in parallel
+    :param arrays: SweepArrays
+    :param candidates: list of dicts of engine settings values
+    :param n_learners: int, number of learners
+    :param n_steps: int, maximum number of activities served per learner
+    :param seed: int, random seed (the same for every candidate)
+    :param prior: float or (# learners) x (# KCs) np.array, see evaluate_settings
+    :param processes: int, number of worker processes; defaults to the number of CPUs, and candidates are evaluated
+        in the current process if 1
+    :return: list of OrderedDicts of settings values and outcome metrics, in candidate order
+    """
+    global _sweep_arrays
+    tasks = [(settings, n_learners, n_steps, seed, prior) for settings in candidates]
+    _sweep_arrays = arrays
+    try:
+        if processes == 1:
+            results = [_evaluate(task) for task in tasks]
+        else:
+            # workers are forked with the arrays in memory; numpy arrays are only read, so pages stay shared
+            with multiprocessing.get_context('fork').Pool(processes) as pool:
+                results = pool.map(_evaluate, tasks, chunksize=1)
+    finally:
+        _sweep_arrays = None
+    return [OrderedDict(list(settings.items()) + list(result.items()))
+            for settings, result in zip(candidates, results)]
@@ -0,0 +1,207 @@
+"""
+Load a synthetic catalog and simulated learner scores into the database
+Rows are inserted in chunks with PostgreSQL COPY when available, and with bulk_create() otherwise. Bulk inserts do not
+send model signals; process-local caches are cleared afterwards.
+"""
+import csv
+import datetime
+import io
+from collections import OrderedDict
+from itertools import islice
+import numpy as np
+from django.db import connection, transaction
+from django.utils import timezone
+from alosi.engine import odds
+from ..models import (Activity, ActivityKCParameter, Collection, KnowledgeComponent, Learner, Mastery,
+                      PrerequisiteRelation, Score)
+from ..caches import nonadaptive_sequence_cache, score_vector_cache
+from .bkt import LearnerPopulation, random_catalog
+
+
+# number of rows per COPY or bulk_create() call
+SYNTHETIC_CHUNK_SIZE = 10000
+# number of learners simulated per transaction
+LEARNER_CHUNK_SIZE = 1000
+
+
+class SyntheticDataError(ValueError):
+    """
+    Synthetic data cannot be generated with the given options
+    """
+    pass
+
+
+def copy_available():
+    """
+    :return: True if rows can be loaded with PostgreSQL COPY
+    """
+    return connection.vendor == 'postgresql'
+
+
+def _chunks(rows, chunk_size):
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def insert_rows(model, fields, rows, chunk_size=SYNTHETIC_CHUNK_SIZE):
+    """
+    Insert rows in chunks, with COPY if available, else bulk_create()
+    Note that auto_now_add fields (e.g. Score.timestamp) are set to insertion time by bulk_create().
+    :param model: model class
+    :param fields: list of field attribute names (e.g. 'learner_id' for foreign keys)
+    :param rows: iterable of tuples of field values
+    :param chunk_size: int, number of rows per query
+    :return: int, number of inserted rows
+    """
+    count = 0
+    columns = [model._meta.get_field(field).column for field in fields]
+    sql = 'COPY {} ({}) FROM STDIN WITH (FORMAT csv)'.format(
+        connection.ops.quote_name(model._meta.db_table),
+        ', '.join(connection.ops.quote_name(column) for column in columns)
+    )
+    for chunk in _chunks(rows, chunk_size):
+        if copy_available():
+            buffer = io.StringIO()
+            csv.writer(buffer).writerows(chunk)
+            buffer.seek(0)
+            with connection.cursor() as cursor:
+                cursor.copy_expert(sql, buffer)
+        else:
+            model.objects.bulk_create([model(**dict(zip(fields, row))) for row in chunk])
+        count += len(chunk)
+    return count
+
+
+def generate_synthetic_data(n_activities, n_kcs, kcs_per_activity, n_collections, prerequisite_density, n_learners,
+                            scores_per_learner, seed=0, prefix='synthetic', prior=0.2,
+                            chunk_size=SYNTHETIC_CHUNK_SIZE):
+    """
+    Generate a random catalog and simulated learners, and insert them into the database
+    Identifiers of created objects start with prefix (kc_id, collection_id, activity url and learner
+    tool_consumer_instance_guid), so that data sets with different prefixes can coexist.
+    :param n_activities: int, number of activities
+    :param n_kcs: int, number of KCs
+    :param kcs_per_activity: int, number of KCs tagged per activity
+    :param n_collections: int, number of collections
+    :param prerequisite_density: float, approximate fraction of KC pairs with a prerequisite relation
+    :param n_learners: int, number of learners
+    :param scores_per_learner: int, number of scores per learner
+    :param seed: int, random seed
+    :param prefix: str, identifier prefix
+    :param prior: float, KC mastery prior
+    :param chunk_size: int, number of rows per insert query
+    :return: OrderedDict of model name -> number of created rows
+    :raises: SyntheticDataError if data with the prefix already exists
+    """
+    if KnowledgeComponent.objects.filter(kc_id__startswith=prefix + '-').exists():
+        raise SyntheticDataError("Synthetic data with prefix '{}' already exists".format(prefix))
+    rng = np.random.RandomState(seed)
+    catalog = random_catalog(rng, n_activities, n_kcs, kcs_per_activity, n_collections, prerequisite_density)
+    counts = OrderedDict()
+
+    with transaction.atomic():
+        counts['collection'] = insert_rows(Collection, ['collection_id', 'name', 'max_problems'], (
+            ('{}-collection-{}'.format(prefix, i), 'Collection {}'.format(i), None) for i in range(n_collections)
+        ), chunk_size)
+        counts['knowledge_component'] = insert_rows(KnowledgeComponent, ['kc_id', 'name', 'mastery_prior'], (
+            ('{}-kc-{}'.format(prefix, i), 'KC {}'.format(i), prior) for i in range(n_kcs)
+        ), chunk_size)
+        # activities are ordered within their collection for the non-adaptive engine
+        order = np.zeros(n_activities, dtype=int)
+        for c in range(n_collections):
+            members = np.flatnonzero(catalog.activity_collections == c)
+            order[members] = np.arange(1, len(members) + 1)
+        counts['activity'] = insert_rows(
+            Activity,
+            ['url', 'name', 'difficulty', 'tags', 'type', 'include_adaptive', 'nonadaptive_order'],
+            (('https://{}.example.com/activity/{}'.format(prefix, i), 'Activity {}'.format(i),
+              float(catalog.difficulty[i]), '', '', True, int(order[i])) for i in range(n_activities)),
+            chunk_size
+        )
+
+        # pks of created objects, in index order
+        collection_pks = dict(Collection.objects.filter(collection_id__startswith=prefix + '-collection-')
+                              .values_list('collection_id', 'pk'))
+        collection_pks = [collection_pks['{}-collection-{}'.format(prefix, i)] for i in range(n_collections)]
+        kc_pks = dict(KnowledgeComponent.objects.filter(kc_id__startswith=prefix + '-kc-').values_list('kc_id', 'pk'))
+        kc_pks = [kc_pks['{}-kc-{}'.format(prefix, i)] for i in range(n_kcs)]
+        activity_pks = dict(Activity.objects.filter(url__startswith='https://{}.example.com/'.format(prefix))
+                            .values_list('url', 'pk'))
+        activity_pks = [activity_pks['https://{}.example.com/activity/{}'.format(prefix, i)]
+                        for i in range(n_activities)]
+
+        counts['activity_collection'] = insert_rows(
+            Activity.collections.through, ['activity_id', 'collection_id'],
+            ((activity_pks[i], collection_pks[c]) for i, c in enumerate(catalog.activity_collections)),
+            chunk_size
+        ) if n_collections else 0
+        tagged_activities = np.repeat(np.arange(n_activities), np.diff(catalog.kc_indptr))
+        counts['activity_kc'] = insert_rows(
+            Activity.knowledge_components.through, ['activity_id', 'knowledgecomponent_id'],
+            ((activity_pks[i], kc_pks[k]) for i, k in zip(tagged_activities, catalog.kc_indices)),
+            chunk_size
+        )
+        counts['activity_kc_parameter'] = insert_rows(
+            ActivityKCParameter, ['activity_id', 'knowledge_component_id', 'guess', 'slip', 'transit'],
+            ((activity_pks[i], kc_pks[k], float(odds(g)), float(odds(s)), float(odds(t)))
+             for i, k, g, s, t in zip(tagged_activities, catalog.kc_indices, catalog.guess, catalog.slip,
+                                      catalog.transit)),
+            chunk_size
+        )
+        counts['prerequisite_relation'] = insert_rows(
+            PrerequisiteRelation, ['prerequisite_id', 'knowledge_component_id', 'value'],
+            ((kc_pks[a], kc_pks[b], float(v)) for a, b, v in zip(*catalog.prerequisites)),
+            chunk_size
+        )
+
+    # learners are assigned to a random collection, and attempt random activities of the collection; activities
+    # grouped by collection, so that collection c has activities sorted_activities[starts[c]:starts[c] + sizes[c]]
+    sorted_activities = np.argsort(catalog.activity_collections, kind='mergesort')
+    sizes = np.bincount(catalog.activity_collections, minlength=n_collections)[:n_collections]
+    starts = np.cumsum(sizes) - sizes
+    learner_collections = rng.randint(max(n_collections, 1), size=n_learners)
+    # simulated timestamps, one second apart, ending now
+    start_time = timezone.now() - datetime.timedelta(seconds=n_learners * scores_per_learner)
+    for key in ('learner', 'score', 'mastery'):
+        counts[key] = 0
+    for chunk_start in range(0, n_learners, LEARNER_CHUNK_SIZE):
+        indices = np.arange(chunk_start, min(chunk_start + LEARNER_CHUNK_SIZE, n_learners))
+        with transaction.atomic():
+            counts['learner'] += insert_rows(Learner, ['user_id', 'tool_consumer_instance_guid'], (
+                ('{}-learner-{}'.format(prefix, i), prefix) for i in indices
+            ), chunk_size)
+            learner_pks = dict(Learner.objects.filter(
+                tool_consumer_instance_guid=prefix,
+                user_id__in=['{}-learner-{}'.format(prefix, i) for i in indices]
+            ).values_list('user_id', 'pk'))
+            learner_pks = [learner_pks['{}-learner-{}'.format(prefix, i)] for i in indices]
+
+            # simulate one attempt of every learner (with a non-empty collection) per step
+            population = LearnerPopulation(rng, catalog, len(indices), prior)
+            collections = learner_collections[indices] if n_collections else np.zeros(len(indices), dtype=int)
+            active = np.flatnonzero(sizes[collections] > 0) if n_collections else np.array([], dtype=int)
+            attempts = np.empty((len(active), scores_per_learner), dtype=int)
+            scores = np.empty((len(active), scores_per_learner))
+            for t in range(scores_per_learner):
+                offsets = (rng.rand(len(active)) * sizes[collections[active]]).astype(int)
+                attempts[:, t] = sorted_activities[starts[collections[active]] + offsets]
+                scores[:, t] = population.attempt(active, attempts[:, t])
+
+            counts['score'] += insert_rows(Score, ['learner_id', 'activity_id', 'score', 'timestamp'], (
+                (learner_pks[j], activity_pks[attempts[row, t]], float(scores[row, t]),
+                 start_time + datetime.timedelta(seconds=int(indices[j]) * scores_per_learner + t))
+                for row, j in enumerate(active) for t in range(scores_per_learner)
+            ), chunk_size)
+            mastery = population.mastery
+            counts['mastery'] += insert_rows(Mastery, ['learner_id', 'knowledge_component_id', 'value'], (
+                (learner_pks[j], kc_pks[k], float(mastery[j, k])) for j in range(len(indices)) for k in range(n_kcs)
+            ), chunk_size)
+
+    # bulk inserts do not send the model signals that clear process-local caches
+    score_vector_cache.clear_params()
+    nonadaptive_sequence_cache.clear_orders()
+    return counts
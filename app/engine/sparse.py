@@ -0,0 +1,344 @@
+"""
+Sparse (CSR) representations of activity x KC parameters, and recommendation score computation using them
+Numpy-only implementation; used by AdaptiveEngine for collections whose tagging matrix is sparse
+"""
+import numpy as np
+from alosi.engine import odds, fillna
+
+
+class CSRMatrix(object):
+    """
+    Minimal compressed sparse row matrix
+    """
+    def __init__(self, indptr, indices, data, shape):
+        """
+        :param indptr: np.array of size (n_rows+1,), row i has elements indptr[i]:indptr[i+1]
+        :param indices: np.array of size (nnz,), column index of elements
+        :param data: np.array of size (nnz,), element values
+        :param shape: (n_rows, n_cols) tuple
+        """
+        self.indptr = indptr
+        self.indices = indices
+        self.data = data
+        self.shape = tuple(shape)
+        self._row_indices = None
+        self._row_sums = None
+
+    @classmethod
+    def from_triples(cls, rows, cols, values, shape):
+        """
+        Construct matrix from (row, col, value) triples
+        If a (row, col) position appears more than once, the last value is used (as with dense assignment)
+        :param rows: list-like of row indices
+        :param cols: list-like of column indices
+        :param values: list-like of element values
+        :param shape: (n_rows, n_cols) tuple
+        :return: CSRMatrix
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        cols = np.asarray(cols, dtype=np.int64)
+        values = np.asarray(values, dtype=np.float64)
+        # row-major linear position; np.unique on reversed positions keeps last occurrence and sorts into CSR order
+        keys, idx = np.unique((rows * shape[1] + cols)[::-1], return_index=True)
+        rows = keys // shape[1]
+        indptr = np.zeros(shape[0] + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=shape[0]), out=indptr[1:])
+        return cls(indptr, keys % shape[1], values[::-1][idx], shape)
+
+    @property
+    def nnz(self):
+        return len(self.data)
+
+    @property
+    def density(self):
+        size = self.shape[0] * self.shape[1]
+        return self.nnz / size if size else 0.0
+
+    @property
+    def row_indices(self):
+        """
+        Row index of each stored element
+        :return: np.array of size (nnz,)
+        """
+        if self._row_indices is None:
+            self._row_indices = np.repeat(np.arange(self.shape[0]), np.diff(self.indptr))
+        return self._row_indices
+
+    @property
+    def row_sums(self):
+        """
+        Sum of stored elements in each row
+        :return: np.array of size (n_rows,)
+        """
+        if self._row_sums is None:
+            self._row_sums = np.bincount(self.row_indices, weights=self.data, minlength=self.shape[0])
+        return self._row_sums
+
+    def dot(self, x):
+        """
+        Matrix-vector product A.x
+        :param x: np.array of size (n_cols,)
+        :return: np.array of size (n_rows,)
+        """
+        return np.bincount(self.row_indices, weights=self.data * x[self.indices], minlength=self.shape[0])
+
+    def rdot(self, x):
+        """
+        Vector-matrix product x.A
+        :param x: np.array of size (n_rows,)
+        :return: np.array of size (n_cols,)
+        """
+        return np.bincount(self.indices, weights=self.data * x[self.row_indices], minlength=self.shape[1])
+
+    def transpose(self):
+        """
+        Transposed copy of matrix; gives row access to the columns of this matrix
+        :return: CSRMatrix of size (n_cols, n_rows)
+        """
+        return CSRMatrix.from_triples(self.indices, self.row_indices, self.data, (self.shape[1], self.shape[0]))
+
+    def select_rows(self, rows):
+        """
+        Stored elements of a subset of rows
+        :param rows: np.array of row indices
+        :return: (positions, indices, data) tuple of np.arrays of size (nnz in rows,), where positions is the
+            position in rows of the row the element belongs to
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        starts = self.indptr[rows]
+        lengths = self.indptr[rows + 1] - starts
+        offsets = np.cumsum(lengths) - lengths
+        elements = np.arange(lengths.sum()) + np.repeat(starts - offsets, lengths)
+        return np.repeat(np.arange(len(rows)), lengths), self.indices[elements], self.data[elements]
+
+    def getrow(self, i):
+        """
+        Dense copy of a single row
+        :param i: row index
+        :return: np.array of size (n_cols,)
+        """
+        row = np.zeros(self.shape[1])
+        row[self.indices[self.indptr[i]:self.indptr[i+1]]] = self.data[self.indptr[i]:self.indptr[i+1]]
+        return row
+
+    def toarray(self, fill_value=0.0):
+        """
+        Dense copy of matrix
+        :param fill_value: value for elements not stored
+        :return: np.array of size shape
+        """
+        output = np.full(self.shape, fill_value)
+        output[self.row_indices, self.indices] = self.data
+        return output
+
+
+def sparse_relevance(shape, tagging, guess, slip, guess_default, slip_default):
+    """
+    Compute sparse relevance matrix from sparse tagging and guess/slip parameters
+    Guess/slip for an activity-kc pair is the stored parameter value if one exists, else the default value if the
+    activity is tagged with the kc; relevance is 0.0 where either parameter is missing
+    :param shape: (# activities, # KCs) tuple
+    :param tagging: (rows, cols) tuple of index arrays for tagged activity-kc pairs
+    :param guess: (rows, cols, values) tuple of guess parameters
+    :param slip: (rows, cols, values) tuple of slip parameters
+    :param guess_default: default guess value for tagged pairs without guess parameter
+    :param slip_default: default slip value for tagged pairs without slip parameter
+    :return: CSRMatrix of relevance values
+    """
+    n_cols = shape[1]
+    tagging_keys = np.asarray(tagging[0], dtype=np.int64) * n_cols + np.asarray(tagging[1], dtype=np.int64)
+    guess_keys = np.asarray(guess[0], dtype=np.int64) * n_cols + np.asarray(guess[1], dtype=np.int64)
+    slip_keys = np.asarray(slip[0], dtype=np.int64) * n_cols + np.asarray(slip[1], dtype=np.int64)
+    # union of positions with any tagging or parameter information
+    keys = np.unique(np.concatenate([tagging_keys, guess_keys, slip_keys]))
+
+    def parameter_values(parameter_keys, parameter_values, default):
+        values = np.full(len(keys), np.nan)
+        values[np.searchsorted(keys, tagging_keys)] = default
+        values[np.searchsorted(keys, parameter_keys)] = parameter_values
+        return values
+
+    guess_values = parameter_values(guess_keys, guess[2], guess_default)
+    slip_values = parameter_values(slip_keys, slip[2], slip_default)
+    relevance = fillna(-np.log(odds(guess_values)) - np.log(odds(slip_values)), 0.0)
+
+    nonzero = relevance != 0.0
+    return CSRMatrix.from_triples(keys[nonzero] // n_cols, keys[nonzero] % n_cols, relevance[nonzero], shape)
+
+
+def sparse_recommendation_score(*, relevance, learner_mastery, prereqs, r_star, L_star, difficulty, W_p, W_r, W_d,
+                                W_c, last_attempted_relevance=None):
+    """
+    Computes recommendation scores for activities, using sparse relevance and prerequisite matrices
+    Equivalent to alosi.engine.recommendation_score, given the relevance computed from the same guess/slip values
+    :param relevance: QxK CSRMatrix of relevance values
+    :param learner_mastery: 1xK vector of learner mastery (probability) values
+    :param prereqs: KxK CSRMatrix of prerequisite values
+    :param r_star: Threshold for forgiving lower odds of mastering pre-requisite LOs.
+    :param L_star: Threshold logarithmic odds. If mastery logarithmic odds are >= than L_star, the LO is considered mastered
+    :param difficulty: 1xQ vector of difficulty values
+    :param W_p: (float), weight on substrategy P
+    :param W_r: (float), weight on substrategy R
+    :param W_d: (float), weight on substrategy D
+    :param W_c: (float), weight on substrategy C
+    :param last_attempted_relevance: 1xK vector of relevance values for last attempted activity, or None
+    :return: np.array of size (Q,) of activity recommendation score values
+    """
+    L = np.log(odds(learner_mastery))
+    difficulty = np.log(odds(fillna(np.array(difficulty, dtype=np.float64), value=0.5)))
+
+    # P: readiness
+    m_r = prereqs.rdot(np.minimum(L - L_star, 0))
+    P = relevance.dot(np.minimum(m_r + r_star, 0))
+    # R: demand
+    R = relevance.dot(np.maximum(L_star - L, 0))
+    # C: continuity
+    if last_attempted_relevance is None:
+        C = np.zeros(relevance.shape[0])
+    else:
+        C = np.sqrt(relevance.dot(last_attempted_relevance))
+    # D: appropriate difficulty
+    rows = relevance.row_indices
+    D = -np.bincount(
+        rows,
+        weights=relevance.data * np.abs(L[relevance.indices] - difficulty[rows]),
+        minlength=relevance.shape[0]
+    )
+
+    # weights are paired with subscores in the same order as alosi.engine.recommendation_score
+    return W_p * P + W_r * R + W_d * C + W_c * D
+
+
+# number of candidate activities with highest score bounds scored first in pruned_recommendation()
+PRUNING_BATCH_SIZE = 256
+
+
+# number of grid points at which the score envelope is evaluated in score_envelope()
+ENVELOPE_GRID_SIZE = 1024
+
+
+def score_envelope(L, coefficients, W_c, difficulty, grid_size=ENVELOPE_GRID_SIZE):
+    """
+    Upper bound of h(d) = max_k (coefficients[k] - W_c * |L[k] - d|), for each difficulty value d
+    h is evaluated exactly on a grid over the range of difficulty values; since h changes by at most |W_c| per unit
+    of d, h(d) <= min(h(g) + |W_c| * |d - g|) over the neighbouring grid points g
+    :param L: 1xK vector of learner mastery log odds
+    :param coefficients: 1xK vector of per-kc score coefficients
+    :param W_c: float, weight on distance between mastery and difficulty
+    :param difficulty: 1xQ vector of difficulty log odds
+    :param grid_size: int, number of grid points
+    :return: 1xQ vector
+    """
+    c = abs(W_c)
+    d_min, d_max = difficulty.min(), difficulty.max()
+    grid = np.linspace(d_min, d_max, grid_size)
+    # h on grid points; for W_c < 0 the max of a_k + c|L_k - d| is attained at one of the two linear pieces
+    if W_c < 0:
+        h = np.maximum(np.max(coefficients + c * L) - c * grid, np.max(coefficients - c * L) + c * grid)
+    else:
+        # kcs with L_k <= d contribute (a_k + c L_k) - c d, kcs with L_k >= d contribute (a_k - c L_k) + c d
+        order = np.argsort(L)
+        below = np.maximum.accumulate((coefficients + c * L)[order])
+        above = np.maximum.accumulate((coefficients - c * L)[order][::-1])[::-1]
+        n_below = np.searchsorted(L[order], grid, side='right')
+        n_above = np.searchsorted(L[order], grid, side='left')
+        h = np.maximum(
+            np.where(n_below > 0, below[np.maximum(n_below - 1, 0)] - c * grid, -np.inf),
+            np.where(n_above < len(L), above[np.minimum(n_above, len(L) - 1)] + c * grid, -np.inf),
+        )
+    if d_max == d_min:
+        return np.full(len(difficulty), h[0])
+    step = grid[1] - grid[0]
+    lower = np.minimum(((difficulty - d_min) / step).astype(np.int64), grid_size - 2)
+    offset = difficulty - grid[lower]
+    return np.minimum(h[lower] + c * offset, h[lower + 1] + c * np.abs(grid[lower + 1] - difficulty))
+
+
+def pruned_recommendation(*, relevance, learner_mastery, prereqs, r_star, L_star, difficulty, W_p, W_r, W_d, W_c,
+                          last_attempted_relevance=None, candidates=None, kc_mask=None, relevance_columns=None,
+                          epsilon=0.0, batch_size=PRUNING_BATCH_SIZE):
+    """
+    Find the activities with highest recommendation score without scoring every candidate activity
+    The score of an activity is sum_k relevance[q,k] * g_k(difficulty[q]) plus the continuity term, where g_k combines
+    the readiness, demand and difficulty terms of kc k. The continuity term is computed exactly (it is nonzero only for
+    activities sharing kcs with the last attempted activity), and the rest is bounded by the relevance row sum times
+    the maximum of g_k over the learner's kcs. The candidates with highest bounds are scored first; of the remaining
+    candidates, only those whose bound exceeds the best score found by more than epsilon are scored.
+    With epsilon=0 the result is exact; otherwise the best score returned is within epsilon of the maximum score.
+    The bounds require non-negative relevance values (guess and slip below 0.5); if any relevance value is negative,
+    all candidates are scored.
+    :param relevance: QxK CSRMatrix of relevance values
+    :param learner_mastery: 1xK vector of learner mastery (probability) values
+    :param prereqs: KxK CSRMatrix of prerequisite values
+    :param r_star: Threshold for forgiving lower odds of mastering pre-requisite LOs.
+    :param L_star: Threshold logarithmic odds. If mastery logarithmic odds are >= than L_star, the LO is considered mastered
+    :param difficulty: 1xQ vector of difficulty values
+    :param W_p: (float), weight on substrategy P
+    :param W_r: (float), weight on substrategy R
+    :param W_d: (float), weight on substrategy D
+    :param W_c: (float), weight on substrategy C
+    :param last_attempted_relevance: 1xK vector of relevance values for last attempted activity, or None
+    :param candidates: np.array of row indices of activities that can be recommended; defaults to all rows
+    :param kc_mask: 1xK boolean vector of KCs of candidate activities, limits prerequisite contributions to
+        substrategy P to these KCs; defaults to all KCs
+    :param relevance_columns: transpose of relevance (CSRMatrix), if available
+    :param epsilon: float >= 0, allowed difference between best score returned and maximum score
+    :param batch_size: int, number of candidates with highest bounds scored before pruning
+    :return: (indices, score, n_scored) tuple: row indices of scored candidates with the best score found, best score,
+        and number of candidates scored
+    """
+    n_activities, n_kcs = relevance.shape
+    if candidates is None:
+        candidates = np.arange(n_activities)
+    candidates = np.asarray(candidates, dtype=np.int64)
+    if kc_mask is None:
+        kc_mask = np.ones(n_kcs, dtype=bool)
+    if not len(candidates):
+        return np.array([], dtype=np.int64), None, 0
+    if relevance_columns is None:
+        relevance_columns = relevance.transpose()
+
+    L = np.log(odds(learner_mastery))
+    difficulty = np.log(odds(fillna(np.array(difficulty, dtype=np.float64), value=0.5)))
+    m_r = prereqs.rdot(np.where(kc_mask, np.minimum(L - L_star, 0), 0.0))
+    # weights are paired with subscores in the same order as alosi.engine.recommendation_score,
+    # i.e. W_d is applied to C and W_c to D
+    coefficients = W_p * np.minimum(m_r + r_star, 0) + W_r * np.maximum(L_star - L, 0)
+
+    # continuity term for all activities, from relevance columns of kcs of last attempted activity
+    continuity = np.zeros(n_activities)
+    if last_attempted_relevance is not None:
+        kcs = np.flatnonzero(last_attempted_relevance)
+        positions, activities, values = relevance_columns.select_rows(kcs)
+        continuity = W_d * np.sqrt(np.bincount(
+            activities, weights=values * last_attempted_relevance[kcs][positions], minlength=n_activities))
+
+    def score(rows):
+        positions, kcs, values = relevance.select_rows(rows)
+        g = coefficients[kcs] - W_c * np.abs(L[kcs] - difficulty[rows][positions])
+        return np.bincount(positions, weights=values * g, minlength=len(rows)) + continuity[rows]
+
+    if np.any(relevance.data < 0):
+        # bounds do not hold; score all candidates
+        scores = score(candidates)
+        best_score = scores.max()
+        return candidates[scores == best_score], best_score, len(candidates)
+
+    # only kcs of candidates contribute to candidate scores
+    kcs = kc_mask if kc_mask.any() else slice(None)
+    envelope = score_envelope(L[kcs], coefficients[kcs], W_c, difficulty[candidates])
+    bounds = relevance.row_sums[candidates] * envelope + continuity[candidates]
+
+    # score candidates with highest bounds, then remaining candidates that could beat the best score found
+    if len(candidates) > batch_size:
+        first = np.argpartition(-bounds, batch_size)[:batch_size]
+    else:
+        first = np.arange(len(candidates))
+    scores = score(candidates[first])
+    remaining = np.ones(len(candidates), dtype=bool)
+    remaining[first] = False
+    rest = np.flatnonzero(remaining & (bounds > scores.max() + epsilon))
+    scored = np.concatenate([first, rest])
+    scores = np.concatenate([scores, score(candidates[rest])])
+    best_score = scores.max()
+    return candidates[scored[scores == best_score]], best_score, len(scored)
@@ -1,5 +1,6 @@
 from .models import *
 from .data_structures import Matrix, Vector
+from .registry import engine_registry
 import numpy as np
 
 
@@ -8,10 +9,14 @@ epsilon = 1e-10 # a regularization cutoff, the smallest value of a mastery proba
 
 def pick_experimental_group():
     """
-    Randomly pick an experimental group
-    Currently weights all groups equally
+    Randomly pick an experimental group, with probability proportional to group weights
+    (all groups weighted equally if weights are zero)
+    :return: ExperimentalGroup model instance, or None if no experimental groups exist
     """
-    return np.random.choice(ExperimentalGroup.objects.all())
+    experimental_group_id = engine_registry.pick_experimental_group_id()
+    if experimental_group_id is None:
+        return None
+    return ExperimentalGroup.objects.get(pk=experimental_group_id)
 
 
 def is_adaptive(learner):
@@ -55,9 +60,10 @@ def get_activities(learner, collection=None, seen=False):
 
 def get_engine_settings_for_learner(learner):
     """
-    Given learner, get the right engine instance for them (for A/B testing)
+    Given learner, get the engine settings of their experimental group (for A/B testing)
+    :return: EngineSettings model instance, or None if learner's group is non-adaptive
     """
-    return EngineSettings.objects.get(pk=1)
+    return engine_registry.get_engine_settings(learner.experimental_group_id)
 
 
 def x0_mult(guess, slip):
@@ -0,0 +1,15 @@
+import pytest
+from engine.caches import activity_url_index, learner_cache, score_vector_cache, nonadaptive_sequence_cache
+from engine.registry import engine_registry
+
+
+@pytest.fixture(autouse=True)
+def clear_caches():
+    """
+    Reset process-local engine caches, since the test database is reset between tests
+    """
+    activity_url_index.clear()
+    learner_cache.clear()
+    score_vector_cache.clear()
+    nonadaptive_sequence_cache.clear()
+    engine_registry.clear()
@@ -1,6 +1,15 @@
+import csv
+import io
+import json
 import logging
+from time import sleep
+import numpy as np
 import pytest
-from engine.models import Collection, KnowledgeComponent, Mastery, Learner, Activity
+from engine.models import (Collection, KnowledgeComponent, Mastery, Learner, Activity, Score, Guess, Slip,
+                           ParameterVersion)
+import engine.serializers
+from engine.bulk import bulk_update
+from engine.serializers import BulkMasterySerializer
 from .fixtures import engine_api, sequence_test_collection
 
 log = logging.getLogger(__name__)
@@ -89,6 +98,98 @@ def test_recommend(engine_api, test_collection):
     assert r.ok
 
 
+def test_recommend_top_n(engine_api, sequence_test_collection):
+    """
+    Recommend with top_n returns ranked recommendations, starting with the recommended activity
+    :param engine_api: alosi.EngineApi instance
+    :param sequence_test_collection: Collection model instance
+    """
+    r = engine_api.request('POST', 'activity/recommend', json=dict(
+        learner=dict(
+            user_id='my_user_id',
+            tool_consumer_instance_guid='default'
+        ),
+        collection=sequence_test_collection.collection_id,
+        sequence=[],
+        top_n=3,
+    ))
+    assert r.ok
+    recommendations = r.json()['recommendations']
+    assert len(recommendations) == 3
+    assert recommendations[0]['source_launch_url'] == r.json()['source_launch_url']
+    scores = [item['score'] for item in recommendations]
+    assert scores == sorted(scores, reverse=True)
+
+
+def test_collection_activity_sync(engine_api, test_collection):
+    """
+    Syncing collection activities creates new activities, updates changed fields, adds existing activities from
+    other collections and removes activities missing from request data from the collection
+    :param engine_api: alosi.EngineApi instance
+    :param test_collection: Collection model instance
+    """
+    kept = Activity.objects.create(url='http://example.com/kept', name='kept')
+    removed = Activity.objects.create(url='http://example.com/removed', name='removed')
+    test_collection.activity_set.add(kept, removed)
+    other = Activity.objects.create(url='http://example.com/other', name='other')
+    data = [
+        dict(source_launch_url=kept.url, name='renamed', difficulty=0.3, tags=None),
+        dict(source_launch_url=other.url, name='other', difficulty=None, tags=''),
+        dict(source_launch_url='http://example.com/new', name='new', difficulty=0.5, tags='a'),
+    ]
+    r = engine_api.request('POST', 'collection/{}/activities'.format(test_collection.collection_id), json=data)
+    assert r.ok
+    assert [item['source_launch_url'] for item in r.json()] == [item['source_launch_url'] for item in data]
+    assert r.json()[0] == dict(source_launch_url=kept.url, name='renamed', difficulty=0.3, tags='')
+    assert set(test_collection.activity_set.values_list('url', flat=True)) == {item['source_launch_url'] for item in data}
+    assert Activity.objects.get(pk=kept.pk).name == 'renamed'
+    assert Activity.objects.filter(pk=removed.pk).exists()
+    assert Activity.objects.filter(url='http://example.com/new').count() == 1
+
+
+def test_activity_tagging(engine_api, sequence_test_collection):
+    """
+    Tagging is replaced in bulk for requested activities (and collection activities if specified), bumping
+    ParameterVersion, and returned as a sparse matrix
+    :param engine_api: alosi.EngineApi instance
+    :param sequence_test_collection: Collection model instance
+    """
+    activities = list(sequence_test_collection.activity_set.order_by('pk'))
+    kc0, kc1 = KnowledgeComponent.objects.order_by('pk')
+    other = Activity.objects.create(url='http://example.com/other')
+    other.knowledge_components.add(kc0)
+    r = engine_api.request('PUT', 'activity/tagging', json={
+        'pairs': [[activities[0].url, kc0.kc_id], [activities[0].url, kc1.kc_id], [activities[1].url, kc1.kc_id]],
+        'collection': sequence_test_collection.collection_id,
+    })
+    assert r.ok
+    assert set(activities[0].knowledge_components.all()) == {kc0, kc1}
+    assert list(activities[1].knowledge_components.all()) == [kc1]
+    assert not any(activity.knowledge_components.exists() for activity in activities[2:])
+    assert list(other.knowledge_components.all()) == [kc0]
+
+    sleep(0.1)
+    r = engine_api.request('GET', 'activity/tagging?collection={}'.format(sequence_test_collection.collection_id))
+    assert r.ok
+    matrix = r.json()
+    assert matrix['activity_urls'] == [activity.url for activity in activities]
+    assert list(zip(matrix['rows'], matrix['cols'])) == [(0, 0), (0, 1), (1, 1)]
+
+    # replace tagging of one activity from matrix form; unchanged pairs are not rewritten
+    sleep(0.1)
+    matrix = {'activity_urls': [activities[0].url], 'kc_ids': [kc0.kc_id], 'rows': [0], 'cols': [0]}
+    version = ParameterVersion.current()
+    r = engine_api.request('PUT', 'activity/tagging', json={'matrix': matrix})
+    assert r.json() == {'created': 0, 'deleted': 1}
+    assert ParameterVersion.current() == version + 1
+    assert list(activities[0].knowledge_components.all()) == [kc0]
+    assert list(activities[1].knowledge_components.all()) == [kc1]
+
+    sleep(0.1)
+    r = engine_api.request('PUT', 'activity/tagging', json={'pairs': [[activities[0].url, 'unknown']]})
+    assert r.status_code == 400
+
+
 def test_create_knowledge_component(engine_api, test_collection):
     """
     Creates KC via api
@@ -156,6 +257,66 @@ def test_bulk_update_mastery(engine_api, knowledge_component):
     assert mastery.value == NEW_VALUE
 
 
+def test_bulk_update_mastery_many(engine_api, knowledge_component):
+    """
+    Bulk mastery update creates and updates values for many learners, using last value for repeated items,
+    and rejects requests referencing unknown knowledge components without writing anything
+    :param engine_api: engine api fixture
+    :param knowledge_component: KnowledgeComponent model instance
+    """
+    learner = Learner.objects.create(user_id='user_0', tool_consumer_instance_guid='default')
+    Mastery.objects.create(learner=learner, knowledge_component=knowledge_component, value=0.1)
+    data = [
+        {
+            'learner': {'user_id': 'user_{}'.format(i), 'tool_consumer_instance_guid': 'default'},
+            'knowledge_component': {'kc_id': knowledge_component.kc_id},
+            'value': i / 10
+        }
+        for i in range(5)
+    ]
+    data.append(dict(data[1], value=0.9))
+    r = engine_api.bulk_update_mastery(data)
+    assert r.ok
+    assert [item['value'] for item in r.json()] == [0.0, 0.9, 0.2, 0.3, 0.4, 0.9]
+    values = Mastery.objects.order_by('learner__user_id').values_list('learner__user_id', 'value')
+    assert list(values) == [('user_0', 0.0), ('user_1', 0.9), ('user_2', 0.2), ('user_3', 0.3), ('user_4', 0.4)]
+
+    sleep(0.1)
+    r = engine_api.bulk_update_mastery([dict(data[0], value=0.5), dict(data[0], knowledge_component={'kc_id': 'x'})])
+    assert r.status_code == 400
+    assert r.json()[0] == {}
+    assert 'kc_id' in r.json()[1]['knowledge_component']
+    assert Mastery.objects.get(learner=learner).value == 0.0
+
+
+@pytest.mark.django_db
+def test_bulk_update_mastery_conflict(monkeypatch, knowledge_component):
+    """
+    Mastery objects created by another request between fetching and inserting mastery objects are updated
+    :param knowledge_component: KnowledgeComponent model instance
+    """
+    learner = Learner.objects.create(user_id='user_0', tool_consumer_instance_guid='default')
+
+    def bulk_update_before_concurrent_create(objs, fields):
+        Mastery.objects.create(learner=learner, knowledge_component=knowledge_component, value=0.1)
+        return bulk_update(objs, fields)
+
+    monkeypatch.setattr(engine.serializers, 'bulk_update', bulk_update_before_concurrent_create)
+    serializer = BulkMasterySerializer(many=True, data=[
+        {
+            'learner': {'user_id': 'user_{}'.format(i), 'tool_consumer_instance_guid': 'default'},
+            'knowledge_component': {'kc_id': knowledge_component.kc_id},
+            'value': 0.5
+        }
+        for i in range(2)
+    ])
+    assert serializer.is_valid()
+    masteries = serializer.save()
+    assert all(mastery.pk for mastery in masteries)
+    values = Mastery.objects.order_by('learner__user_id').values_list('learner__user_id', 'value')
+    assert list(values) == [('user_0', 0.5), ('user_1', 0.5)]
+
+
 @pytest.mark.django_db
 def test_api_create_prerequisite_activity(engine_api, activities):
     """
@@ -215,3 +376,161 @@ def test_api_grade(engine_api, sequence_test_collection):
     }
     r = engine_api.request('POST', f'collection/{sequence_test_collection.collection_id}/grade', json=data)
     assert r.ok
+
+
+def test_api_grades(engine_api, sequence_test_collection):
+    """
+    Batched grades are returned in request order, and for learners with scores if no learners are specified
+    :param engine_api: engine api fixture
+    :param sequence_test_collection: Collection model instance
+    """
+    learner = Learner.objects.create(user_id='user_id', tool_consumer_instance_guid='default')
+    kc = sequence_test_collection.activity_set.first().knowledge_components.first()
+    Mastery.objects.create(learner=learner, knowledge_component=kc, value=0.55)
+    learners = [
+        {'user_id': 'unknown_user_id', 'tool_consumer_instance_guid': 'default'},
+        {'user_id': 'user_id', 'tool_consumer_instance_guid': 'default'},
+    ]
+    url = f'collection/{sequence_test_collection.collection_id}/grades'
+    r = engine_api.request('POST', url, json={'learners': learners})
+    assert r.ok
+    assert [item['learner'] for item in r.json()['grades']] == learners
+    assert [item['grade'] for item in r.json()['grades']] == pytest.approx([0.0, 0.25])
+    assert not Learner.objects.filter(user_id='unknown_user_id').exists()
+
+    sleep(0.1)
+    Score.objects.create(learner=learner, activity=sequence_test_collection.activity_set.first(), score=1.0)
+    r = engine_api.request('POST', url, json={})
+    assert r.ok
+    assert r.json()['grades'] == [{'learner': learners[1], 'grade': pytest.approx(0.25)}]
+
+
+def test_mastery_matrix(engine_api, sequence_test_collection):
+    """
+    Mastery matrix is aligned to requested learners and KC ids, with priors for missing values,
+    in JSON, .npy and (if msgpack is installed) MessagePack formats
+    :param engine_api: engine api fixture
+    :param sequence_test_collection: Collection model instance
+    """
+    learner = Learner.objects.create(user_id='user_id', tool_consumer_instance_guid='default')
+    kc0, kc1 = KnowledgeComponent.objects.order_by('kc_id')
+    Mastery.objects.create(learner=learner, knowledge_component=kc1, value=0.55)
+    data = {
+        'learners': [
+            {'user_id': 'user_id', 'tool_consumer_instance_guid': 'default'},
+            {'user_id': 'unknown_user_id', 'tool_consumer_instance_guid': 'default'},
+        ],
+        'kc_ids': [kc1.kc_id, kc0.kc_id],
+    }
+    expected = [[0.55, kc0.mastery_prior], [kc1.mastery_prior, kc0.mastery_prior]]
+
+    r = engine_api.request('POST', 'mastery/matrix', json=data)
+    assert r.ok
+    assert r.json()['kc_ids'] == data['kc_ids']
+    assert r.json()['learners'] == data['learners']
+    np.testing.assert_allclose(r.json()['mastery'], expected)
+
+    sleep(0.1)
+    r = engine_api.request('POST', 'mastery/matrix', json=data, headers={'Accept': 'application/x-npy'})
+    assert r.ok
+    np.testing.assert_allclose(np.load(io.BytesIO(r.content)), expected)
+
+    sleep(0.1)
+    r = engine_api.request('POST', 'mastery/matrix?format=npy', json={'learners': data['learners'], 'kc_ids': ['x']})
+    assert r.status_code == 400
+    assert 'kc_ids' in r.json()
+
+    msgpack = pytest.importorskip('msgpack')
+    sleep(0.1)
+    r = engine_api.request('POST', 'mastery/matrix?format=msgpack', json={'learners': data['learners'][:1]})
+    assert r.ok
+    content = msgpack.unpackb(r.content, raw=False)
+    assert content['kc_ids'] == [kc0.kc_id, kc1.kc_id]
+    np.testing.assert_allclose(content['mastery'], [[kc0.mastery_prior, 0.55]])
+
+
+def test_score_cursor_pagination_and_export(engine_api, sequence_test_collection):
+    """
+    Score list supports keyset pagination with a cursor parameter (limit/offset otherwise),
+    and scores can be exported as NDJSON or CSV
+    :param engine_api: engine api fixture
+    :param sequence_test_collection: Collection model instance
+    """
+    learner = Learner.objects.create(user_id='user_id', tool_consumer_instance_guid='default')
+    activities = list(sequence_test_collection.activity_set.order_by('pk'))
+    scores = [Score.objects.create(learner=learner, activity=activity, score=0.5) for activity in activities[:5]]
+
+    r = engine_api.request('GET', 'score?limit=2&offset=2')
+    assert r.ok
+    assert r.json()['count'] == 5
+
+    sleep(0.1)
+    results = []
+    r = engine_api.request('GET', 'score?cursor=&page_size=2')
+    while True:
+        assert r.ok
+        assert 'count' not in r.json()
+        results.extend(r.json()['results'])
+        if not r.json()['next']:
+            break
+        sleep(0.1)
+        r = engine_api.client.get(r.json()['next'])
+    assert [item['activity'] for item in results] == [activity.url for activity in activities[:5]]
+
+    sleep(0.1)
+    r = engine_api.request('GET', 'score/export')
+    assert r.ok
+    assert r.headers['Content-Type'] == 'application/x-ndjson'
+    rows = [json.loads(line) for line in r.text.splitlines()]
+    assert [row['id'] for row in rows] == [score.pk for score in scores]
+    assert rows[0]['user_id'] == 'user_id'
+
+    sleep(0.1)
+    r = engine_api.request('GET', 'score/export?format=csv')
+    assert r.ok
+    rows = list(csv.DictReader(io.StringIO(r.text)))
+    assert [row['activity'] for row in rows] == [activity.url for activity in activities[:5]]
+
+
+def test_parameter_import_export(engine_api, sequence_test_collection):
+    """
+    Parameter values are imported from CSV triples and dense .npz files, and exported as .npz or CSV
+    :param engine_api: engine api fixture
+    :param sequence_test_collection: Collection model instance
+    """
+    activities = list(sequence_test_collection.activity_set.order_by('pk'))[:2]
+    kc0, kc1 = KnowledgeComponent.objects.order_by('pk')
+    Guess.objects.create(activity=activities[0], knowledge_component=kc0, value=0.1)
+    version = ParameterVersion.current()
+    content = 'activity_url,kc_id,value\n{},{},0.3\n{},{},0.4\n'.format(
+        activities[0].url, kc0.kc_id, activities[1].url, kc1.kc_id)
+    r = engine_api.request('PUT', 'parameter/guess', files={'file': ('guess.csv', content)})
+    assert r.ok
+    assert r.json() == {'created': 1, 'updated': 1, 'parameter_version': version + 1}
+
+    sleep(0.1)
+    r = engine_api.request('GET', 'parameter/guess')
+    assert r.ok
+    data = np.load(io.BytesIO(r.content))
+    assert list(data['activity_urls']) == [activity.url for activity in activities]
+    assert list(data['kc_ids']) == [kc0.kc_id, kc1.kc_id]
+    np.testing.assert_allclose(data['values'], [[0.3, np.nan], [np.nan, 0.4]])
+
+    sleep(0.1)
+    buffer = io.BytesIO()
+    np.savez(buffer, values=data['values'] * 2, activity_urls=data['activity_urls'], kc_ids=data['kc_ids'])
+    r = engine_api.request('PUT', 'parameter/slip', files={'file': ('slip.npz', buffer.getvalue())})
+    assert r.ok
+    assert r.json()['created'] == 2
+
+    sleep(0.1)
+    r = engine_api.request('GET', 'parameter/slip?format=csv')
+    assert r.ok
+    rows = list(csv.DictReader(io.StringIO(r.text)))
+    assert [(row['activity_url'], row['kc_id'], float(row['value'])) for row in rows] == [
+        (activities[0].url, kc0.kc_id, 0.6), (activities[1].url, kc1.kc_id, 0.8)]
+
+    sleep(0.1)
+    r = engine_api.request('PUT', 'parameter/slip', files={'file': ('slip.csv', 'activity_url,kc_id,value\nx,y,0.1\n')})
+    assert r.status_code == 400
+    assert Slip.objects.count() == 2
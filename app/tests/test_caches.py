@@ -0,0 +1,149 @@
+import pytest
+from engine.models import Activity, Collection, Learner, ParameterVersion
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from engine.caches import ActivityUrlIndex, LearnerCache, NonAdaptiveSequenceCache, ScoreVectorCache
+
+
+@pytest.mark.django_db
+def test_activity_url_index_resolve():
+    """
+    Activity urls resolve through index, and stale entries (e.g. from writes in another process) are repaired
+    """
+    index = ActivityUrlIndex()
+    activity = Activity.objects.create(url='http://example.com/1', name='activity 1')
+    assert index.resolve('http://example.com/1') == activity
+    assert index.get('http://example.com/1') == activity.pk
+
+    # change url without triggering signals
+    Activity.objects.filter(pk=activity.pk).update(url='http://example.com/2')
+    with pytest.raises(Activity.DoesNotExist):
+        index.resolve('http://example.com/1')
+    assert index.get('http://example.com/1') is None
+    assert index.resolve('http://example.com/2') == activity
+    with CaptureQueriesContext(connection) as queries:
+        assert index.resolve('http://example.com/2') == activity
+    assert len(queries) == 1
+
+    # lowest pk wins if multiple activities share a url
+    Activity.objects.create(url='http://example.com/2')
+    index.clear()
+    assert index.resolve('http://example.com/2') == activity
+
+
+@pytest.mark.django_db
+def test_activity_url_index_resolve_many():
+    """
+    Bulk resolution returns activities for known urls and omits unknown urls, without a query for indexed urls if
+    deferred
+    """
+    index = ActivityUrlIndex()
+    activities = [Activity.objects.create(url='http://example.com/{}'.format(i)) for i in range(3)]
+    index.set(activities[0].url, activities[0].pk)
+    resolved = index.resolve_many([a.url for a in activities] + ['http://example.com/unknown'])
+    assert resolved == {a.url: a for a in activities}
+    assert all(index.get(a.url) == a.pk for a in activities)
+
+    # indexed urls resolve to deferred instances without a query
+    with CaptureQueriesContext(connection) as queries:
+        resolved = index.resolve_many([a.url for a in activities], deferred=True)
+    assert len(queries) == 0
+    assert resolved == {a.url: a for a in activities}
+    assert resolved[activities[0].url].url == activities[0].url
+
+
+@pytest.mark.django_db
+def test_learner_cache_get_or_create():
+    """
+    Learner is created on first sight, and returned from cache afterwards without a query
+    """
+    cache = LearnerCache(maxsize=1)
+    learner, created = cache.get_or_create('user_id', 'guid')
+    assert created
+    with CaptureQueriesContext(connection) as queries:
+        cached_learner, created = cache.get_or_create('user_id', 'guid')
+    assert not created
+    assert len(queries) == 0
+    assert cached_learner == learner
+
+    # least recently used identity is evicted
+    cache.get_or_create('user_id_2', 'guid')
+    assert cache.get('user_id', 'guid') is None
+    learner_again, created = cache.get_or_create('user_id', 'guid')
+    assert not created
+    assert learner_again == learner
+
+
+@pytest.mark.django_db
+def test_learner_cache_get_many():
+    """
+    Existing learners are fetched in batches and added to cache, without creating unknown learners; other combinations
+    of requested user ids and guids are not returned
+    """
+    for user_id, guid in [('a', 'x'), ('b', 'y'), ('a', 'y'), ('c', 'x')]:
+        Learner.objects.create(user_id=user_id, tool_consumer_instance_guid=guid)
+    cache = LearnerCache()
+    identities = [('a', 'x'), ('b', 'y'), ('c', 'x'), ('unknown', 'x')]
+    learners = cache.get_many(identities, batch_size=2)
+    assert set(learners) == {('a', 'x'), ('b', 'y'), ('c', 'x')}
+    assert all((learner.user_id, learner.tool_consumer_instance_guid) == identity
+               for identity, learner in learners.items())
+    assert not Learner.objects.filter(user_id='unknown').exists()
+    with CaptureQueriesContext(connection) as queries:
+        assert cache.get_many(identities[:3]) == learners
+    assert len(queries) == 0
+
+
+@pytest.mark.django_db
+def test_learner_cache_get_or_create_many_conflict(monkeypatch):
+    """
+    Learners created by another request between fetching and inserting missing learners are fetched instead
+    """
+    cache = LearnerCache()
+    fetch_many = cache._fetch_many
+    calls = []
+
+    def fetch_many_before_concurrent_create(identities, batch_size):
+        # first fetch misses the learner that another request creates right after it
+        calls.append(identities)
+        if len(calls) == 1:
+            Learner.objects.create(user_id='user_id', tool_consumer_instance_guid='guid')
+            return {}
+        return fetch_many(identities, batch_size)
+
+    monkeypatch.setattr(cache, '_fetch_many', fetch_many_before_concurrent_create)
+    learners = cache.get_or_create_many([('user_id', 'guid'), ('user_id_2', 'guid')])
+    assert set(learners) == {('user_id', 'guid'), ('user_id_2', 'guid')}
+    assert Learner.objects.count() == 2
+
+
+@pytest.mark.django_db
+def test_score_vector_cache_parameter_version():
+    """
+    Cached score parameters are discarded when parameter version changes, e.g. after an import in another process
+    """
+    cache = ScoreVectorCache(version_check_interval=0)
+    params = object()
+    cache.set_params(1, params)
+    assert cache.get_params(1) is params
+    ParameterVersion.bump()
+    assert cache.get_params(1) is None
+
+
+@pytest.mark.django_db
+def test_nonadaptive_sequence_cache_ttl():
+    """
+    Non-adaptive sequences are reloaded after ttl seconds, e.g. after activities are modified in another process
+    """
+    collection = Collection.objects.create(collection_id='collection', name='collection')
+    first, second = [Activity.objects.create(url='http://example.com/{}'.format(i)) for i in range(2)]
+    collection.activity_set.add(first, second)
+    Activity.objects.filter(pk=first.pk).update(nonadaptive_order=1)
+    cache = NonAdaptiveSequenceCache()
+    assert list(cache.get_order(collection.pk)) == [first.pk]
+    # update() does not send save signals
+    Activity.objects.filter(pk=second.pk).update(nonadaptive_order=0)
+    assert list(cache.get_order(collection.pk)) == [first.pk]
+    # expire loaded sequences
+    cache.ttl = -1
+    assert list(cache.get_order(collection.pk)) == [second.pk, first.pk]
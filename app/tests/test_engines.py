@@ -0,0 +1,369 @@
+import numpy as np
+import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from alosi.engine import recommendation_score
+from engine.engines import (AdaptiveEngine, NonAdaptiveEngine, get_engine, recommendation_score_kernel, GUESS_DEFAULT,
+                            SLIP_DEFAULT, TRANSIT_DEFAULT)
+from engine.models import ActivityKCParameter, Activity, Guess, KnowledgeComponent, Learner, Mastery, Score, Slip, Transit
+from engine.sparse import CSRMatrix, sparse_relevance, sparse_recommendation_score, pruned_recommendation
+from engine.incremental import CollectionScoreParams, LearnerScoreVector
+from .fixtures import sequence_test_collection
+
+
+def random_recommend_params(n_activities, n_kcs, density=0.1, seed=0):
+    """
+    Generate random dense recommendation parameters (as input to alosi.engine.recommendation_score),
+    with guess/slip values missing for untagged activity-kc pairs
+    :return: (params dict, tagging mask)
+    """
+    rng = np.random.RandomState(seed)
+    tagging = rng.rand(n_activities, n_kcs) < density
+    guess = np.where(tagging, rng.uniform(0.05, 0.3, (n_activities, n_kcs)), np.nan)
+    slip = np.where(tagging, rng.uniform(0.05, 0.3, (n_activities, n_kcs)), np.nan)
+    prereqs = np.where(rng.rand(n_kcs, n_kcs) < density, rng.rand(n_kcs, n_kcs), np.nan)
+    difficulty = rng.rand(n_activities)
+    difficulty[::7] = np.nan
+    params = dict(
+        guess=guess,
+        slip=slip,
+        learner_mastery=rng.rand(n_kcs),
+        prereqs=prereqs,
+        r_star=0.0,
+        L_star=2.2,
+        difficulty=difficulty,
+        W_p=5.0,
+        W_r=3.0,
+        W_d=1.0,
+        W_c=0.5,
+        last_attempted_guess=guess[0],
+        last_attempted_slip=slip[0],
+    )
+    return params, tagging
+
+
+def to_sparse_params(params, tagging):
+    """
+    Convert dense recommendation parameters to sparse_recommendation_score input
+    """
+    shape = tagging.shape
+    rows, cols = np.nonzero(tagging)
+    relevance = sparse_relevance(
+        shape,
+        (rows, cols),
+        (rows, cols, params['guess'][rows, cols]),
+        (rows, cols, params['slip'][rows, cols]),
+        GUESS_DEFAULT,
+        SLIP_DEFAULT
+    )
+    prereq_rows, prereq_cols = np.nonzero(~np.isnan(params['prereqs']))
+    prereqs = CSRMatrix.from_triples(
+        prereq_rows, prereq_cols, params['prereqs'][prereq_rows, prereq_cols], params['prereqs'].shape
+    )
+    sparse_params = {k: v for k, v in params.items() if k not in ('guess', 'slip', 'last_attempted_guess',
+                                                                  'last_attempted_slip', 'prereqs')}
+    sparse_params.update(relevance=relevance, prereqs=prereqs, last_attempted_relevance=relevance.getrow(0))
+    return sparse_params
+
+
+def test_csr_matrix():
+    """
+    CSRMatrix products match dense products; repeated positions keep last value
+    """
+    rng = np.random.RandomState(0)
+    dense = np.where(rng.rand(20, 30) < 0.2, rng.rand(20, 30), 0.0)
+    rows, cols = np.nonzero(dense)
+    matrix = CSRMatrix.from_triples(rows, cols, dense[rows, cols], dense.shape)
+    assert np.array_equal(matrix.toarray(), dense)
+    x, y = rng.rand(30), rng.rand(20)
+    assert np.allclose(matrix.dot(x), dense.dot(x))
+    assert np.allclose(matrix.rdot(y), y.dot(dense))
+    assert np.array_equal(matrix.getrow(5), dense[5])
+    assert np.array_equal(matrix.transpose().toarray(), dense.T)
+    positions, indices, data = matrix.select_rows([3, 5])
+    selected = np.zeros((2, 30))
+    selected[positions, indices] = data
+    assert np.array_equal(selected, dense[[3, 5]])
+
+    duplicates = CSRMatrix.from_triples([1, 0, 1], [2, 0, 2], [1.0, 2.0, 3.0], (2, 3))
+    assert duplicates.nnz == 2
+    assert np.array_equal(duplicates.toarray(), np.array([[2.0, 0, 0], [0, 0, 3.0]]))
+
+
+@pytest.mark.parametrize('n_activities,n_kcs', [(50, 20), (200, 80)])
+def test_sparse_recommendation_score(n_activities, n_kcs):
+    """
+    Sparse recommendation score matches alosi.engine.recommendation_score on dense inputs
+    """
+    params, tagging = random_recommend_params(n_activities, n_kcs)
+    sparse_params = to_sparse_params(params, tagging)
+    expected = recommendation_score(**{k: np.copy(v) if isinstance(v, np.ndarray) else v for k, v in params.items()})
+    assert np.allclose(sparse_recommendation_score(**sparse_params), expected)
+
+
+@pytest.mark.django_db
+def test_engine_sparse_matches_dense(sequence_test_collection):
+    """
+    AdaptiveEngine gives the same recommendation scores with sparse and dense parameter representations
+    """
+    collection = sequence_test_collection
+    learner = Learner.objects.create(user_id='user_id', tool_consumer_instance_guid='default')
+    activities = list(collection.activity_set.order_by('pk'))
+    kc = activities[0].knowledge_components.first()
+    Guess.objects.create(activity=activities[0], knowledge_component=kc, value=0.2)
+    Mastery.objects.create(learner=learner, knowledge_component=kc, value=0.6)
+    Score.objects.create(learner=learner, activity=activities[1], score=1.0)
+
+    engine_settings = get_engine().engine_settings
+    dense_scores = AdaptiveEngine(engine_settings, sparse_density_threshold=0.0, incremental_scores=False
+                                  ).recommendation_score(learner, collection)
+    sparse_scores = AdaptiveEngine(engine_settings, sparse_density_threshold=1.1, incremental_scores=False
+                                   ).recommendation_score(learner, collection)
+    assert dense_scores.keys() == sparse_scores.keys()
+    for activity, score in dense_scores.items():
+        assert sparse_scores[activity] == pytest.approx(score)
+
+
+@pytest.mark.django_db
+def test_activity_kc_parameters(sequence_test_collection):
+    """
+    Guess/Slip/Transit compatibility models read and write columns of a single ActivityKCParameter row per pair,
+    and the engine reads all parameters of a set of activities with one parameter query
+    """
+    activities = Activity.objects.filter(collections=sequence_test_collection).order_by('pk')
+    activity = activities[0]
+    kc = activity.knowledge_components.first()
+    Guess.objects.create(activity=activity, knowledge_component=kc, value=0.2)
+    Transit.objects.create(activity=activity, knowledge_component=kc, value=0.3)
+    Guess.objects.create(activity=activity, knowledge_component=kc, value=0.25)
+    assert list(ActivityKCParameter.objects.values_list('guess', 'slip', 'transit')) == [(0.25, None, 0.3)]
+    assert Guess.objects.get().value == 0.25
+    assert not Slip.objects.exists()
+
+    engine = AdaptiveEngine(get_engine().engine_settings)
+    knowledge_components = KnowledgeComponent.objects.filter(pk=kc.pk)
+    with CaptureQueriesContext(connection) as context:
+        parameters = engine.get_tagging_parameters(activities, knowledge_components)
+    assert sum('engine_activitykcparameter' in query['sql'] for query in context.captured_queries) == 1
+    assert parameters['guess'][0, 0] == 0.25
+    assert parameters['slip'][0, 0] == SLIP_DEFAULT
+    assert parameters['transit'][0, 0] == 0.3
+    np.testing.assert_array_equal(parameters['guess'], engine.get_guess(activities, knowledge_components))
+
+    Guess.objects.get().delete()
+    assert list(ActivityKCParameter.objects.values_list('guess', 'slip', 'transit')) == [(None, None, 0.3)]
+    Transit.objects.all().delete()
+    assert not Transit.objects.exists()
+    assert engine.get_transit(activities, knowledge_components)[0, 0] == TRANSIT_DEFAULT
+
+
+@pytest.mark.django_db
+def test_grade(sequence_test_collection):
+    """
+    Grade is average over collection KCs of mastery gain relative to prior, as fraction of gain needed for mastery
+    """
+    collection = sequence_test_collection
+    learner = Learner.objects.create(user_id='user_id', tool_consumer_instance_guid='default')
+    engine = get_engine()
+    assert engine.grade(learner, collection) == 0.0
+    kc = collection.activity_set.first().knowledge_components.first()
+    Mastery.objects.create(learner=learner, knowledge_component=kc, value=0.55)
+    # one of two kcs is halfway from prior (0.2) to mastery threshold (0.9)
+    assert engine.grade(learner, collection) == pytest.approx(0.25)
+    # batched grades match single-learner grades; unknown learners are graded as new learners
+    other_learner = Learner.objects.create(user_id='other_user_id', tool_consumer_instance_guid='default')
+    np.testing.assert_allclose(engine.grade_many([learner.pk, other_learner.pk, None], collection), [0.25, 0.0, 0.0])
+
+
+@pytest.mark.parametrize('n_activities,n_kcs', [(1, 1), (50, 20), (200, 80)])
+@pytest.mark.parametrize('with_last_attempted', [True, False])
+def test_recommendation_score_kernel(n_activities, n_kcs, with_last_attempted):
+    """
+    Fused scoring kernel matches alosi.engine.recommendation_score
+    """
+    params, tagging = random_recommend_params(n_activities, n_kcs, density=0.3)
+    if not with_last_attempted:
+        params.update(last_attempted_guess=None, last_attempted_slip=None)
+    expected = recommendation_score(**{k: np.copy(v) if isinstance(v, np.ndarray) else v for k, v in params.items()})
+    assert np.allclose(recommendation_score_kernel(**params, use_numba=False), expected)
+    # float32 inputs
+    params32 = {k: v.astype(np.float32) if isinstance(v, np.ndarray) else v for k, v in params.items()}
+    scores32 = recommendation_score_kernel(**params32, use_numba=False)
+    assert scores32.dtype == np.float32
+    assert np.allclose(scores32, expected, rtol=1e-3, atol=1e-3)
+
+
+def test_recommendation_score_kernel_numba():
+    """
+    Numba kernel matches alosi.engine.recommendation_score
+    """
+    pytest.importorskip('numba')
+    params, tagging = random_recommend_params(100, 30, density=0.3)
+    expected = recommendation_score(**{k: np.copy(v) if isinstance(v, np.ndarray) else v for k, v in params.items()})
+    assert np.allclose(recommendation_score_kernel(**params, use_numba=True), expected)
+
+
+def test_learner_score_vector():
+    """
+    Incrementally updated score vector matches sparse recommendation score computed from scratch
+    """
+    params, tagging = random_recommend_params(200, 40, density=0.1)
+    sparse_params = to_sparse_params(params, tagging)
+    n_activities, n_kcs = tagging.shape
+    score_params = CollectionScoreParams(
+        activity_pks=range(n_activities),
+        kc_pks=range(n_kcs),
+        relevance=sparse_params['relevance'],
+        prereqs=sparse_params['prereqs'],
+        difficulty=params['difficulty'],
+        mastery_prior=np.full(n_kcs, 0.1),
+    )
+    weights = {k: sparse_params[k] for k in ('W_p', 'W_r', 'W_d', 'W_c')}
+    kc_mask = np.ones(n_kcs, dtype=bool)
+    vector = LearnerScoreVector(score_params, sparse_params['learner_mastery'], kc_mask,
+                                sparse_params['last_attempted_relevance'], sparse_params['r_star'],
+                                sparse_params['L_star'])
+    assert np.allclose(vector.scores(**weights), sparse_recommendation_score(**sparse_params))
+
+    rng = np.random.RandomState(1)
+    for i in range(5):
+        # change mastery of a few kcs, drop some kcs from valid set, change last attempted activity
+        learner_mastery = np.copy(sparse_params['learner_mastery'])
+        learner_mastery[rng.choice(n_kcs, 3)] = rng.rand(3)
+        kc_mask[rng.choice(n_kcs, 2)] = False
+        last_attempted_relevance = sparse_params['relevance'].getrow(i + 1)
+        vector.update(learner_mastery, kc_mask, last_attempted_relevance)
+
+        # prerequisite contributions only come from valid kcs
+        prereqs = sparse_params['prereqs'].toarray()
+        prereqs[~kc_mask] = 0.0
+        rows, cols = np.nonzero(prereqs)
+        sparse_params.update(
+            learner_mastery=learner_mastery,
+            last_attempted_relevance=last_attempted_relevance,
+            prereqs=CSRMatrix.from_triples(rows, cols, prereqs[rows, cols], prereqs.shape),
+        )
+        assert np.allclose(vector.scores(**weights), sparse_recommendation_score(**sparse_params))
+
+
+@pytest.mark.django_db
+def test_engine_incremental_scores(sequence_test_collection):
+    """
+    AdaptiveEngine gives the same recommendation scores with and without incremental score vectors,
+    as learner mastery changes from scores
+    """
+    collection = sequence_test_collection
+    learner = Learner.objects.create(user_id='user_id', tool_consumer_instance_guid='default')
+    engine_settings = get_engine().engine_settings
+    engine = AdaptiveEngine(engine_settings, incremental_scores=True)
+    reference_engine = AdaptiveEngine(engine_settings)
+    for i in range(3):
+        scores = engine.recommendation_score(learner, collection)
+        expected = reference_engine.recommendation_score(learner, collection)
+        assert scores.keys() == expected.keys()
+        for activity, score in expected.items():
+            assert scores[activity] == pytest.approx(score)
+        activity = max(scores, key=scores.get)
+        Score.objects.create(learner=learner, activity=activity, score=0.5)
+        engine.update_from_score(learner, activity, 0.5)
+
+
+@pytest.mark.parametrize('epsilon', [0.0, 1.0])
+def test_pruned_recommendation(epsilon):
+    """
+    Pruned recommendation finds the top scoring activities (exactly, or within epsilon)
+    """
+    params, tagging = random_recommend_params(500, 40, density=0.05)
+    sparse_params = to_sparse_params(params, tagging)
+    scores = sparse_recommendation_score(**sparse_params)
+    candidates = np.arange(1, 500, 2)
+    indices, score, n_scored = pruned_recommendation(**sparse_params, candidates=candidates, epsilon=epsilon)
+    assert set(indices) <= set(candidates)
+    assert np.allclose(scores[indices], score)
+    assert score >= scores[candidates].max() - epsilon - 1e-9
+    if epsilon == 0.0:
+        assert set(indices) == set(candidates[np.isclose(scores[candidates], scores[candidates].max())])
+    assert n_scored <= len(candidates)
+
+
+def test_pruned_recommendation_negative_relevance():
+    """
+    Pruned recommendation scores all candidates if relevance values are negative (guess and slip above 0.5)
+    """
+    params, tagging = random_recommend_params(100, 10, density=0.2)
+    params['guess'][:10] = params['slip'][:10] = 10.0
+    sparse_params = to_sparse_params(params, tagging)
+    assert np.any(sparse_params['relevance'].data < 0)
+    scores = sparse_recommendation_score(**sparse_params)
+    indices, score, n_scored = pruned_recommendation(**sparse_params)
+    assert score == pytest.approx(scores.max())
+    assert n_scored == 100
+
+
+@pytest.mark.django_db
+def test_engine_pruned_recommend(sequence_test_collection):
+    """
+    AdaptiveEngine with pruning_epsilon=0 recommends a top scoring activity, the last valid activity, or nothing
+    once all activities are in the sequence; pruning can not be combined with a custom score function
+    """
+    collection = sequence_test_collection
+    learner = Learner.objects.create(user_id='user_id', tool_consumer_instance_guid='default')
+    engine_settings = get_engine().engine_settings
+    scores = AdaptiveEngine(engine_settings).recommendation_score(learner, collection)
+    engine = AdaptiveEngine(engine_settings, pruning_epsilon=0.0)
+    activity = engine.recommend(learner, collection)
+    assert scores[activity] == pytest.approx(max(scores.values()))
+
+    activities = list(collection.activity_set.order_by('pk'))
+    assert engine.recommend(learner, collection, activities[:-1]) == activities[-1]
+    assert engine.recommend(learner, collection, activities) is None
+    with pytest.raises(ValueError):
+        AdaptiveEngine(engine_settings, recommendation_score_function=recommendation_score, pruning_epsilon=0.0)
+
+
+@pytest.mark.django_db
+def test_stop_on_mastery(sequence_test_collection):
+    """
+    With stop_on_mastery, activities tagged only with mastered KCs are not recommended,
+    and there is nothing to recommend once all collection KCs are mastered
+    """
+    collection = sequence_test_collection
+    learner = Learner.objects.create(user_id='user_id', tool_consumer_instance_guid='default')
+    engine_settings = get_engine().engine_settings
+    engine_settings.stop_on_mastery = True
+    engine = AdaptiveEngine(engine_settings)
+    kc0, kc1 = KnowledgeComponent.objects.order_by('pk')
+    assert len(engine.recommendation_score(learner, collection)) == 10
+
+    Mastery.objects.create(learner=learner, knowledge_component=kc0, value=0.95)
+    scores = engine.recommendation_score(learner, collection)
+    assert scores
+    assert all(activity.knowledge_components.filter(pk=kc1.pk).exists() for activity in scores)
+
+    Mastery.objects.create(learner=learner, knowledge_component=kc1, value=0.95)
+    assert engine.recommend(learner, collection) is None
+
+
+def test_nonadaptive_recommend(sequence_test_collection):
+    """
+    Non-adaptive engine serves activities with nonadaptive_order populated, in that order, skipping seen activities,
+    with a single query per recommendation once the collection sequence is loaded
+    """
+    collection = sequence_test_collection
+    learner = Learner.objects.create(user_id='user_id', tool_consumer_instance_guid='default')
+    activities = list(collection.activity_set.order_by('-pk'))[:4]
+    for i, activity in enumerate(activities):
+        activity.nonadaptive_order = i
+        activity.save()
+    engine = NonAdaptiveEngine()
+
+    assert engine.recommend(learner, collection, []) == activities[0]
+    # out-of-order history
+    assert engine.recommend(learner, collection, [activities[1]]) == activities[0]
+    with CaptureQueriesContext(connection) as queries:
+        assert engine.recommend(learner, collection, [activities[1], activities[0]]) == activities[2]
+    assert len(queries) == 1
+    assert engine.recommend_top_n(learner, collection, 3, activities[:2]) == [(activities[2], None), (activities[3], None)]
+    assert engine.recommend(learner, collection, activities) is None
+    # shorter (new) history resets learner's cursor
+    assert engine.recommend(learner, collection, []) == activities[0]
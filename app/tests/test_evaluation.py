@@ -0,0 +1,65 @@
+import numpy as np
+import pytest
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from engine.evaluation import PredictionMetrics, binned_auc, evaluate_predictions, predict_correctness
+from engine.models import Slip
+
+
+def test_prediction_metrics():
+    """
+    Binned AUC matches the pairwise definition, and chance baselines are computed from training scores
+    """
+    rng = np.random.RandomState(0)
+    predictions = rng.rand(500)
+    targets = (rng.rand(500) < predictions).astype(float)
+    pairs = predictions[targets == 1][:, None] - predictions[targets == 0][None, :]
+    exact_auc = np.mean((pairs > 0) + 0.5 * (pairs == 0))
+    assert binned_auc(*[np.bincount((predictions * 100).astype(int)[targets == label], minlength=100)
+                        for label in (1, 0)]) == pytest.approx(exact_auc, abs=0.01)
+
+    metrics = PredictionMetrics(n_activities=2)
+    metrics.add_training(np.array([0, 0, 1, 1]), np.array([1.0, 1.0, 0.0, 1.0]))
+    metrics.add(np.array([0, 1, 1]), np.array([1.0, 0.0, 1.0]), np.array([0.9, 0.2, 0.6]))
+    result = metrics.result()
+    assert result['evaluated'] == 3
+    assert result['model']['accuracy'] == 1.0
+    assert result['model']['auc'] == 1.0
+    assert result['model']['log_loss'] == pytest.approx(-np.mean(np.log([0.9, 0.8, 0.6])))
+    # overall chance 0.75, per-activity chance 1.0 (clipped) and 0.5
+    assert result['overall_chance']['log_loss'] == pytest.approx(-np.mean(np.log([0.75, 0.25, 0.75])))
+    assert result['overall_chance']['accuracy'] == pytest.approx(2 / 3)
+    assert result['activity_chance']['auc'] == pytest.approx(0.75)
+
+    # single KC: odds of correct answer (L(1-s) + g) / (L s + 1 - g), with guess/slip as odds
+    p = predict_correctness(np.array([1.0]), np.array([0.25]), np.array([0.25]), np.array([0]), 1)
+    assert p[0] == pytest.approx(0.5)
+
+
+@pytest.mark.django_db
+def test_evaluate_predictions(tmpdir):
+    """
+    Stored parameters predict simulated scores better than chance, and candidate parameters are rejected by
+    evaluate_predictions if they predict worse than stored parameters
+    """
+    call_command('generate_synthetic_data', activities=60, kcs=10, kcs_per_activity=1, collections=2,
+                 prerequisite_density=0.0, learners=200, scores_per_learner=20, seed=4)
+    result = evaluate_predictions(holdout_fraction=0.5, learner_chunk_size=30)
+    assert result['evaluated'] + result['training'] == 4000
+    assert 0 < result['evaluated'] < 4000
+    assert result['model']['log_loss'] < result['overall_chance']['log_loss']
+    assert result['model']['auc'] > 0.5
+    # replay does not depend on chunking
+    rechunked = evaluate_predictions(holdout_fraction=0.5, chunk_size=7, learner_chunk_size=1000)
+    assert rechunked['evaluated'] == result['evaluated']
+    for name in ('log_loss', 'auc', 'accuracy'):
+        assert rechunked['model'][name] == pytest.approx(result['model'][name])
+
+    path = tmpdir.join('slip.csv')
+    path.write('activity_url,kc_id,value\n' + ''.join(
+        '{},{},{}\n'.format(slip.activity.url, slip.knowledge_component.kc_id, 8 * slip.value)
+        for slip in Slip.objects.select_related('activity', 'knowledge_component')
+    ))
+    call_command('evaluate_predictions', holdout_fraction=0.5, max_log_loss=1.0)
+    with pytest.raises(CommandError):
+        call_command('evaluate_predictions', holdout_fraction=0.5, slip=str(path))
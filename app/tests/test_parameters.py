@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+from django.core.management import call_command
+from engine.models import (Activity, ActivityKCParameter, Guess, KnowledgeComponent, ParameterVersion, Slip,
+                           Transit)
+from engine.parameters import export_dense
+from .fixtures import sequence_test_collection
+
+
+@pytest.mark.parametrize('extension', ['npz', 'npy', 'csv'])
+def test_parameter_commands_roundtrip(sequence_test_collection, tmpdir, extension):
+    """
+    Parameters exported with export_parameters are restored by import_parameters, and the import bumps
+    the parameter version
+    """
+    activities = list(sequence_test_collection.activity_set.order_by('pk'))
+    kc0, kc1 = KnowledgeComponent.objects.order_by('pk')
+    for i, activity in enumerate(activities):
+        Transit.objects.create(activity=activity, knowledge_component=kc0 if i % 2 else kc1, value=i / 100)
+    expected = export_dense(Transit)
+    path = str(tmpdir.join('transit.{}'.format(extension)))
+    call_command('export_parameters', 'transit', path)
+
+    Transit.objects.all().delete()
+    version = ParameterVersion.current()
+    options = {}
+    if extension == 'npy':
+        options = {'activity_urls': path + '.activity_urls.txt', 'kc_ids': path + '.kc_ids.txt'}
+    call_command('import_parameters', 'transit', path, **options)
+    values, activity_urls, kc_ids = export_dense(Transit)
+    np.testing.assert_array_equal(values, expected[0])
+    assert (activity_urls, kc_ids) == expected[1:]
+    assert ParameterVersion.current() == version + 1
+
+
+@pytest.mark.django_db
+def test_parameter_column_models():
+    """
+    Guess/Slip/Transit instances are saved to the shared ActivityKCParameter row of their activity-kc pair,
+    and 'value' can be updated and cleared through querysets
+    """
+    activity = Activity.objects.create(url='http://example.com/activity')
+    kc = KnowledgeComponent.objects.create(kc_id='kc', name='kc', mastery_prior=0.5)
+    slip = Slip.objects.create(activity=activity, knowledge_component=kc, value=0.2)
+    guess = Guess(activity=activity, knowledge_component=kc, value=0.1)
+    guess.save()
+    assert guess.pk == slip.pk
+    assert ActivityKCParameter.objects.values_list('guess', 'slip', 'transit').get() == (0.1, 0.2, None)
+
+    guess.value = 0.4
+    guess.save()
+    assert Guess.objects.update(value=0.3) == 1
+    assert Guess.objects.get().value == 0.3
+    assert Slip.objects.get().value == 0.2
+    Guess.objects.all().delete()
+    assert not Guess.objects.exists()
+    assert ActivityKCParameter.objects.values_list('guess', 'slip').get() == (None, 0.2)
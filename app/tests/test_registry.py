@@ -0,0 +1,76 @@
+import numpy as np
+import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from engine.engines import AdaptiveEngine, NonAdaptiveEngine
+from engine.models import EngineSettings, ExperimentalGroup, Learner
+from engine.registry import EngineRegistry, alias_draw, build_alias_table
+
+
+def test_alias_table():
+    """
+    Alias table draws indices in proportion to weights; zero weights are never drawn
+    """
+    probability, alias = build_alias_table([1.0, 0.0, 3.0])
+    rng = np.random.RandomState(0)
+    counts = np.bincount([alias_draw(probability, alias, rng) for i in range(20000)], minlength=3)
+    assert counts[1] == 0
+    assert counts[2] / counts[0] == pytest.approx(3.0, rel=0.1)
+    # all-zero weights are drawn uniformly
+    probability, alias = build_alias_table([0.0, 0.0])
+    assert np.allclose(probability, 1.0)
+
+
+@pytest.mark.django_db
+def test_engine_registry():
+    """
+    Registry routes learners to engines of their experimental group, loads settings once, and reloads on change
+    """
+    registry = EngineRegistry()
+    settings = EngineSettings.objects.create(name='adaptive', r_star=0.0, L_star=2.2, W_p=5.0, W_r=3.0, W_c=1.0,
+                                             W_d=1.0)
+    adaptive_group = ExperimentalGroup.objects.create(name='adaptive', weight=1.0, engine_settings=settings)
+    ExperimentalGroup.objects.create(name='non-adaptive', weight=0.0)
+
+    learner = Learner.objects.create(user_id='user_id', tool_consumer_instance_guid='default')
+    engine = registry.get_engine_for_learner(learner)
+    # only group with nonzero weight is assigned
+    assert Learner.objects.get(pk=learner.pk).experimental_group == adaptive_group
+    assert isinstance(engine, AdaptiveEngine)
+    assert engine.engine_settings.W_p == 5.0
+    with CaptureQueriesContext(connection) as queries:
+        assert registry.get_engine_for_learner(learner) is engine
+    assert len(queries) == 0
+
+    assert isinstance(registry.get_engine(None), AdaptiveEngine)
+    assert engine.pruning_epsilon is None
+    settings.W_p = 1.0
+    settings.pruning_epsilon = 0.1
+    settings.save()
+    registry.clear()
+    engine = registry.get_engine_for_learner(learner)
+    assert engine.engine_settings.W_p == 1.0
+    assert engine.pruning_epsilon == 0.1
+
+    adaptive_group.engine_settings = None
+    adaptive_group.save()
+    registry.clear()
+    assert isinstance(registry.get_engine_for_learner(learner), NonAdaptiveEngine)
+
+
+@pytest.mark.django_db
+def test_assign_experimental_group_concurrent():
+    """
+    A learner assigned to a group by another request keeps that group
+    """
+    registry = EngineRegistry()
+    first = ExperimentalGroup.objects.create(name='first', weight=0.0)
+    ExperimentalGroup.objects.create(name='second', weight=1.0)
+    learner = Learner.objects.create(user_id='user_id', tool_consumer_instance_guid='default')
+    # learner instance loaded before the other request assigned the group
+    stale = Learner.objects.get(pk=learner.pk)
+    learner.experimental_group = first
+    learner.save()
+    registry.assign_experimental_group(stale)
+    assert stale.experimental_group_id == first.pk
+    assert Learner.objects.get(pk=learner.pk).experimental_group == first
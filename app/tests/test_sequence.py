@@ -2,7 +2,8 @@ import logging
 import random
 from time import sleep
 import pytest
-from engine.models import Collection, KnowledgeComponent, Mastery, Learner, Activity, PrerequisiteRelation
+from engine.models import (Collection, KnowledgeComponent, Mastery, Learner, Activity, PrerequisiteRelation,
+                           LearnerSequence, SequenceItem)
 from .fixtures import engine_api, sequence_test_collection
 from alosi.engine import EPSILON
 log = logging.getLogger(__name__)
@@ -71,3 +72,70 @@ def test_sequence(engine_api, sequence_test_collection):
     r = engine_api.request('POST', f'collection/{sequence_test_collection.collection_id}/grade', json=data)
     print(f'grade after sequence: {r.json()}')
     assert r.ok
+
+
+def test_server_side_sequence(engine_api, sequence_test_collection):
+    """
+    Simulates a student doing questions in a collection, with the sequence tracked server-side
+    (bridge sends only the sequence version instead of the full sequence)
+    :param engine_api: fixture returning api client
+    :param sequence_test_collection: fixture returning collection
+    """
+    collection = sequence_test_collection
+    n_activities = collection.activity_set.count()
+    LEARNER = dict(
+        user_id='my_user_id',
+        tool_consumer_instance_guid='default'
+    )
+
+    sequence_version = 0
+    recommended = []
+    for i in range(n_activities):
+        r = engine_api.request('POST', 'activity/recommend', json=dict(
+            learner=LEARNER,
+            collection=collection.collection_id,
+            sequence_version=sequence_version,
+        ))
+        assert r.ok
+        sleep(0.1)
+        assert r.json()['sequence_version'] == sequence_version + 1
+        sequence_version = r.json()['sequence_version']
+        recommended.append(r.json()['source_launch_url'])
+
+    # every activity in the collection served once, then sequence is complete
+    assert len(set(recommended)) == n_activities
+    r = engine_api.request('POST', 'activity/recommend', json=dict(
+        learner=LEARNER,
+        collection=collection.collection_id,
+        sequence_version=sequence_version,
+    ))
+    assert r.json()['complete']
+    sleep(0.1)
+
+    # stale sequence version is rejected with the current server version
+    r = engine_api.request('POST', 'activity/recommend', json=dict(
+        learner=LEARNER,
+        collection=collection.collection_id,
+        sequence_version=0,
+    ))
+    assert r.status_code == 409
+    assert r.json()['sequence_version'] == sequence_version
+
+
+@pytest.mark.django_db
+def test_record_score():
+    """
+    A score is recorded on the learner's latest unscored item for the activity, in sequences of collections that
+    contain the activity
+    """
+    learner = Learner.objects.create(user_id='user_id', tool_consumer_instance_guid='default')
+    activity = Activity.objects.create(url='http://example.com/activity')
+    collection, other_collection = [Collection.objects.create(collection_id=name, name=name) for name in 'ab']
+    collection.activity_set.add(activity)
+    sequence = LearnerSequence.objects.create(learner=learner, collection=collection)
+    other_sequence = LearnerSequence.objects.create(learner=learner, collection=other_collection)
+    other_sequence.extend([activity])
+    sequence.extend([activity, activity])
+    assert SequenceItem.record_score(learner, activity, 0.5) == 1
+    assert list(sequence.sequenceitem_set.order_by('pk').values_list('score', flat=True)) == [None, 0.5]
+    assert other_sequence.sequenceitem_set.get().score is None
@@ -0,0 +1,132 @@
+import threading
+import numpy as np
+import pytest
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from engine.engines import get_engine
+from engine.models import (Activity, ActivityKCParameter, Collection, EngineSettings, KnowledgeComponent, Learner,
+                           Mastery, PrerequisiteRelation, Score)
+from engine.simulation.bkt import random_catalog, simulate_learner
+import engine.simulation.driver
+from engine.simulation.driver import InProcessEngineClient, load_catalog, run_simulation
+from engine.simulation.sweep import load_replay_prior, load_sweep_arrays, run_sweep
+
+
+def test_simulate_learner():
+    """
+    Simulated learners who know every KC answer correctly more often than learners who know none, and their
+    tracked mastery is higher
+    """
+    rng = np.random.RandomState(0)
+    catalog = random_catalog(rng, n_activities=20, n_kcs=5, kcs_per_activity=2, n_collections=1,
+                             prerequisite_density=0.5)
+    assert np.all(np.diff(catalog.kc_indptr) == 2)
+    assert np.all(catalog.prerequisites[0] < catalog.prerequisites[1])
+    activities = np.arange(20)
+    attempts, known_scores, known_mastery = simulate_learner(rng, catalog, activities, 200, prior=1.0)
+    attempts, unknown_scores, unknown_mastery = simulate_learner(rng, catalog, activities, 5, prior=0.0)
+    assert len(attempts) == 5
+    assert set(np.unique(known_scores)) <= {0.0, 1.0}
+    assert known_scores.mean() > unknown_scores.mean()
+    assert np.all(known_mastery > 0.5)
+
+
+@pytest.mark.django_db
+def test_generate_synthetic_data():
+    """
+    generate_synthetic_data creates the requested catalog and learner data, which the engine can recommend from
+    """
+    call_command('generate_synthetic_data', activities=30, kcs=6, kcs_per_activity=2, collections=3,
+                 prerequisite_density=0.3, learners=4, scores_per_learner=5, seed=1)
+    assert Collection.objects.count() == 3
+    assert KnowledgeComponent.objects.count() == 6
+    assert Activity.objects.count() == 30
+    assert Activity.knowledge_components.through.objects.count() == 60
+    assert ActivityKCParameter.objects.filter(guess__isnull=False, slip__isnull=False, transit__isnull=False
+                                              ).count() == 60
+    assert PrerequisiteRelation.objects.count() > 0
+    assert Learner.objects.count() == 4
+    assert Score.objects.count() == 20
+    assert Mastery.objects.count() == 24
+
+    learner = Learner.objects.first()
+    collection = Score.objects.filter(learner=learner).first().activity.collections.get()
+    assert get_engine().recommend(learner, collection) in collection.activity_set.all()
+
+    with pytest.raises(CommandError):
+        call_command('generate_synthetic_data', activities=1, kcs=1, learners=1)
+
+
+@pytest.mark.django_db
+def test_run_simulation():
+    """
+    Simulated learners get recommendations and submit scores through the engine, and the report covers every request
+    """
+    call_command('generate_synthetic_data', activities=20, kcs=4, kcs_per_activity=2, collections=1,
+                 prerequisite_density=0.0, learners=0, seed=2)
+    collection = Collection.objects.get()
+    catalog, urls = load_catalog(collection)
+    assert len(urls) == 20
+    assert catalog.n_kcs == 4
+    assert np.all(np.diff(catalog.kc_indptr) == 2)
+    assert np.all((catalog.guess > 0) & (catalog.guess < 1))
+
+    engine_settings = EngineSettings.objects.create(name='simulation', r_star=0.0, L_star=2.2, W_p=5.0, W_r=3.0,
+                                                    W_c=1.0, W_d=0.5)
+    report = run_simulation(InProcessEngineClient(engine_settings), collection, n_learners=3, n_steps=4, seed=0)
+    assert Learner.objects.filter(tool_consumer_instance_guid='simulation').count() == 3
+    assert Score.objects.count() == report['outcomes']['attempts'] == 12
+    assert report['requests'] == 24
+    assert set(report['recommend_latency_ms']) == {'p50', 'p90', 'p99', 'mean'}
+    assert report['outcomes']['final_knowledge'] >= report['outcomes']['initial_knowledge']
+
+
+@pytest.mark.django_db
+def test_run_simulation_closes_worker_connections(monkeypatch):
+    """
+    Database connections of concurrent request workers are closed after each request
+    """
+    call_command('generate_synthetic_data', activities=5, kcs=2, kcs_per_activity=1, collections=1,
+                 prerequisite_density=0.0, learners=0, seed=2)
+    closed, requests = [], []
+
+    class Client(object):
+        def recommend(self, learner, collection, sequence):
+            requests.append(threading.get_ident())
+
+    class Connection(object):
+        def close(self):
+            closed.append(threading.get_ident())
+
+    monkeypatch.setattr(engine.simulation.driver, 'connection', Connection())
+    report = run_simulation(Client(), Collection.objects.get(), n_learners=4, n_steps=2, concurrency=2)
+    assert report['outcomes']['completed'] == 4
+    assert sorted(closed) == sorted(requests)
+    assert threading.get_ident() not in closed
+
+
+@pytest.mark.django_db
+def test_run_sweep():
+    """
+    Engine settings candidates are evaluated on the same population, with the same results in worker processes
+    """
+    call_command('generate_synthetic_data', activities=20, kcs=4, kcs_per_activity=2, collections=1,
+                 prerequisite_density=0.0, learners=3, scores_per_learner=2, seed=3)
+    collection = Collection.objects.get()
+    arrays = load_sweep_arrays(collection)
+    assert arrays.guess.shape == (20, 4)
+    assert np.sum(~np.isnan(arrays.guess)) == 40
+    base = dict(W_p=2.0, W_r=2.0, W_c=1.0, W_d=0.5, L_star=2.2, r_star=0.0, stop_on_mastery=False)
+    candidates = [base, dict(base, W_r=0.0), dict(base, stop_on_mastery=True, L_star=-10.0)]
+
+    results = run_sweep(arrays, candidates, n_learners=10, n_steps=5, processes=1)
+    assert [result['W_r'] for result in results] == [2.0, 0.0, 2.0]
+    assert results[0]['items_served'] == 50
+    assert 0 <= results[0]['gain_per_item'] <= 2
+    # every KC is mastered (above L_star) from the start, so no activity is valid
+    assert results[2]['items_served'] == 0
+    assert run_sweep(arrays, candidates, n_learners=10, n_steps=5, processes=2) == results
+
+    prior = load_replay_prior(collection, n_learners=10)
+    assert prior.shape == (3, 4)
+    assert run_sweep(arrays, [base], n_learners=10, n_steps=5, prior=prior, processes=1)[0]['learners'] == 3